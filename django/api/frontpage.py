@@ -7,7 +7,11 @@ from rest_framework.utils.urls import replace_query_param
 
 from apps.frontpage.models import FrontpageStory
 from apps.stories.models import Story
-from utils.serializers import CropBoxField
+from utils.serializers import (
+    CropBoxField,
+    SrcsetField,
+    ThumbnailListSerializer,
+)
 
 from .photos import ImageFile, ImageFileSerializer
 
@@ -38,6 +42,7 @@ class NestedPhotoSerializer(ImageFileSerializer):
         fields = [
             'id',
             'large',
+            'placeholder',
             'width',
             'height',
         ]
@@ -47,6 +52,7 @@ class FrontpageStorySerializer(serializers.ModelSerializer):
     """ModelSerializer for FrontpageStory"""
 
     imagefile = NestedPhotoSerializer()
+    srcset = SrcsetField(source='imagefile')
     image_id = serializers.PrimaryKeyRelatedField(
         source='imagefile',
         allow_null=True,
@@ -88,6 +94,7 @@ class FrontpageStorySerializer(serializers.ModelSerializer):
             'url',
             'imagefile',
             'image_id',
+            'srcset',
             'crop_box',
             'headline',
             'kicker',
@@ -103,6 +110,7 @@ class FrontpageStorySerializer(serializers.ModelSerializer):
             'ranking',
             'baserank',
         ]
+        list_serializer_class = ThumbnailListSerializer
 
 
 class FrontpagePaginator(pagination.LimitOffsetPagination):
@@ -162,8 +170,12 @@ class FrontpageStoryViewset(viewsets.ModelViewSet):
         if sections:
             stories = stories.filter(story_type__section__in=sections)
         if search:
-            stories = stories.search(search)
-            pks = list(stories.values_list('frontpagestory', flat=True)[:100])
+            pks = stories.cached_search(
+                search,
+                filters=[language, sections],
+                field='frontpagestory',
+                limit=100,
+            )
             order = Case(
                 *[When(pk=pk, then=pos) for pos, pk in enumerate(pks)]
             )
@@ -11,7 +11,12 @@ from url_filter.integrations.drf import DjangoFilterBackend
 from apps.contributors.models import Contributor
 from apps.photo.models import ImageFile
 from apps.photo.tasks import upload_imagefile_to_desken
-from utils.serializers import AbsoluteURLField, CropBoxField
+from utils.serializers import (
+    AbsoluteURLField,
+    CropBoxField,
+    ThumbnailListSerializer,
+    ThumbnailURLField,
+)
 
 logger = logging.getLogger('apps')
 
@@ -30,6 +35,7 @@ class ImageFileSerializer(serializers.HyperlinkedModelSerializer):
             'contributor',
             'small',
             'large',
+            'placeholder',
             # 'thumb',
             'original',
             'width',
@@ -45,7 +51,9 @@ class ImageFileSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = [
             'original',
             'artist',
+            'placeholder',
         ]
+        list_serializer_class = ThumbnailListSerializer
 
     contributor = serializers.PrimaryKeyRelatedField(
         queryset=Contributor.objects.all(),
@@ -56,8 +64,8 @@ class ImageFileSerializer(serializers.HyperlinkedModelSerializer):
     usage = serializers.IntegerField(read_only=True)
     crop_box = CropBoxField()
     original = AbsoluteURLField()
-    small = AbsoluteURLField()
-    large = AbsoluteURLField()
+    small = ThumbnailURLField('small')
+    large = ThumbnailURLField('large')
     # thumb = AbsoluteURLField()
     mimetype = serializers.SerializerMethodField()
     method = serializers.SerializerMethodField()
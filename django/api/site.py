@@ -7,6 +7,7 @@ from rest_framework import permissions, response, serializers, views
 from apps.contributors.models import Contributor
 from apps.issues.models import Issue
 from apps.stories.models import Section, StoryType
+from utils.serializers import ThumbnailListSerializer, ThumbnailURLField
 
 from .issues import IssueSerializer
 
@@ -26,9 +27,7 @@ class SectionSerializer(serializers.ModelSerializer):
 
 
 class StaffSerializer(serializers.ModelSerializer):
-    thumb = serializers.ImageField(
-        source='byline_photo.preview', read_only=True
-    )
+    thumb = ThumbnailURLField('preview', source='byline_photo')
 
     class Meta:
         model = Contributor
@@ -40,6 +39,7 @@ class StaffSerializer(serializers.ModelSerializer):
             'thumb',
             'id',
         ]
+        list_serializer_class = ThumbnailListSerializer
 
 
 class SiteData:
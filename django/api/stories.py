@@ -2,7 +2,7 @@ import logging
 
 from django.core.exceptions import FieldError
 from django.db.models import Count, Prefetch
-from rest_framework import filters, serializers, viewsets
+from rest_framework import filters, pagination, serializers, viewsets
 from url_filter.integrations.drf import DjangoFilterBackend
 
 from apps.stories.models import (
@@ -211,16 +211,64 @@ class StoryTypeViewSet(viewsets.ModelViewSet):
 class SearchFilterBackend(filters.BaseFilterBackend):
     """ Postgresql filter """
 
+    uncached_params = {'search', 'ordering', 'limit', 'offset'}
+    search_limit = 200  # top ranked matches, or more for later pages
+
+    def search_window(self, request, view):
+        """Number of top ranked matches needed for the requested page"""
+        window = self.search_limit
+        paginator = getattr(view, 'paginator', None)
+        if paginator is not None:
+            page_size = paginator.get_limit(request)
+            if page_size:
+                offset = paginator.get_offset(request)
+                window = max(window, offset + page_size)
+        return window
+
     def filter_queryset(self, request, queryset, view):
         search_query = request.query_params.get('search', None)
-        if search_query:
-            queryset = queryset.search(search_query)
-
         order_by = request.query_params.get('ordering')
         if order_by:
-            return queryset.order_by(order_by)
+            ordering = [order_by]
         else:
-            return queryset.order_by('publication_status', '-modified')
+            ordering = ['publication_status', '-modified']
+
+        if search_query:
+            filters = [
+                (key, values) for key, values in request.query_params.lists()
+                if key not in self.uncached_params
+            ]
+            filters.append(('anonymous', request.user.is_anonymous))
+            pks = queryset.cached_search(
+                search_query,
+                filters=sorted(filters),
+                limit=self.search_window(request, view),
+                order_by=ordering,
+            )
+            queryset = queryset.order_by(*ordering)
+            result = queryset.filter(pk__in=pks)
+            # used by `SearchPagination` to fetch only the current page
+            result.search_pks = pks
+            result.search_base = queryset
+            return result
+        return queryset.order_by(*ordering)
+
+
+class SearchPagination(pagination.LimitOffsetPagination):
+    """Paginate search results by slicing the cached list of primary keys,
+    so the count does not need a query, and only rows on the page are
+    fetched from the database."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        pks = getattr(queryset, 'search_pks', None)
+        if pks is None:
+            return super().paginate_queryset(queryset, request, view)
+        page = super().paginate_queryset(pks, request, view)
+        if page is None:
+            return None
+        rows = queryset.search_base.in_bulk(page)
+        # search results are already sorted, rows deleted since are skipped
+        return [rows[pk] for pk in page if pk in rows]
 
 
 class StoryViewSet(QueryOrderableViewSetMixin, viewsets.ModelViewSet):
@@ -228,6 +276,7 @@ class StoryViewSet(QueryOrderableViewSetMixin, viewsets.ModelViewSet):
 
     filter_backends = [DjangoFilterBackend, SearchFilterBackend]
     filter_fields = ['id', 'publication_status', 'modified']
+    pagination_class = SearchPagination
 
     def is_nested(self):
         return 'nested' in self.request.query_params
@@ -2,7 +2,13 @@ from rest_framework import serializers, viewsets
 from url_filter.integrations.drf import DjangoFilterBackend
 
 from apps.stories.models import StoryImage
-from utils.serializers import AbsoluteURLField, CropBoxField
+from utils.serializers import (
+    AbsoluteURLField,
+    CropBoxField,
+    SrcsetField,
+    ThumbnailListSerializer,
+    ThumbnailURLField,
+)
 
 
 class StoryImageSerializer(serializers.ModelSerializer):
@@ -12,8 +18,9 @@ class StoryImageSerializer(serializers.ModelSerializer):
         read_only=True, source='imagefile.filename'
     )
 
-    thumb = AbsoluteURLField(source='imagefile.large.url')
+    thumb = ThumbnailURLField('large', source='imagefile')
     cropped = AbsoluteURLField(read_only=True)
+    srcset = SrcsetField(source='imagefile', crop_size='crop_size')
     aspect_ratio = serializers.DecimalField(
         required=False, max_digits=5, decimal_places=4
     )
@@ -30,6 +37,7 @@ class StoryImageSerializer(serializers.ModelSerializer):
             'creditline',
             'thumb',
             'cropped',
+            'srcset',
             'filename',
             'ordering',
             'placement',
@@ -37,6 +45,7 @@ class StoryImageSerializer(serializers.ModelSerializer):
             'aspect_ratio',
             'crop_box',
         ]
+        list_serializer_class = ThumbnailListSerializer
 
 
 class StoryImageViewSet(viewsets.ModelViewSet):
@@ -34,3 +34,27 @@ def test_upload_image(staff_client, writer):
         'created',
         'contributor',
     }
+
+
+def test_upload_identical_image(staff_client, writer):
+    """Uploading an identical file returns the existing image"""
+
+    def upload():
+        data = {
+            'original': dummy_image('starwars.jpg', color='red'),
+            'description': 'Star Wars!',
+            'contributor': writer.pk,
+            'category': ImageFile.EXTERNAL,
+        }
+        return staff_client.post(api_path, data=data)
+
+    first = upload()
+    assert first.status_code == status.HTTP_201_CREATED
+    image = ImageFile.objects.get(pk=first.data['id'])
+    assert image.stat.upload_md5
+
+    count = ImageFile.objects.count()
+    second = upload()
+    assert second.status_code == status.HTTP_200_OK
+    assert second.data['id'] == image.pk
+    assert ImageFile.objects.count() == count
@@ -0,0 +1,40 @@
+from rest_framework import status
+
+from api.stories import SearchFilterBackend
+from apps.stories.models import Story
+
+api_url = '/api/stories/'
+
+
+def test_search_pagination(staff_client):
+    """Search results are paginated from the cached list of primary keys"""
+    stories = [
+        Story.objects.create(title='Studentene', lede=f'nummer {n}')
+        for n in range(5)
+    ]
+    params = {'search': 'studentene', 'limit': 2, 'ordering': 'pk'}
+    response = staff_client.get(api_url, params)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['count'] == 5
+    assert [s['id'] for s in response.data['results']
+            ] == [s.pk for s in stories[:2]]
+
+    params['offset'] = 4
+    response = staff_client.get(api_url, params)
+    assert [s['id'] for s in response.data['results']] == [stories[4].pk]
+
+    params['offset'] = 10
+    response = staff_client.get(api_url, params)
+    assert response.data['count'] == 5
+    assert response.data['results'] == []
+
+
+def test_search_window(staff_client, monkeypatch):
+    """Only the top ranked matches needed for the page are searched"""
+    monkeypatch.setattr(SearchFilterBackend, 'search_limit', 3)
+    for n in range(5):
+        Story.objects.create(title='Studentene', lede=f'nummer {n}')
+    params = {'search': 'studentene', 'limit': 2}
+    assert staff_client.get(api_url, params).data['count'] == 3
+    params['offset'] = 4
+    assert staff_client.get(api_url, params).data['count'] == 5
@@ -33,6 +33,7 @@ def test_create_new_storyimage(staff_client, scandal, scandal_photo):
         'ordering',
         'placement',
         'cropped',
+        'srcset',
     }
     assert scandal.images.count() == 1
     assert response.data.get('caption') == ''
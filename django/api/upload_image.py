@@ -2,11 +2,13 @@ import logging
 import re
 
 from django.conf import settings
-from rest_framework import mixins, permissions, serializers, viewsets
+from rest_framework import mixins, permissions, serializers, status, viewsets
 from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.response import Response
 
 from apps.contributors.models import Contributor
 from apps.photo.models import ImageFile
+from apps.photo.uploadhandler import FingerprintUploadHandler
 
 from .photos import ImageFileSerializer
 
@@ -60,3 +62,24 @@ class FileUploadViewSet(viewsets.GenericViewSet, mixins.CreateModelMixin):
     queryset = ImageFile.objects.none()
     if settings.DEBUG:
         permission_classes = [permissions.AllowAny]
+
+    def initialize_request(self, request, *args, **kwargs):
+        """Calculate md5 and imagehashes while the upload is received"""
+        request.upload_handlers = [FingerprintUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        """Return existing ImageFile if an identical file has been uploaded
+        before. Nothing is stored or processed in that case."""
+        existing = self.find_identical(request.data.get('original'))
+        if existing is None:
+            return super().create(request, *args, **kwargs)
+        logger.debug(f'upload is identical to {existing}')
+        serializer = self.get_serializer(existing)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def find_identical(self, upload):
+        fingerprint = getattr(upload, 'fingerprint', None)
+        if fingerprint is None:
+            return None
+        return ImageFile.objects.identical(fingerprint.md5).first()
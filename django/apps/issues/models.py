@@ -26,6 +26,7 @@ from wand.color import Color
 from wand.drawing import Drawing
 from wand.image import Image as WandImage
 
+from apps.photo.governor import RenderBusy, render_slots
 from utils.model_mixins import EditURLMixin
 
 logger = logging.getLogger('universitas')
@@ -104,24 +105,27 @@ def pdf_to_image(pdf, page=1, size=800, file_format='jpeg', quality=80):
         outputStream.seek(0)
     finally:
         pdf.close()
-    # put content of page in a new image
-    foreground = WandImage(
-        blob=outputStream,
-        format='pdf',
-        resolution=int(1.6 * 72 * scaleby),
-    )
-    # make sure the color space is correct.
-    # this prevents an occational bug where rgb colours are inverted
-    foreground.type = 'truecolormatte'
-    foreground.resize(*dims, 25)
-    # white background
-    background = WandImage(
-        width=foreground.width,
-        height=foreground.height,
-        background=Color('white')
-    )
-    background.format = file_format
-    background.composite(foreground, 0, 0)
+    # page is rendered at a higher resolution, then resized
+    with render_slots(tuple(int(d * 1.6) for d in dims)):
+        # put content of page in a new image
+        foreground = WandImage(
+            blob=outputStream,
+            format='pdf',
+            resolution=int(1.6 * 72 * scaleby),
+        )
+        # make sure the color space is correct.
+        # this prevents an occational bug where rgb colours are inverted
+        foreground.type = 'truecolormatte'
+        foreground.resize(*dims, 25)
+        # white background
+        background = WandImage(
+            width=foreground.width,
+            height=foreground.height,
+            background=Color('white')
+        )
+        background.format = file_format
+        background.composite(foreground, 0, 0)
+        foreground.close()
     background.compression_quality = quality
     return background
 
@@ -318,6 +322,8 @@ class PrintIssue(models.Model, EditURLMixin):
             filename = Path(self.pdf.name).with_suffix('.jpg').name
             try:
                 cover_image = pdf_to_image(self.pdf.file, page=1, size=size)
+            except RenderBusy:
+                raise  # try again later, instead of saving an error image
             except Exception as e:
                 logger.exception('Failed to create cover')
                 msg = 'ERROR:\n{}\nnot found on disk'.format(self.pdf.name)
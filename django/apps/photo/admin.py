@@ -10,7 +10,7 @@ from django.utils.translation import ugettext_lazy as _
 
 from utils.sorladmin import AdminImageMixin
 
-from .models import ImageFile
+from .models import DuplicateGroup, ImageFile
 from .tasks import upload_imagefile_to_desken
 
 logger = logging.getLogger(__name__)
@@ -80,6 +80,23 @@ def merge_photos(modeladmin, request, queryset):
 merge_photos.short_description = _('Merge photos')  # type: ignore
 
 
+def merge_duplicates(modeladmin, request, queryset):
+    merged = 0
+    for group in queryset:
+        try:
+            group.merge()
+            merged += 1
+        except Exception as err:
+            msg = f'merge of {group} failed: {err}'
+            messages.add_message(request, messages.ERROR, msg)
+    messages.add_message(
+        request, messages.INFO, f'merged {merged} groups of duplicates'
+    )
+
+
+merge_duplicates.short_description = _('Merge duplicates')  # type: ignore
+
+
 @admin.register(ImageFile)
 class ImageFileAdmin(
     AdminImageMixin,
@@ -114,3 +131,28 @@ class ImageFileAdmin(
     autocomplete_fields = [
         'contributor',
     ]
+
+
+@admin.register(DuplicateGroup)
+class DuplicateGroupAdmin(admin.ModelAdmin):
+
+    actions = [merge_duplicates]
+    actions_on_top = True
+    list_per_page = 25
+    list_filter = ['method']
+    list_display = ['id', 'created', 'method', 'distance', 'thumbs']
+    ordering = ['distance', '-created']
+    raw_id_fields = ['images']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('images')
+
+    def thumbs(self, instance):
+        return mark_safe(
+            ''.join(
+                ThumbAdmin._img_tag(image.preview.url)
+                for image in instance.images.all()
+            )
+        )
+
+    thumbs.short_description = _('images')  # type: ignore
@@ -8,3 +8,5 @@ class PhotoAppConfig(AppConfig):
 
     def ready(self):
         from . import signals  # noqa
+        from .governor import limit_imagemagick
+        limit_imagemagick()
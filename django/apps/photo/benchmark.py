@@ -0,0 +1,424 @@
+"""Benchmarks for image processing and feature detection.
+
+Each benchmark runs in a forked child process, so peak memory usage can be
+measured separately for each engine or detector.
+"""
+
+from collections import OrderedDict, namedtuple
+from functools import partial
+from io import BytesIO
+import json
+import logging
+import multiprocessing
+from pathlib import Path
+import resource
+import time
+import traceback
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import PIL.ExifTags
+import PIL.Image
+import piexif
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.helpers import get_module_class
+
+from .cropping.boundingbox import CropBox
+from .cropping.crop_detector import (
+    FaceDetector,
+    FeatureDetector,
+    HybridDetector,
+    ImagePyramid,
+    KeypointDetector,
+    MockFeatureDetector,
+    crop_box_from_features,
+)
+from .exif import clean_exif_data, parse_exif, prune_exif
+from .thumb_backend import KeepNameThumbnailBackend
+
+logger = logging.getLogger(__name__)
+
+Sample = namedtuple('Sample', 'name, category, data, crop_box')
+Result = namedtuple('Result', 'label, count, seconds, peak_rss, output_size')
+DetectorResult = namedtuple(
+    'DetectorResult',
+    'label, count, seconds, peak_rss, stages, overlap, offset',
+)
+
+# geometries and options used in the thumbnail engine benchmark
+GEOMETRIES = [
+    ('200x200', {}),
+    ('1500x1500', {'upscale': False}),
+    ('150x150', {'crop_box': True}),
+    ('800x420', {'crop_box': True}),
+    ('1200x675', {'crop_box': True, 'expand': 1}),
+]
+
+# detectors and image sizes used in the feature detection benchmark
+DETECTORS = ['face', 'keypoint', 'hybrid']
+IMAGESIZES = [200, 400, 600]
+
+
+def legacy_exif(image) -> Tuple[bytes, dict]:
+    """Exif bytes and data as they were made before `parse_exif`, by
+    parsing the exif data twice and pruning it by trial and error."""
+    exif_dict = piexif.load(image.info['exif'])
+    exif_bytes = piexif.dump(prune_exif(exif_dict))
+    data = clean_exif_data({
+        PIL.ExifTags.TAGS.get(k, str(k)): v
+        for k, v in (image._getexif() or {}).items()
+    })
+    return exif_bytes, data
+
+
+# exif parsers used in the exif benchmark
+EXIF_PARSERS = OrderedDict([
+    ('legacy', legacy_exif),
+    ('single pass', parse_exif),
+])
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_forked(func: Callable, *args):
+    """Run function in a child process, and return its result.
+
+    The function should return a Result. Its `peak_rss` is replaced with the
+    peak memory increase of the child process. Exceptions in the child are
+    raised as `RuntimeError` in the parent.
+    """
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+
+    def target():
+        try:
+            baseline = peak_rss()
+            result = func(*args)
+            result = result._replace(peak_rss=peak_rss() - baseline)
+            sender.send((result, None))
+        except Exception:
+            sender.send((None, traceback.format_exc()))
+        finally:
+            sender.close()
+
+    process = context.Process(target=target)
+    process.start()
+    sender.close()  # so recv fails instead of blocking if the child dies
+    try:
+        result, error = receiver.recv()
+    except EOFError:
+        result, error = None, 'no result'
+    finally:
+        receiver.close()
+        process.join()
+    if error:
+        raise RuntimeError(
+            f'{func.__name__} failed in child process '
+            f'(exit code {process.exitcode}): {error}'
+        )
+    return result
+
+
+def load_samples(queryset, per_category: int = 10) -> List[Sample]:
+    """Read original image data for some images of each category"""
+    samples = []
+    categories = [
+        ('photo', queryset.photos()),
+        ('diagram', queryset.diagrams() | queryset.illustrations()),
+        ('profile', queryset.profile_images()),
+    ]
+    for category, images in categories:
+        images = images.exclude(original='').exclude(original=None)
+        for image in images.order_by('-pk')[:per_category]:
+            try:
+                with image.original.open('rb') as fp:
+                    data = fp.read()
+            except (OSError, ValueError):
+                logger.exception(f'cannot read {image}')
+                continue
+            samples.append(
+                Sample(str(image), category, data, image.get_crop_box())
+            )
+    return samples
+
+
+def load_sample_files(directory: Path) -> List[Sample]:
+    """Read image files from a fixture folder. Subfolder names are used as
+    category names. A reference crop box can be stored as json in a file
+    with the same name and a `.json` suffix."""
+    samples = []
+    for path in sorted(Path(directory).glob('**/*')):
+        if path.suffix.lower() not in {'.jpg', '.jpeg', '.png'}:
+            continue
+        category = path.parent.name
+        data = path.read_bytes()
+        reference = path.with_suffix('.json')
+        if reference.exists():
+            crop_box = json.loads(reference.read_text())
+        else:
+            crop_box = CropBox.basic().serialize()
+        samples.append(Sample(path.name, category, data, crop_box))
+    return samples
+
+
+def thumbnail_options(options: dict, sample: Sample) -> dict:
+    """Full set of sorl options for a benchmark geometry"""
+    options = dict(ThumbnailBackend.default_options, **options)
+    if options.get('crop_box'):
+        options['crop_box'] = sample.crop_box
+    return options
+
+
+class MemoryThumbnail:
+    """Thumbnail file that keeps the encoded data in memory"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.data = b''
+        self.size = None
+
+    def write(self, data: bytes):
+        self.data = data or b''
+
+    def set_size(self, size):
+        self.size = size
+
+
+def benchmark_engine(
+    engine_path: str, geometry_string: str, options: dict,
+    samples: Iterable[Sample]
+) -> Result:
+    """Create thumbnails of all samples using a sorl thumbnail engine. The
+    thumbnails are rendered by the thumbnail backend, the same way as in
+    production, but not saved."""
+    backend = KeepNameThumbnailBackend()
+    engine = get_module_class(engine_path)()
+    count = output_size = 0
+    seconds = 0.0
+    for sample in samples:
+        sample_options = thumbnail_options(options, sample)
+        thumbnail = MemoryThumbnail(sample.name)
+        start = time.perf_counter()
+        image = engine.get_image(BytesIO(sample.data))
+        try:
+            backend._render_thumbnails(
+                engine, image, [(geometry_string, sample_options, thumbnail)]
+            )
+        finally:
+            engine.cleanup(image)
+        seconds += time.perf_counter() - start
+        count += 1
+        output_size += len(thumbnail.data)
+    label = f'{engine_path.split(".")[-1]} {geometry_string}'
+    return Result(label, count, seconds, 0, output_size)
+
+
+def compare_engines(
+    engines: List[str], samples: List[Sample], geometries=GEOMETRIES
+) -> List[Result]:
+    """Run thumbnail benchmark for each engine, category and geometry"""
+    results = []
+    categories = sorted({sample.category for sample in samples})
+    for geometry_string, options in geometries:
+        for category in categories:
+            group = [s for s in samples if s.category == category]
+            for engine in engines:
+                result = run_forked(
+                    benchmark_engine, engine, geometry_string, options, group
+                )
+                results.append(
+                    result._replace(label=f'{result.label} {category}')
+                )
+    return results
+
+
+def benchmark_exif(name: str, samples: Iterable[Sample],
+                   repeat: int = 10) -> Result:
+    """Parse exif data of all samples that have exif data. The output size
+    is the size of the pruned exif data."""
+    parse = EXIF_PARSERS[name]
+    count = output_size = 0
+    seconds = 0.0
+    for sample in samples:
+        image = PIL.Image.open(BytesIO(sample.data))
+        if not image.info.get('exif'):
+            continue
+        start = time.perf_counter()
+        for _ in range(repeat):
+            exif_bytes, data = parse(image)
+        seconds += (time.perf_counter() - start) / repeat
+        count += 1
+        output_size += len(exif_bytes)
+    return Result(name, count, seconds, 0, output_size)
+
+
+def compare_exif(samples: List[Sample], repeat: int = 10) -> List[Result]:
+    """Run exif benchmark for each parser and category"""
+    results = []
+    categories = sorted({sample.category for sample in samples})
+    for category in categories:
+        group = [s for s in samples if s.category == category]
+        for name in EXIF_PARSERS:
+            result = run_forked(benchmark_exif, name, group, repeat)
+            results.append(
+                result._replace(label=f'exif {result.label} {category}')
+            )
+    return results
+
+
+def make_detector(name: str, imagesize: int, n: int = 10) -> FeatureDetector:
+    """Feature detector by name. For the hybrid detector, `imagesize` is
+    used for face detection only."""
+    if name == 'face':
+        return FaceDetector(n, imagesize=imagesize)
+    if name == 'keypoint':
+        return KeypointDetector(n, imagesize=imagesize)
+    if name == 'mock':
+        return MockFeatureDetector(n, imagesize=imagesize)
+    if name == 'hybrid':
+        detector = HybridDetector(n)
+        detector.primary = FaceDetector(n, imagesize=imagesize)
+        return detector
+    raise ValueError(f'unknown detector: {name}')
+
+
+def stage_timings(detector: FeatureDetector, data: bytes) -> Dict[str, float]:
+    """Seconds spent in each stage of feature detection.
+
+    Every stage is timed, also the keypoint fallback that the hybrid
+    detector skips when it finds large faces.
+    """
+    timings = OrderedDict()  # type: Dict[str, float]
+
+    def timed(stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+        return result
+
+    pyramid = timed('decode', ImagePyramid, data)
+    if isinstance(detector, HybridDetector):
+        parts = [detector.primary, detector.fallback]
+    else:
+        parts = [detector]
+    for part in parts:
+        if isinstance(part, FaceDetector):
+            cv_image = timed('resize', pyramid.resized, part._imagesize)
+            for cascade in part._cascades:
+                detect = partial(
+                    cascade.classifier.detectMultiScale, **part._kwargs
+                )
+                timed(cascade.label, detect, cv_image)
+        elif isinstance(part, KeypointDetector):
+            cv_image = timed('resize', pyramid.resized, part._imagesize)
+            timed('ORB', part._detector.detect, cv_image)
+    return timings
+
+
+def crop_agreement(crop_box: CropBox,
+                   reference: CropBox) -> Tuple[float, float]:
+    """Compare crop boxes. Returns the intersection over union of the
+    boxes, and the distance between their points of interest."""
+    intersection = (crop_box & reference).size
+    union = crop_box.size + reference.size - intersection
+    overlap = intersection / union if union else 1.0
+    offset = ((crop_box.x - reference.x)**2 +
+              (crop_box.y - reference.y)**2)**0.5
+    return overlap, offset
+
+
+def benchmark_detector(
+    name: str, imagesize: int, samples: Iterable[Sample]
+) -> DetectorResult:
+    """Detect features in all samples, and compare the resulting crop boxes
+    with the reference crop boxes of the samples."""
+    detector = make_detector(name, imagesize)
+    count = 0
+    seconds = overlap = offset = 0.0
+    stages = OrderedDict()  # type: Dict[str, float]
+    for sample in samples:
+        start = time.perf_counter()
+        features = detector.detect_features(sample.data)
+        seconds += time.perf_counter() - start
+        for stage, elapsed in stage_timings(detector, sample.data).items():
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+        agreement = crop_agreement(
+            crop_box_from_features(features), CropBox(**sample.crop_box)
+        )
+        overlap += agreement[0]
+        offset += agreement[1]
+        count += 1
+    n = count or 1
+    return DetectorResult(
+        f'{name} {imagesize}', count, seconds, 0, stages, overlap / n,
+        offset / n
+    )
+
+
+def compare_detectors(
+    detectors: List[str],
+    samples: List[Sample],
+    imagesizes: List[int] = IMAGESIZES,
+) -> List[DetectorResult]:
+    """Run feature detection benchmark for each detector, image size and
+    category"""
+    results = []
+    categories = sorted({sample.category for sample in samples})
+    for category in categories:
+        group = [s for s in samples if s.category == category]
+        for detector in detectors:
+            for imagesize in imagesizes:
+                result = run_forked(
+                    benchmark_detector, detector, imagesize, group
+                )
+                results.append(
+                    result._replace(label=f'{result.label} {category}')
+                )
+    return results
+
+
+def format_detector_results(results: List[DetectorResult]) -> str:
+    """Detector results as text table, with milliseconds per image spent in
+    each stage"""
+    header = ('benchmark', 'count', 'images/s', 'peak rss MB', 'overlap',
+              'offset', 'stages ms/item')
+    lines = ['{:<30} {:>6} {:>9} {:>12} {:>8} {:>7}  {}'.format(*header)]
+    for result in results:
+        count = result.count or 1
+        stages = ', '.join(
+            f'{stage}: {1000 * seconds / count:.1f}'
+            for stage, seconds in result.stages.items()
+        )
+        lines.append(
+            '{:<30} {:>6} {:>9.1f} {:>12.1f} {:>8.2f} {:>7.3f}  {}'.format(
+                result.label,
+                result.count,
+                result.count / result.seconds if result.seconds else 0,
+                result.peak_rss / 2**20,
+                result.overlap,
+                result.offset,
+                stages,
+            )
+        )
+    return '\n'.join(lines)
+
+
+def format_results(results: List[Result]) -> str:
+    """Results as text table"""
+    header = ('benchmark', 'count', 'ms/item', 'peak rss MB', 'output kB')
+    lines = ['{:<45} {:>6} {:>10} {:>12} {:>10}'.format(*header)]
+    for result in results:
+        count = result.count or 1
+        lines.append(
+            '{:<45} {:>6} {:>10.1f} {:>12.1f} {:>10.1f}'.format(
+                result.label,
+                result.count,
+                1000 * result.seconds / count,
+                result.peak_rss / 2**20,
+                result.output_size / count / 2**10,
+            )
+        )
+    return '\n'.join(lines)
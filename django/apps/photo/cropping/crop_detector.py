@@ -1,16 +1,54 @@
 import abc
 from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Union
+from typing import Dict, List, Union
 
 import cv2
 import numpy
 from numpy import ndarray as CVImage
 
-from .boundingbox import Box
+from .boundingbox import Box, CropBox
+
+
+class ImagePyramid:
+    """Grayscale image that is decoded once, with cached resized versions.
+
+    Detectors that work on different image sizes can share a pyramid, so
+    the source image is only decoded once.
+    """
+
+    def __init__(self, source: Union[Path, bytes, CVImage]) -> None:
+        if isinstance(source, Path):
+            assert source.exists(), 'file {} not found'.format(source)
+            source = source.read_bytes()
+        if isinstance(source, numpy.ndarray):  # already decoded grayscale
+            self.image = source
+        elif isinstance(source, bytes):
+            data = numpy.frombuffer(source, numpy.uint8)
+            self.image = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+        else:
+            raise TypeError('incorrect type')
+        if self.image is None:
+            raise ValueError('cannot decode image')
+        self._levels = {}  # type: Dict[int, CVImage]
+
+    def resized(self, size: int = 0) -> CVImage:
+        """Image resized to an area of about size * size pixels"""
+        if size <= 0:
+            return self.image
+        if size not in self._levels:
+            w, h = self.image.shape[1::-1]  # type: int, int
+            multiplier = (size**2 / (w * h))**0.5
+            dimensions = tuple(int(round(d * multiplier)) for d in (w, h))
+            self._levels[size] = cv2.resize(
+                self.image, dimensions, interpolation=cv2.INTER_AREA
+            )
+        return self._levels[size]
+
 
 # type annotation aliases
-Image = Union[Path, bytes]
+Image = Union[Path, bytes, ImagePyramid]
 
 
 def get_haarcascade(filename: str) -> Path:
@@ -96,23 +134,9 @@ class FeatureDetector(abc.ABC):
         numpy array integers where 0 is black and 255 is
         white. Color images will be converted to grayscale.
         """
-        if isinstance(source, Path):
-            assert source.exists(), 'file {} not found'.format(source)
-            source = source.read_bytes()
-        if not isinstance(source, bytes):
-            raise TypeError('incorrect type')
-
-        data = numpy.frombuffer(source, numpy.uint8)
-        cv_image = cv2.imdecode(data, cv2.IMREAD_COLOR)
-        cv_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
-        if resize > 0:
-            w, h = cv_image.shape[1::-1]  # type: int, int
-            multiplier = (resize**2 / (w * h))**0.5
-            dimensions = tuple(int(round(d * multiplier)) for d in (w, h))
-            cv_image = cv2.resize(
-                cv_image, dimensions, interpolation=cv2.INTER_AREA
-            )
-        return cv_image
+        if not isinstance(source, ImagePyramid):
+            source = ImagePyramid(source)
+        return source.resized(resize)
 
     @staticmethod
     def _resize_feature(feature: Feature, cv_image: CVImage) -> Feature:
@@ -309,8 +333,25 @@ class HybridDetector(FeatureDetector):
 
     def detect_features(self, source: Image) -> List[Feature]:
         """Find faces and/or keypoints in the image."""
+        if not isinstance(source, ImagePyramid):
+            source = ImagePyramid(source)  # decode once for both detectors
         faces = self.primary.detect_features(source)
         if sum(faces, Box(0, 0, 0, 0)).size > self.breakpoint:
             return faces
         features = faces + self.fallback.detect_features(source)
         return features[:self._number]
+
+
+def crop_box_from_features(features: List[Feature]) -> CropBox:
+    """Crop box containing all features, centered on the strongest one"""
+    if not features:
+        return CropBox.basic()
+    x, y = features[0].center
+    left, top, right, bottom = sum(features)  # type: ignore
+    return CropBox(left, top, right, bottom, x, y)
+
+
+@lru_cache(maxsize=None)
+def shared_detector(n: int = 10) -> HybridDetector:
+    """HybridDetector that is reused for the lifetime of the worker process"""
+    return HybridDetector(n=n)
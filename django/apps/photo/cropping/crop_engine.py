@@ -1,8 +1,21 @@
+from io import BytesIO
 import logging
 
+from PIL import Image
+import numpy
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.engines.pil_engine import Engine as PILEngine
 from sorl.thumbnail.engines.wand_engine import Engine as WandEngine
 from wand.color import Color
 
+from ..file_operations import get_orientation, rotate_upright
+from ..quality import (
+    SEARCH_FORMATS,
+    cache_quality,
+    cached_qualities,
+    grayscale,
+    search_quality,
+)
 from .boundingbox import Box, CropBox
 
 logger = logging.getLogger(__name__)
@@ -52,18 +65,86 @@ def calculate_crop(width, height, crop_width, crop_height, crop_box, exp):
     )
 
 
-class CloseCropEngine(WandEngine):
+def pop_crop_options(options):
+    """Remove crop box and expand options that sorl does not understand"""
+    cropbox = options.pop('crop_box', None)
+    try:
+        # expand cropbox area
+        expand = float(options.pop('expand', 0))
+    except TypeError:
+        expand = 0.0
+    return cropbox, expand
+
+
+def draft_size(width, height, geometry, crop=None):
+    """Smallest size of the full image that can be used to render a thumbnail
+    of `geometry` without upscaling."""
+    if crop is None:
+        factor = min(geometry[0] / width, geometry[1] / height)
+    else:
+        factor = max(geometry[0] / crop.width, geometry[1] / crop.height)
+    if factor >= 1:
+        return width, height
+    return int(width * factor + 1), int(height * factor + 1)
+
+
+class QualitySearchMixin:
+    """Encode jpeg and webp thumbnails with the lowest quality that reaches
+    `THUMBNAIL_TARGET_SSIM`, instead of `THUMBNAIL_QUALITY`. Disabled when
+    the setting is `None`."""
+
+    def write(self, image, options, thumbnail):
+        target = getattr(settings, 'THUMBNAIL_TARGET_SSIM', None)
+        format_ = options['format']
+        if not target or format_ not in SEARCH_FORMATS:
+            return super().write(image, options, thumbnail)
+        image_info = options.get('image_info', {})
+        progressive = options.get(
+            'progressive', settings.THUMBNAIL_PROGRESSIVE
+        )
+
+        def encode(quality):
+            return self._get_raw_data(
+                image,
+                format_,
+                quality,
+                image_info=image_info,
+                progressive=progressive,
+            )
+
+        # set by the thumbnail backend when several sizes are created
+        source_key = options.get('source_key')
+        quality, raw_data = search_quality(
+            encode,
+            reference=self.grayscale(image),
+            target=target,
+            guess=cached_qualities(source_key).get(format_),
+        )
+        cache_quality(source_key, format_, quality)
+        logger.debug(f'{thumbnail.name} quality {quality}')
+        thumbnail.write(raw_data)
+
+    def grayscale(self, image):
+        """Uncompressed thumbnail as a grayscale array. Engines can override
+        this with something faster than a png round trip."""
+        return grayscale(self._get_raw_data(image, 'PNG', 100, image_info={}))
+
+
+class CloseCropEngine(QualitySearchMixin, WandEngine):
     """Sorl thumbnail crop engine"""
 
+    def copy_image(self, image):
+        """Copy of decoded image, so it can be reused for several thumbs"""
+        return image.clone()
+
+    def cleanup(self, image):
+        """Release ImageMagick memory"""
+        image.close()
+
     def create(self, image, geometry, options):
 
-        cropbox = options.pop('crop_box', None)
+        cropbox, expand = pop_crop_options(options)
         if cropbox:
-            try:
-                # expand cropbox area
-                expand = float(options.pop('expand', 0))
-            except TypeError:
-                expand = 0.0
             new_geometry = calculate_crop(
                 image.width,
                 image.height,
@@ -79,3 +160,83 @@ class CloseCropEngine(WandEngine):
         image.alpha_channel = 'remove'
 
         return super().create(image, geometry, options)
+
+    def grayscale(self, image):
+        with Image.open(BytesIO(image.make_blob('pgm'))) as gray:
+            return numpy.asarray(gray.convert('L'))
+
+
+class PillowCloseCropEngine(QualitySearchMixin, PILEngine):
+    """Sorl thumbnail crop engine using Pillow instead of ImageMagick.
+
+    Jpeg files are decoded at reduced size with Pillow's draft mode when all
+    thumbnails are much smaller than the original, see `draft`.
+    """
+
+    def copy_image(self, image):
+        """Copy of decoded image, so it can be reused for several thumbs.
+        The copy has no exif data, so it is rotated upright here, before the
+        crop box is applied."""
+        orientation = get_orientation(image)
+        return rotate_upright(image.copy(), orientation)
+
+    def cleanup(self, image):
+        image.close()
+
+    def grayscale(self, image):
+        return numpy.asarray(image.convert('L'))
+
+    def draft(self, image, renditions):
+        """Decode a jpeg image at the smallest scale that is large enough for
+        all renditions, given as `(geometry, options)` pairs. Only has effect
+        before the image is loaded, so it must be called before
+        `copy_image`."""
+        if not renditions or get_orientation(image) > 4:
+            return  # geometry of rotated images is transposed
+        width, height = image.size
+        sizes = []
+        for geometry, options in renditions:
+            crop = None
+            if options.get('crop_box'):
+                crop = calculate_crop(
+                    width,
+                    height,
+                    geometry[0],
+                    geometry[1],
+                    options['crop_box'],
+                    float(options.get('expand') or 0),
+                )
+            sizes.append(draft_size(width, height, geometry, crop))
+        size = max(w for w, h in sizes), max(h for w, h in sizes)
+        if size != image.size:
+            image.draft(image.mode, size)
+
+    def create(self, image, geometry, options):
+
+        cropbox, expand = pop_crop_options(options)
+        if cropbox:
+            crop_to = calculate_crop(
+                image.width,
+                image.height,
+                geometry[0],
+                geometry[1],
+                cropbox,
+                expand,
+            )
+            image = image.crop(tuple(crop_to))  # close crop
+
+        image = self._remove_alpha(image)
+
+        return super().create(image, geometry, options)
+
+    def _remove_alpha(self, image):
+        """Flatten transparent image on a white background"""
+        transparent = image.mode in ('RGBA', 'LA') or (
+            image.mode == 'P' and 'transparency' in image.info
+        )
+        if not transparent:
+            return image
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.split()[-1])
+        return background
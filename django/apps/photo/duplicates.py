@@ -0,0 +1,149 @@
+"""Find groups of duplicate images in the whole photo archive.
+
+Identical files are found by md5. Visually similar images are found with a
+multi-index of perceptual hashes: each 64 bit hash is split into 16 bit
+chunks, and only images that share at least one chunk value are compared.
+Two hashes with a hamming distance of 3 or less always share a chunk, so
+this finds almost all duplicates without comparing all pairs of images.
+"""
+
+from collections import defaultdict, namedtuple
+from itertools import combinations
+import logging
+from typing import Dict, Iterator, List, Set, Tuple
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.fields.jsonb import KeyTextTransform
+from django.db.models import Count
+import numpy
+
+from .hashindex import ImageHashIndex, combined_distance, hamming_distances
+
+logger = logging.getLogger(__name__)
+
+CHUNK_BITS = 16
+MAX_BUCKET = 500  # skip chunk values shared by too many images
+Cluster = namedtuple('Cluster', 'pks, method, distance')
+
+
+class DuplicateGraph:
+    """Pairs of duplicate images, grouped around center images.
+
+    Similarity is not transitive, so a chain of similar images is not
+    grouped together. Each group is a center image and its duplicates.
+    """
+
+    def __init__(self) -> None:
+        # pk -> {pk: method}
+        self._edges = defaultdict(dict)  # type: Dict[int, Dict[int, str]]
+
+    def add(self, a: int, b: int, method: str):
+        if a == b:
+            return
+        if self._edges[a].get(b) != 'md5':  # identical files win
+            self._edges[a][b] = self._edges[b][a] = method
+
+    def groups(self) -> List[Tuple[List[int], str]]:
+        """Groups as (pks, method) tuples. Images with most duplicates are
+        used as centers first, and each image is in at most one group."""
+        assigned = set()  # type: Set[int]
+        groups = []
+        for center in sorted(self._edges, key=self._centrality):
+            if center in assigned:
+                continue
+            members = {
+                pk: method
+                for pk, method in self._edges[center].items()
+                if pk not in assigned
+            }
+            if not members:
+                continue
+            assigned.add(center)
+            assigned.update(members)
+            methods = set(members.values())
+            groups.append((
+                sorted([center, *members]),
+                'md5' if methods == {'md5'} else 'imagehash',
+            ))
+        return groups
+
+    def _centrality(self, pk: int) -> Tuple[int, int]:
+        return -len(self._edges[pk]), pk
+
+
+def md5_duplicates(queryset) -> Iterator[List[int]]:
+    """Groups of primary keys of images with identical md5"""
+    groups = queryset.annotate(md5=KeyTextTransform('md5', 'stat')).exclude(
+        md5=None
+    ).values('md5').annotate(
+        count=Count('pk'),
+        pks=ArrayAgg('pk'),
+    ).filter(count__gt=1).values_list('pks', flat=True)
+    yield from groups.iterator()
+
+
+def chunk_buckets(hashes: numpy.ndarray) -> Iterator[numpy.ndarray]:
+    """Row numbers of hashes that share a chunk value"""
+    mask = numpy.uint64(2**CHUNK_BITS - 1)
+    for column in hashes.T:
+        for shift in range(0, 64, CHUNK_BITS):
+            chunks = (column >> numpy.uint64(shift)) & mask
+            order = numpy.argsort(chunks, kind='mergesort')
+            edges = numpy.flatnonzero(numpy.diff(chunks[order])) + 1
+            for rows in numpy.split(order, edges):
+                if 1 < len(rows) <= MAX_BUCKET:
+                    yield rows
+                elif len(rows) > MAX_BUCKET:
+                    logger.debug(f'skipped bucket of {len(rows)} images')
+
+
+def imagehash_duplicates(
+    pks: numpy.ndarray, hashes: numpy.ndarray, cutoff: int = 8
+) -> Iterator[Tuple[int, int, int]]:
+    """Pairs of similar images as (pk, pk, distance) tuples. Each pair is
+    yielded once, even if the images share several chunks."""
+    seen = set()  # type: Set[Tuple[int, int]]
+    for rows in chunk_buckets(hashes):
+        bucket = hashes[rows]
+        for n in range(len(rows) - 1):
+            distances = combined_distance(
+                hamming_distances(bucket[n + 1:], bucket[n])
+            )
+            for m in numpy.flatnonzero(distances < cutoff):
+                a, b = int(pks[rows[n]]), int(pks[rows[n + 1 + m]])
+                pair = (a, b) if a < b else (b, a)
+                if pair not in seen:
+                    seen.add(pair)
+                    yield a, b, int(distances[m])
+
+
+def diameter(hashes: numpy.ndarray) -> int:
+    """Largest distance between any two of the hashes"""
+    distances = [
+        combined_distance(hamming_distances(hashes[n + 1:], hashes[n]))
+        for n in range(len(hashes) - 1)
+    ]
+    return int(max((d.max() for d in distances), default=0))
+
+
+def find_duplicates(queryset, cutoff: int = 8) -> List[Cluster]:
+    """Group all images in queryset into groups of duplicates. All images in
+    a group are duplicates of the group's center image."""
+    graph = DuplicateGraph()
+    for group in md5_duplicates(queryset):
+        for a, b in combinations(group, 2):
+            graph.add(a, b, 'md5')
+
+    index = ImageHashIndex()
+    pks, hashes = index.arrays()
+    selected = numpy.isin(pks, list(queryset.values_list('pk', flat=True)))
+    pks, hashes = pks[selected], hashes[selected]
+    for a, b, distance in imagehash_duplicates(pks, hashes, cutoff):
+        graph.add(a, b, 'imagehash')
+
+    clusters = []
+    for members, method in graph.groups():
+        rows = numpy.isin(pks, members)
+        clusters.append(Cluster(members, method, diameter(hashes[rows])))
+    logger.info(f'found {len(clusters)} groups of duplicate images')
+    return clusters
@@ -4,6 +4,7 @@ from collections import namedtuple
 from datetime import datetime
 import logging
 import string
+import struct
 from typing import Any, Union
 
 import PIL.ExifTags
@@ -11,34 +12,133 @@ from PIL.Image import Image
 from django.utils import timezone
 import ftfy
 import piexif
+from piexif import TAGS, TYPES, ExifIFD, ImageIFD
 
 logger = logging.getLogger(__name__)
 
+ParsedExif = namedtuple('ParsedExif', 'exif_bytes, data')
+
+# value ranges of the integer exif types
+INTEGER_RANGES = {
+    TYPES.Byte: (0, 2**8),
+    TYPES.Short: (0, 2**16),
+    TYPES.Long: (0, 2**32),
+    TYPES.SByte: (-2**7, 2**7),
+    TYPES.SShort: (-2**15, 2**15),
+    TYPES.SLong: (-2**31, 2**31),
+}
+RATIONAL_RANGES = {
+    TYPES.Rational: INTEGER_RANGES[TYPES.Long],
+    TYPES.SRational: INTEGER_RANGES[TYPES.SLong],
+}
+# offsets to other sections are written by piexif.dump
+POINTER_TAGS = {
+    ImageIFD.ExifTag,
+    ImageIFD.GPSTag,
+    ExifIFD.InteroperabilityTag,
+}
+
+
+def parse_exif(img: Image, maxbytes=1000) -> ParsedExif:
+    """Parse exif data of image file once.
+
+    Returns pruned exif bytes to embed in the processed image, and a json
+    serializable dictionary of the exif tags. Tags that do not match the
+    type of the exif standard, or are bigger than `maxbytes`, are dropped.
+    The thumbnail is removed, and rotation is unset in the pruned bytes.
+    """
+    raw = img.info.get('exif')
+    if not raw:
+        return ParsedExif(b'', {})
+    try:
+        exif_dict = piexif.load(raw)
+    except (ValueError, struct.error, IndexError):
+        logger.warning('cannot parse exif data', exc_info=True)
+        return ParsedExif(b'', {})
+
+    pruned = {}  # type: dict
+    data = {}  # type: dict
+    for section in ['0th', 'Exif', 'GPS', 'Interop']:
+        tags = pruned[section] = {}
+        for tag, value in exif_dict[section].items():
+            if tag in POINTER_TAGS:
+                continue
+            value_type = TAGS[section][tag]['type']
+            if not valid_exif_value(value, value_type, maxbytes):
+                logger.debug(f'invalid exif tag {section} {tag}: {value!r}')
+                continue
+            tags[tag] = value
+            if section in ('0th', 'Exif'):
+                name = PIL.ExifTags.TAGS.get(tag, str(tag))
+                data[name] = clean_exif_value(value, value_type)
+            elif section == 'GPS':
+                gps = data.setdefault('GPSInfo', {})
+                gps[str(tag)] = clean_exif_value(value, value_type)
+
+    # unset image rotation
+    pruned['0th'][ImageIFD.Orientation] = 1
+    try:
+        exif_bytes = piexif.dump(pruned)
+    except (ValueError, struct.error):
+        logger.warning('cannot dump exif data', exc_info=True)
+        exif_bytes = b''
+    return ParsedExif(exif_bytes, data)
+
+
+def valid_exif_value(value: Any, value_type: int, maxbytes=1000) -> bool:
+    """Check that value can be written as the given exif type"""
+    if isinstance(value, (bytes, tuple)) and len(value) > maxbytes:
+        return False
+    if value_type in (TYPES.Ascii, TYPES.Undefined):
+        return isinstance(value, bytes)
+    if value_type in (TYPES.Float, TYPES.DFloat):
+        values = value if isinstance(value, tuple) else (value, )
+        return all(isinstance(v, float) for v in values)
+    if value_type in RATIONAL_RANGES:
+        low, high = RATIONAL_RANGES[value_type]
+        if value and isinstance(value, tuple) and isinstance(value[0], int):
+            value = (value, )
+        return isinstance(value, tuple) and bool(value) and all(
+            isinstance(pair, tuple) and len(pair) == 2 and
+            all(isinstance(n, int) and low <= n < high for n in pair)
+            for pair in value
+        )
+    if value_type in INTEGER_RANGES:
+        low, high = INTEGER_RANGES[value_type]
+        values = value if isinstance(value, tuple) else (value, )
+        return all(isinstance(v, int) and low <= v < high for v in values)
+    return False
+
+
+def clean_exif_value(value: Any, value_type: int) -> Any:
+    """Make a single exif value serializable"""
+    if value_type != TYPES.Ascii:
+        return clean_exif_data(value)
+    try:
+        text = value.decode('utf8')
+    except UnicodeError:
+        text = value.decode('latin1')
+    text = text.replace('\x00', '').strip()
+    try:
+        return parse_exif_timestamp(text)
+    except ValueError:
+        return text
+
 
 def sanitize_image_exif(img: Image) -> bytes:
     """Prune thumbnail and other excessive exif data from image file."""
-    exif_bytes = img.info.get('exif')
-    if not exif_bytes:
-        return b''
-    exif_dict = piexif.load(exif_bytes)
-    pruned_dict = prune_exif(exif_dict)
-    return piexif.dump(pruned_dict)
+    return parse_exif(img).exif_bytes
 
 
 def serialize_exif(img: Image) -> dict:
     """Get exif dictionary from pil image   """
-    try:
-        tags = img._getexif() or {}
-    except AttributeError:
-        return {}
-    return clean_exif_data({
-        PIL.ExifTags.TAGS.get(k, str(k)): v
-        for k, v in tags.items()
-    })
+    return parse_exif(img).data
 
 
 def prune_exif(exif_dict: dict, maxbytes=1000) -> dict:
-    """Remove non-standard and bloated exif data."""
+    """Remove non-standard and bloated exif data by trial and error.
+
+    Superseded by `parse_exif`, kept for the exif benchmark."""
     # remove thumbnail binary data to save space
     del exif_dict['thumbnail']
     # remove gps data?
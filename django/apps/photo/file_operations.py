@@ -1,9 +1,12 @@
 import base64
+from collections import namedtuple
+from functools import partial
 import hashlib
 from io import BytesIO
 import logging
 from pathlib import Path
-from typing import Dict, Union
+import tempfile
+from typing import Dict, Iterator, Union
 
 import PIL
 from django.core.files import File as DjangoFile
@@ -17,6 +20,17 @@ except ImportError:
 logger = logging.getLogger(__name__)
 Fileish = Union[str, bytes, Path, DjangoFile]
 FINGERPRINT_SIZE = 16
+CHUNK_SIZE = 2**16  # 64 kB
+SPOOL_SIZE = 2**22  # keep files up to 4 MB in memory while streaming
+DRAFT_SIZE = 200  # similar to the `small` thumbnail used for imagehashes
+PLACEHOLDER_SIZE = 16  # longest side of placeholder image
+PLACEHOLDER_QUALITY = 40
+EXIF_ORIENTATION = 0x0112
+ROTATIONS = {3: 180, 6: 270, 8: 90}  # degrees by exif orientation
+
+Fingerprint = namedtuple(
+    'Fingerprint', 'md5, size, mimetype, imagehashes, placeholder'
+)
 
 
 def image_from_fingerprint(fingerprint):
@@ -33,6 +47,27 @@ def image_to_fingerprint(image, size=FINGERPRINT_SIZE):
     return base64.b64encode(bytes(data)).decode()
 
 
+def image_to_placeholder(image, size=PLACEHOLDER_SIZE) -> str:
+    """Tiny version of image as a data uri, to show in html while the real
+    image is loading. Uses webp if Pillow supports it."""
+    try:
+        thumb = image.convert('RGBA')
+        thumb.thumbnail((size, size), PIL.Image.BILINEAR)
+    except OSError:  # corrupt image file probably
+        return ''
+    background = PIL.Image.new('RGB', thumb.size, 'white')
+    background.paste(thumb, mask=thumb.split()[-1])
+    for file_format in ['webp', 'jpeg']:
+        blob = BytesIO()
+        try:
+            background.save(blob, file_format, quality=PLACEHOLDER_QUALITY)
+        except (KeyError, OSError):  # no encoder for this format
+            continue
+        data = base64.b64encode(blob.getvalue()).decode()
+        return f'data:image/{file_format};base64,{data}'
+    return ''
+
+
 def read_data(value: Fileish) -> bytes:
     """Read raw data from Fileish like object"""
     if isinstance(value, str):
@@ -54,6 +89,21 @@ def read_data(value: Fileish) -> bytes:
     #     return value.read()
 
 
+def iter_chunks(value: Fileish, chunk_size=CHUNK_SIZE) -> Iterator[bytes]:
+    """Read Fileish like object in chunks"""
+    if isinstance(value, (str, Path)):
+        with open(value, 'rb') as fp:
+            yield from iter(partial(fp.read, chunk_size), b'')
+    elif isinstance(value, bytes):
+        for start in range(0, len(value), chunk_size):
+            yield value[start:start + chunk_size]
+    elif isinstance(value, DjangoFile):
+        value.open('rb')
+        yield from value.chunks(chunk_size)
+    else:
+        yield from iter(partial(value.read, chunk_size), b'')
+
+
 def pil_image(fp: Fileish) -> PIL.Image.Image:
     if isinstance(fp, PIL.Image.Image):
         return fp
@@ -114,10 +164,84 @@ def get_exif(fp: Fileish) -> dict:
     return {}
 
 
+def get_orientation(img: PIL.Image.Image) -> int:
+    """Exif orientation of image, 1 is upright"""
+    try:
+        return (img._getexif() or {}).get(EXIF_ORIENTATION, 1)
+    except AttributeError:
+        return 1  # file format has no exif
+    except Exception:
+        logger.exception('Cannot extract exif orientation')
+        return 1
+
+
+def rotate_upright(img: PIL.Image.Image, orientation: int) -> PIL.Image.Image:
+    """Rotate image by exif orientation, same as the processed original"""
+    degrees = ROTATIONS.get(orientation)
+    if degrees:
+        img = img.rotate(degrees, expand=True)
+    return img
+
+
 def get_mimetype(fp: Fileish) -> str:
     return PIL.Image.MIME.get(pil_image(fp).format)
 
 
+class StreamingFingerprint:
+    """Fingerprint of a file that is received in chunks.
+
+    The md5 and size are updated with each chunk. The image is decoded at
+    reduced size when the complete file is available, and rotated by its exif
+    orientation, so the imagehashes and placeholder match the processed
+    original.
+    """
+
+    def __init__(self):
+        self._hasher = hashlib.md5()
+        self.size = 0
+
+    def update(self, chunk: bytes):
+        self._hasher.update(chunk)
+        self.size += len(chunk)
+
+    def finish(self, fp, size=FINGERPRINT_SIZE) -> Fingerprint:
+        """Fingerprint of the complete file `fp`"""
+        fp.seek(0)
+        try:
+            img = PIL.Image.open(fp)  # reads file header only
+            mimetype = PIL.Image.MIME.get(img.format)
+            orientation = get_orientation(img)
+            img.draft('RGB', (DRAFT_SIZE, DRAFT_SIZE))
+            img = rotate_upright(img, orientation)
+            imagehashes = get_imagehashes(img, size)
+            placeholder = image_to_placeholder(img)
+        except (OSError, PIL.Image.DecompressionBombError):
+            # not an image file, or too large to decode safely
+            mimetype, imagehashes, placeholder = None, {}, ''
+        return Fingerprint(
+            md5=self._hasher.hexdigest(),
+            size=self.size,
+            mimetype=mimetype,
+            imagehashes=imagehashes,
+            placeholder=placeholder,
+        )
+
+
+def fingerprint_file(value: Fileish, size=FINGERPRINT_SIZE) -> Fingerprint:
+    """Read file once to find md5, file size, mimetype, imagehashes and
+    placeholder.
+
+    The file is streamed in chunks into a spooled temporary file, so large
+    files are not kept in memory. The image is decoded at reduced size.
+    """
+    fingerprint = StreamingFingerprint()
+    with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as spool:
+        for chunk in iter_chunks(value):
+            fingerprint.update(chunk)
+            spool.write(chunk)
+        return fingerprint.finish(spool, size)
+
+
 def s3_md5(s3key):
     """Hexadecimal md5 hash of a Fileish stored in Amazon S3"""
     return s3key.etag.strip('"').strip("'")
@@ -0,0 +1,108 @@
+"""Limit the memory used for image rendering on each host.
+
+Decoding and resizing a large image with ImageMagick or Pillow can take
+hundreds of megabytes, and both web and celery workers render images. All
+workers on a host share a memory budget that is divided into slots. A render
+holds a number of slots in proportion to the pixel area of the image, and
+waits until enough slots are free. The slots are `flock` locks on files in a
+directory that is shared by all containers on the host, so they are released
+even if a worker is killed.
+"""
+
+from contextlib import contextmanager
+import fcntl
+from io import BytesIO
+import logging
+import math
+import os
+from pathlib import Path
+import random
+import time
+from typing import List, Optional, Tuple
+
+from PIL import Image
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BYTES_PER_PIXEL = 8  # ImageMagick uses 16 bits per channel
+POLL_INTERVAL = 0.2  # seconds between attempts to get slots
+
+
+class RenderBusy(Exception):
+    """Not enough free memory to render an image before the timeout"""
+
+
+def limit_imagemagick():
+    """Make ImageMagick use its disk cache for images that do not fit in the
+    memory budget. The limits are read from the environment when the first
+    image is created in a process, so this must be called before that."""
+    memory = settings.IMAGE_RENDER_MEMORY
+    os.environ.setdefault('MAGICK_MEMORY_LIMIT', str(memory))
+    os.environ.setdefault('MAGICK_MAP_LIMIT', str(memory))
+    os.environ.setdefault('MAGICK_AREA_LIMIT', str(memory // BYTES_PER_PIXEL))
+
+
+def image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Width and height from the image header, without decoding the image"""
+    try:
+        with Image.open(BytesIO(data)) as image:
+            return image.size
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def slots_needed(width: int, height: int) -> int:
+    """Number of slots to render an image of this size"""
+    total = settings.IMAGE_RENDER_SLOTS
+    slot_bytes = settings.IMAGE_RENDER_MEMORY / total
+    needed = math.ceil(width * height * BYTES_PER_PIXEL / slot_bytes)
+    return min(max(needed, 1), total)
+
+
+def _lock_slots(count: int) -> Optional[List[int]]:
+    """Lock `count` free slots. Returns file descriptors of the lock files,
+    or `None` if not enough slots are free."""
+    lock_dir = Path(settings.IMAGE_RENDER_LOCK_DIR)
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    slots = list(range(settings.IMAGE_RENDER_SLOTS))
+    random.shuffle(slots)  # spread out small renders
+    held = []  # type: List[int]
+    for slot in slots:
+        fd = os.open(str(lock_dir / f'slot-{slot}'), os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        held.append(fd)
+        if len(held) == count:
+            return held
+    for fd in held:
+        os.close(fd)  # closing the file releases the lock
+    return None
+
+
+@contextmanager
+def render_slots(size: Optional[Tuple[int, int]], timeout: float = None):
+    """Hold enough slots to render an image of `size`. An image of unknown
+    size takes all slots. Raises `RenderBusy` if not enough slots are free
+    within `timeout` seconds."""
+    if size is None:
+        count = settings.IMAGE_RENDER_SLOTS
+    else:
+        count = slots_needed(*size)
+    if timeout is None:
+        timeout = settings.IMAGE_RENDER_TIMEOUT
+    deadline = time.monotonic() + timeout
+    held = _lock_slots(count)
+    while held is None:
+        if time.monotonic() > deadline:
+            raise RenderBusy(f'no memory to render image of size {size}')
+        time.sleep(POLL_INTERVAL)
+        held = _lock_slots(count)
+    try:
+        yield count
+    finally:
+        for fd in held:
+            os.close(fd)
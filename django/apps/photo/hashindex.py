@@ -0,0 +1,284 @@
+"""In memory index of perceptual image hashes.
+
+All image hashes are packed into a numpy array of 64 bit integers, so the
+hamming distance to every ImageFile can be calculated with vectorized xor
+and bit counting.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+from django.apps import apps
+from django.contrib.postgres.fields.jsonb import KeyTextTransform
+from django.utils import timezone
+import numpy
+from sorl.thumbnail import default
+
+logger = logging.getLogger(__name__)
+
+HASH_TYPES = 'ahash', 'dhash', 'phash', 'whash'
+
+# number of set bits in each byte value
+POPCOUNT = numpy.array([bin(n).count('1') for n in range(256)], numpy.uint8)
+
+
+def hash_to_int(value) -> int:
+    """Convert ImageHash or hexadecimal string to integer"""
+    return int(str(value), 16)
+
+
+def hash_row(hashes: Mapping) -> List[int]:
+    """List of integer hashes in HASH_TYPES order"""
+    return [hash_to_int(hashes[key]) for key in HASH_TYPES]
+
+
+def hamming_distances(haystack: numpy.ndarray, needle: numpy.ndarray):
+    """Hamming distance of each hash in haystack to needle.
+
+    haystack is a (N, H) array and needle is a (H, ) array of uint64. Returns
+    a (N, H) array of bit differences.
+    """
+    xor = numpy.bitwise_xor(haystack, needle)
+    bits = POPCOUNT[xor.view(numpy.uint8)]
+    return bits.reshape(*xor.shape, 8).sum(axis=-1, dtype=numpy.uint8)
+
+
+def combined_distance(distances: numpy.ndarray) -> numpy.ndarray:
+    """Median of the three best matching hash types"""
+    return numpy.sort(distances, axis=1)[:, 1]
+
+
+def hash_distance(a: Mapping, b: Mapping) -> int:
+    """Combined hash distance between two images"""
+    haystack = numpy.array([hash_row(a)], numpy.uint64)
+    needle = numpy.array(hash_row(b), numpy.uint64)
+    return int(combined_distance(hamming_distances(haystack, needle))[0])
+
+
+class ImageHashIndex:
+    """Hamming distance index of ImageFile perceptual hashes.
+
+    The index is loaded from the database on first use, and is kept up to
+    date by `update` and by periodic syncing of recently modified images.
+    Deleted images are removed by `remove`, which is published on a Redis
+    channel to the indexes of all processes. Removed rows are left as
+    tombstones until they are a `COMPACT_FRACTION` of the index.
+    """
+
+    SYNC_INTERVAL = 60  # seconds between syncing with database
+    PRUNE_INTERVAL = 60 * 60  # seconds between checks for missed deletions
+    COMPACT_FRACTION = 0.25
+    CHANNEL = 'image-hash-index-remove'
+
+    def __init__(self, model='photo.ImageFile'):
+        self._model = model
+        self._lock = threading.RLock()
+        self._pks = numpy.zeros(0, numpy.int64)
+        self._hashes = numpy.zeros((0, len(HASH_TYPES)), numpy.uint64)
+        self._rows = {}  # type: Dict[int, int]
+        self._removed = 0  # tombstones
+        self._synced_at = None
+        self._last_sync = 0.0
+        self._last_prune = 0.0
+        self._listener_pid = None
+
+    def __len__(self):
+        return len(self._pks)
+
+    @property
+    def loaded(self) -> bool:
+        return self._synced_at is not None
+
+    def _queryset(self):
+        model = apps.get_model(self._model)
+        annotations = {
+            f'_{key}': KeyTextTransform(key, 'stat')
+            for key in HASH_TYPES
+        }
+        return model.objects.exclude(_imagehash='').annotate(**annotations)
+
+    def _fetch(self, queryset) -> Tuple[List[int], List[List[int]]]:
+        fields = ['pk'] + [f'_{key}' for key in HASH_TYPES]
+        pks, rows = [], []
+        for pk, *hashes in queryset.values_list(*fields).iterator():
+            try:
+                rows.append([hash_to_int(h) for h in hashes])
+            except (TypeError, ValueError):
+                continue  # missing or invalid hash
+            pks.append(pk)
+        return pks, rows
+
+    def load(self):
+        """Load all image hashes from database"""
+        self._listen()
+        started = timezone.now()
+        pks, rows = self._fetch(self._queryset())
+        with self._lock:
+            self._pks = numpy.array(pks, numpy.int64)
+            self._hashes = numpy.array(rows, numpy.uint64).reshape(
+                -1, len(HASH_TYPES)
+            )
+            self._rows = {pk: n for n, pk in enumerate(pks)}
+            self._removed = 0
+            self._synced_at = started
+            self._last_sync = self._last_prune = time.monotonic()
+        logger.debug(f'loaded {len(pks)} image hashes')
+
+    def sync(self, force=False):
+        """Load or refresh index with images modified since last sync"""
+        if not self.loaded:
+            return self.load()
+        elapsed = time.monotonic() - self._last_sync
+        if elapsed < self.SYNC_INTERVAL and not force:
+            return
+        started = timezone.now()
+        queryset = self._queryset().filter(modified__gte=self._synced_at)
+        self._upsert(*self._fetch(queryset))
+        if force or time.monotonic() - self._last_prune > self.PRUNE_INTERVAL:
+            self._remove_deleted()
+            self._last_prune = time.monotonic()
+        self._synced_at = started
+        self._last_sync = time.monotonic()
+
+    def arrays(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Primary keys and hashes of all indexed images"""
+        self.sync()
+        with self._lock:
+            alive = self._pks >= 0
+            return self._pks[alive], self._hashes[alive]
+
+    def update(self, pk: int, hashes: Mapping):
+        """Add or replace hashes of a single image, if the index is loaded"""
+        if not self.loaded or pk is None:
+            return
+        try:
+            row = hash_row(hashes)
+        except (KeyError, TypeError, ValueError):
+            return
+        self._upsert([pk], [row])
+
+    def remove(self, pk: int):
+        """Remove image from the index of this and all other processes"""
+        self._discard([pk])
+        self._publish([pk])
+
+    def _discard(self, pks: Iterable[int]):
+        """Remove images from this index"""
+        with self._lock:
+            for pk in pks:
+                n = self._rows.pop(pk, None)
+                if n is not None:
+                    self._pks[n] = -1  # tombstone
+                    self._removed += 1
+            if self._removed > self.COMPACT_FRACTION * len(self._pks):
+                self._compact()
+
+    def _compact(self):
+        """Drop tombstones from the arrays"""
+        with self._lock:
+            alive = self._pks >= 0
+            self._pks = self._pks[alive]
+            self._hashes = self._hashes[alive]
+            self._rows = {pk: n for n, pk in enumerate(self._pks.tolist())}
+            self._removed = 0
+
+    def _remove_deleted(self):
+        """Remove images that are no longer in the database. Deletions are
+        published by `remove`, this only finds the ones that were missed."""
+        pks = self._queryset().values_list('pk', flat=True)
+        current = numpy.fromiter(pks.iterator(), numpy.int64)
+        with self._lock:
+            known = self._pks[self._pks >= 0]
+        deleted = numpy.setdiff1d(known, current, assume_unique=True)
+        self._discard(deleted.tolist())
+        if len(deleted):
+            logger.debug(f'removed {len(deleted)} deleted image hashes')
+
+    def _publish(self, pks: List[int]):
+        """Tell other processes to remove images from their index"""
+        connection = getattr(default.kvstore, 'connection', None)
+        if connection is None:  # not a redis kvstore
+            return
+        try:
+            connection.publish(self.CHANNEL, json.dumps(pks))
+        except Exception:
+            logger.exception('Cannot publish image hash removal')
+
+    def _on_message(self, message):
+        try:
+            pks = [int(pk) for pk in json.loads(message['data'])]
+        except (TypeError, ValueError):
+            return
+        self._discard(pks)
+
+    def _listen(self):
+        """Subscribe to removals. Threads do not survive a fork, so a new
+        subscription is made in each worker process."""
+        connection = getattr(default.kvstore, 'connection', None)
+        if connection is None or self._listener_pid == os.getpid():
+            return
+        try:
+            pubsub = connection.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.CHANNEL: self._on_message})
+            pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception:
+            logger.exception('Cannot subscribe to image hash removal')
+        self._listener_pid = os.getpid()
+
+    def _upsert(self, pks: List[int], rows: List[List[int]]):
+        with self._lock:
+            new_pks, new_rows = [], []
+            for pk, row in zip(pks, rows):
+                n = self._rows.get(pk)
+                if n is None:
+                    new_pks.append(pk)
+                    new_rows.append(row)
+                else:
+                    self._hashes[n] = row
+            if not new_pks:
+                return
+            start = len(self._pks)
+            self._pks = numpy.concatenate([
+                self._pks, numpy.array(new_pks, numpy.int64)
+            ])
+            self._hashes = numpy.concatenate([
+                self._hashes, numpy.array(new_rows, numpy.uint64)
+            ])
+            self._rows.update({
+                pk: start + n
+                for n, pk in enumerate(new_pks)
+            })
+
+    def nearest(self, hashes: Mapping, k=30) -> List[Tuple[int, int]]:
+        """Find the k images with smallest hash distance to hashes.
+
+        Returns list of (distance, pk) tuples sorted by distance.
+        """
+        self.sync()
+        with self._lock:
+            pks, haystack = self._pks, self._hashes
+        if not len(pks):
+            return []
+        needle = numpy.array(hash_row(hashes), numpy.uint64)
+        distance = combined_distance(hamming_distances(haystack, needle))
+        distance[pks < 0] = 255  # removed images
+        k = min(k, len(pks))
+        nearest = numpy.argpartition(distance, k - 1)[:k]
+        result = [(int(distance[n]), int(pks[n])) for n in nearest]
+        return sorted(r for r in result if r[1] >= 0)
+
+    def similar(self, hashes: Mapping, limit=3, cutoff=8) -> List[int]:
+        """Primary keys of the images that are most likely duplicates"""
+        matches = [(d, pk) for d, pk in self.nearest(hashes) if d < cutoff]
+        if not matches:
+            return []
+        best = matches[0][0] + 0.1
+        return [pk for d, pk in matches if d / best < 1.5][:limit]
+
+
+# Lazily loaded index for each worker process
+hash_index = ImageHashIndex()
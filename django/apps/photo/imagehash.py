@@ -1,6 +1,7 @@
 import logging
 from pathlib import Path
 
+from PIL import Image
 import botocore
 from django.db import models
 from django.utils import timezone
@@ -9,7 +10,13 @@ import imagehash
 
 from utils.model_fields import AttrJSONField
 
-from .file_operations import get_imagehashes, get_md5
+from .file_operations import (
+    fingerprint_file,
+    get_imagehashes,
+    image_to_placeholder,
+    pil_image,
+)
+from .hashindex import hash_index
 
 logger = logging.getLogger(__name__)
 
@@ -51,11 +58,20 @@ class ImageHashModelMixin(models.Model):
         editable=False,
         default=dict,
     )
+    placeholder = models.TextField(
+        verbose_name=_('placeholder'),
+        help_text=_('tiny image data uri to show while loading'),
+        editable=False,
+        blank=True,
+        default='',
+    )
     HASH_TYPES = 'ahash', 'dhash', 'phash', 'whash'
 
     def save(self, *args, **kwargs):
         self.calculate_hashes(save=False)
         super().save(*args, **kwargs)
+        if self._imagehash:
+            hash_index.update(self.pk, self.stat)
 
     @property
     def filesize(self):
@@ -85,27 +101,64 @@ class ImageHashModelMixin(models.Model):
             self.stat[key] = str(hashes[key])
         self._imagehash = self.stat.ahash
 
-    def calculate_hashes(self, save=True):
-        """Make sure the image has size, mtime, md5 and imagehash"""
+    @property
+    def has_hashes(self):
+        """Size, md5 and imagehash have been calculated"""
+        return bool(self.stat.md5 and self.stat.size and self._imagehash)
+
+    def calculate_placeholder(self, save=True):
+        """Make placeholder from the small thumbnail. A failed attempt is
+        recorded in stat, so it is not tried again."""
+        try:
+            placeholder = image_to_placeholder(pil_image(self.small))
+        except (OSError, ValueError, Image.DecompressionBombError):
+            logger.exception(f'cannot make placeholder for {self}')
+            placeholder = ''
+        self.placeholder = placeholder
+        if not placeholder:
+            self.stat.no_placeholder = True
+        if self.pk is not None and save:
+            # update without save signals, nothing else has changed
+            type(self).objects.filter(pk=self.pk).update(
+                placeholder=self.placeholder, stat=self.stat
+            )
+        return bool(placeholder)
+
+    def calculate_hashes(self, save=True, data=None):
+        """Make sure the image has size, mtime, md5 and imagehash. Pass the
+        file `data` if it has already been read."""
         values = []
         if self.original:
             if not self.stat.mtime:
                 self.stat.mtime = get_sourcefile_modification_time(self)
                 values.append(self.stat.mtime)
-            if not self.stat.md5:
-                self.stat.md5 = get_md5(self.original)
-                values.append(self.stat.md5)
-            if not self.stat.size:
-                self.stat.size = self.original.size
-                values.append(self.stat.size)
-            if not self._imagehash:
-                values.append(self.imagehashes)  # use property getter method
+            if not self.has_hashes:
+                # read and decode file only once
+                fingerprint = fingerprint_file(
+                    self.original if data is None else data
+                )
+                if not self.stat.md5:
+                    self.stat.md5 = fingerprint.md5
+                    values.append(self.stat.md5)
+                if not self.stat.size:
+                    self.stat.size = fingerprint.size
+                    values.append(self.stat.size)
+                if not self.stat.mimetype and fingerprint.mimetype:
+                    self.stat.mimetype = fingerprint.mimetype
+                if not self._imagehash and fingerprint.imagehashes:
+                    self.imagehashes = fingerprint.imagehashes
+                    values.append(self._imagehash)
+                if not self.placeholder and fingerprint.placeholder:
+                    self.placeholder = fingerprint.placeholder
+                    values.append(self.placeholder)
 
         if not values:
             return False  # ok
 
         if self.pk is not None and save:
             # save unless instance does not exist already in db.
-            self.save(update_fields=['_imagehash', 'stat', 'modified'])
+            self.save(
+                update_fields=['_imagehash', 'stat', 'placeholder', 'modified']
+            )
             logger.debug(f'updated hashes and stats {self}')
         return True  # values were updated
@@ -0,0 +1,176 @@
+"""Key value store for sorl thumbnail metadata.
+
+Values from Redis are kept in a small in-process LRU cache, since the same
+thumbnails are looked up over and over again. Every change to a key is
+published on a Redis channel, so all processes drop stale entries. Lists of
+thumbnails are not cached, since they are read and rewritten by
+`KeepNameThumbnailBackend`, and a stale list would lose thumbnails.
+"""
+
+from collections import OrderedDict, namedtuple
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from sorl.thumbnail.images import deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.redis_kvstore import KVStore as RedisKVStore
+
+logger = logging.getLogger(__name__)
+
+CacheInfo = namedtuple('CacheInfo', 'hits, misses, maxsize, currsize')
+
+
+class LocalCache:
+    """Thread safe LRU cache where entries expire after `ttl` seconds"""
+
+    def __init__(self, maxsize=2000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._data = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Cached value or `None`"""
+        with self._lock:
+            expires, value = self._data.get(key, (0, None))
+            if expires < time.monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+
+class KVStore(RedisKVStore):
+    """Redis key value store with an in-process LRU cache"""
+
+    CHANNEL = 'thumbnail-kvstore-invalidate'
+    UNCACHED = ('thumbnails', )  # identities that are always read from redis
+
+    def __init__(self):
+        super().__init__()
+        self.cache = LocalCache(
+            maxsize=getattr(settings, 'THUMBNAIL_LOCAL_CACHE_SIZE', 2000),
+            ttl=getattr(settings, 'THUMBNAIL_LOCAL_CACHE_TTL', 300),
+        )
+        self._sender = uuid.uuid4().hex
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    def cache_info(self) -> CacheInfo:
+        """Hit and miss counts of the local cache"""
+        return self.cache.info()
+
+    def get_many(self, image_files):
+        """Get several image files from store with a single MGET. Returns
+        `None` for image files that are not found."""
+        keys = [add_prefix(image_file.key) for image_file in image_files]
+        values = [self._get_cached(key) for key in keys]
+        missing = [key for key, value in zip(keys, values) if value is None]
+        if missing:
+            fetched = dict(zip(missing, self.connection.mget(missing)))
+            for key, value in fetched.items():
+                if value is not None:
+                    self.cache.set(key, value)
+            values = [fetched.get(key, v) for key, v in zip(keys, values)]
+        return [
+            None if value is None else deserialize_image_file(value)
+            for value in values
+        ]
+
+    def delete_thumbnails(self, image_file):
+        """Also forget the thumbnail qualities chosen for the source"""
+        self._delete(image_file.key, identity='quality')
+        return super().delete_thumbnails(image_file)
+
+    def _cacheable(self, key):
+        return not any(
+            key.startswith(add_prefix('', identity))
+            for identity in self.UNCACHED
+        )
+
+    def _get_cached(self, key):
+        self._listen()
+        return self.cache.get(key)
+
+    def _get_raw(self, key):
+        if not self._cacheable(key):
+            return super()._get_raw(key)
+        value = self._get_cached(key)
+        if value is None:
+            value = super()._get_raw(key)
+            if value is not None:
+                self.cache.set(key, value)
+        return value
+
+    def _set_raw(self, key, value):
+        result = super()._set_raw(key, value)
+        if self._cacheable(key):
+            self.cache.set(key, value)
+            self._publish([key])
+        return result
+
+    def _delete_raw(self, *keys):
+        result = super()._delete_raw(*keys)
+        self.cache.delete(*keys)
+        self._publish(keys)
+        return result
+
+    def _publish(self, keys):
+        """Tell other processes to drop keys from their local cache"""
+        message = json.dumps({'sender': self._sender, 'keys': list(keys)})
+        try:
+            self.connection.publish(self.CHANNEL, message)
+        except Exception:
+            logger.exception('Cannot publish kvstore invalidation')
+
+    def _on_message(self, message):
+        try:
+            data = json.loads(message['data'])
+        except (TypeError, ValueError):
+            return
+        if data.get('sender') != self._sender:
+            self.cache.delete(*data.get('keys', []))
+
+    def _listen(self):
+        """Subscribe to invalidation messages. Threads do not survive a fork,
+        so a new subscription is made in each worker process."""
+        if self._listener_pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self.cache.clear()
+            try:
+                pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self.CHANNEL: self._on_message})
+                pubsub.run_in_thread(sleep_time=1, daemon=True)
+            except Exception:
+                logger.exception('Cannot subscribe to kvstore invalidation')
+            self._listener_pid = os.getpid()
@@ -0,0 +1,78 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from apps.photo.benchmark import (
+    DETECTORS,
+    IMAGESIZES,
+    compare_detectors,
+    format_detector_results,
+    load_sample_files,
+    load_samples,
+)
+from apps.photo.models import ImageFile
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Compare speed, memory use and crop quality of feature detectors.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory',
+            dest='directory',
+            default=None,
+            help='Folder of fixture images. Subfolders are categories.'
+        )
+        parser.add_argument(
+            '--count',
+            type=int,
+            dest='count',
+            default=10,
+            help='Number of images per category from the database.'
+        )
+        parser.add_argument(
+            '--manual',
+            action='store_true',
+            dest='manual',
+            default=False,
+            help='Only use manually cropped images from the database.'
+        )
+        parser.add_argument(
+            '--detector',
+            action='append',
+            dest='detectors',
+            choices=DETECTORS + ['mock'],
+            default=None,
+            help='Feature detector. Can be used several times.'
+        )
+        parser.add_argument(
+            '--imagesize',
+            action='append',
+            type=int,
+            dest='imagesizes',
+            default=None,
+            help='Detector image size in pixels. Can be used several times.'
+        )
+
+    def handle(self, *args, **options):
+        if options['directory']:
+            samples = load_sample_files(options['directory'])
+        else:
+            queryset = ImageFile.objects.all()
+            if options['manual']:
+                queryset = queryset.filter(
+                    cropping_method=ImageFile.CROP_MANUAL
+                )
+            samples = load_samples(queryset, options['count'])
+        if not samples:
+            self.stderr.write('no images found')
+            return
+        self.stdout.write(f'{len(samples)} images')
+        results = compare_detectors(
+            options['detectors'] or DETECTORS,
+            samples,
+            options['imagesizes'] or IMAGESIZES,
+        )
+        self.stdout.write(format_detector_results(results))
@@ -0,0 +1,51 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from apps.photo.benchmark import (
+    compare_exif,
+    format_results,
+    load_sample_files,
+    load_samples,
+)
+from apps.photo.models import ImageFile
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Compare speed of exif parsing and pruning.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory',
+            dest='directory',
+            default=None,
+            help='Folder of fixture images. Subfolders are categories.'
+        )
+        parser.add_argument(
+            '--count',
+            type=int,
+            dest='count',
+            default=10,
+            help='Number of images per category from the database.'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            dest='repeat',
+            default=10,
+            help='Number of times each image is parsed.'
+        )
+
+    def handle(self, *args, **options):
+        if options['directory']:
+            samples = load_sample_files(options['directory'])
+        else:
+            samples = load_samples(ImageFile.objects.all(), options['count'])
+        if not samples:
+            self.stderr.write('no images found')
+            return
+        self.stdout.write(f'{len(samples)} images')
+        results = compare_exif(samples, options['repeat'])
+        self.stdout.write(format_results(results))
@@ -0,0 +1,61 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.photo.benchmark import (
+    compare_engines,
+    format_results,
+    load_sample_files,
+    load_samples,
+)
+from apps.photo.models import ImageFile
+
+logger = logging.getLogger(__name__)
+
+ENGINES = [
+    'apps.photo.cropping.crop_engine.CloseCropEngine',
+    'apps.photo.cropping.crop_engine.PillowCloseCropEngine',
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare speed, memory use and file size of thumbnail engines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory',
+            dest='directory',
+            default=None,
+            help='Folder of fixture images. Subfolders are categories.'
+        )
+        parser.add_argument(
+            '--count',
+            type=int,
+            dest='count',
+            default=10,
+            help='Number of images per category from the database.'
+        )
+        parser.add_argument(
+            '--engine',
+            action='append',
+            dest='engines',
+            default=None,
+            help='Thumbnail engine class path. Can be used several times.'
+        )
+
+    def handle(self, *args, **options):
+        if options['directory']:
+            samples = load_sample_files(options['directory'])
+        else:
+            samples = load_samples(ImageFile.objects.all(), options['count'])
+        if not samples:
+            self.stderr.write('no images found')
+            return
+        engines = options['engines'] or ENGINES
+        self.stdout.write(
+            f'{len(samples)} images, current engine is '
+            f'{settings.THUMBNAIL_ENGINE}'
+        )
+        results = compare_engines(engines, samples)
+        self.stdout.write(format_results(results))
@@ -0,0 +1,35 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from apps.photo.tasks import find_duplicate_images
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Find groups of duplicate images for review in the admin.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--cutoff',
+            type=int,
+            dest='cutoff',
+            default=8,
+            help='Maximum perceptual hash distance of duplicates.'
+        )
+        parser.add_argument(
+            '--async',
+            action='store_true',
+            dest='async',
+            default=False,
+            help='Run as a celery task.'
+        )
+
+    def handle(self, *args, **options):
+        if options['async']:
+            find_duplicate_images.delay(options['cutoff'])
+            self.stdout.write('queued task')
+        else:
+            count = find_duplicate_images(options['cutoff'])
+            self.stdout.write(f'found {count} groups of duplicates')
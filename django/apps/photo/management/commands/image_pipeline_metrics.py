@@ -0,0 +1,39 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from apps.photo.pipeline import reset_metrics, stage_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Show duration, bytes read and failures of image pipeline stages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            dest='reset',
+            default=False,
+            help='Reset metrics after showing them.'
+        )
+
+    def handle(self, *args, **options):
+        header = ('stage', 'runs', 'failures', 'ms/run', 'kB read/run')
+        lines = ['{:<15} {:>8} {:>9} {:>10} {:>12}'.format(*header)]
+        for stage, metrics in stage_metrics().items():
+            runs = metrics.runs or 1
+            lines.append(
+                '{:<15} {:>8} {:>9} {:>10.1f} {:>12.1f}'.format(
+                    stage,
+                    metrics.runs,
+                    metrics.failures,
+                    metrics.milliseconds / runs,
+                    metrics.bytes_read / runs / 2**10,
+                )
+            )
+        self.stdout.write('\n'.join(lines))
+        if options['reset']:
+            reset_metrics()
+            self.stdout.write('metrics were reset')
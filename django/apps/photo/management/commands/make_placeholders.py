@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from apps.photo.models import ImageFile
+from apps.photo.tasks import make_placeholders
+
+
+class Command(BaseCommand):
+    help = 'Make missing placeholder images in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            dest='batch_size',
+            default=500,
+            help='Number of images in each batch.'
+        )
+        parser.add_argument(
+            '--async',
+            action='store_true',
+            dest='async',
+            default=False,
+            help='Run each batch as a celery task.'
+        )
+
+    def handle(self, *args, **options):
+        images = ImageFile.objects.needs_placeholder()
+        pks = list(images.order_by('-pk').values_list('pk', flat=True))
+        size = options['batch_size']
+        for start in range(0, len(pks), size):
+            batch = pks[start:start + size]
+            if options['async']:
+                make_placeholders.delay(batch)
+                self.stdout.write(f'queued {len(batch)} images')
+            else:
+                count = make_placeholders(batch)
+                self.stdout.write(
+                    f'{start + len(batch)} of {len(pks)} images, '
+                    f'{count} placeholders'
+                )
@@ -0,0 +1,76 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0031_auto_20181117_0241'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateGroup',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name='ID'
+                    )
+                ),
+                (
+                    'created',
+                    model_utils.fields.AutoCreatedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name='created'
+                    )
+                ),
+                (
+                    'modified',
+                    model_utils.fields.AutoLastModifiedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name='modified'
+                    )
+                ),
+                (
+                    'method',
+                    models.CharField(
+                        choices=[('md5', 'identical file'),
+                                 ('imagehash', 'similar image')],
+                        help_text='how the duplicates were found',
+                        max_length=20,
+                        verbose_name='method'
+                    )
+                ),
+                (
+                    'distance',
+                    models.PositiveSmallIntegerField(
+                        default=0,
+                        help_text='largest perceptual hash difference in '
+                        'the group',
+                        verbose_name='distance'
+                    )
+                ),
+                (
+                    'images',
+                    models.ManyToManyField(
+                        related_name='duplicate_groups',
+                        to='photo.ImageFile',
+                        verbose_name='images'
+                    )
+                ),
+            ],
+            options={
+                'verbose_name': 'duplicate group',
+                'verbose_name_plural': 'duplicate groups',
+            },
+        ),
+    ]
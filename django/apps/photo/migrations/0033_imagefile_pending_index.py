@@ -0,0 +1,21 @@
+from django.db import migrations
+
+# Partial index for picking images from the pending autocrop backlog
+# (cropping_method = CROP_PENDING) ordered by age.
+
+INDEX = 'photo_imagefile_pending_autocrop'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0032_duplicategroup'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE INDEX {INDEX} ON photo_imagefile (created) '
+            'WHERE cropping_method = 1;',
+            f'DROP INDEX {INDEX};',
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+# Expression indexes for finding identical files by md5 of the processed
+# file or md5 of the file as it was uploaded. Matches `stat__md5=value`.
+
+INDEXES = {
+    'photo_imagefile_md5': 'md5',
+    'photo_imagefile_upload_md5': 'upload_md5',
+}
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0033_imagefile_pending_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f"CREATE INDEX {index} ON photo_imagefile ((stat -> '{key}'));",
+            f'DROP INDEX {index};',
+        ) for index, key in INDEXES.items()
+    ]
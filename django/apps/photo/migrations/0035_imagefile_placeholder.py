@@ -0,0 +1,24 @@
+# Generated by Django 2.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0034_imagefile_md5_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='placeholder',
+            field=models.TextField(
+                blank=True,
+                default='',
+                editable=False,
+                help_text='tiny image data uri to show while loading',
+                verbose_name='placeholder'
+            ),
+        ),
+    ]
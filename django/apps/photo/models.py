@@ -4,7 +4,6 @@ import logging
 import mimetypes
 from pathlib import Path
 import re
-from statistics import median
 
 from django.contrib.postgres.fields import JSONField
 from django.contrib.postgres.search import TrigramSimilarity
@@ -28,6 +27,7 @@ from utils.model_mixins import EditURLMixin
 
 # from .exif import ExifData, extract_exif_data
 from .cropping.models import AutoCropImage
+from .hashindex import hash_distance, hash_index
 from .imagehash import ImageHashModelMixin
 from .preprocess import ProcessImage
 from .thumbimage import ThumbImageFile
@@ -59,6 +59,18 @@ class ImageFileQuerySet(models.QuerySet):
         """Awaiting automatic crop calculation"""
         return self.filter(cropping_method=self.model.CROP_PENDING)
 
+    def identical(self, md5):
+        """Same file as uploaded or as processed"""
+        return self.filter(
+            models.Q(stat__md5=md5) | models.Q(stat__upload_md5=md5)
+        )
+
+    def needs_placeholder(self):
+        """Has an original, but no placeholder and no failed attempt"""
+        return self.filter(placeholder='').exclude(original='').exclude(
+            original=None
+        ).exclude(stat__has_key='no_placeholder')
+
     def unused(self):
         """Not used for anything"""
         return self.filter(storyimage=None, person=None, frontpagestory=None)
@@ -91,35 +103,6 @@ class ImageFileQuerySet(models.QuerySet):
         return self.annotate(bigness=RawSQL(sql, []))
 
 
-def _filter_dupes(dupes, master_hashes, limit=3):
-    """Second imagehash comparison pass."""
-    diff_pk = []
-    for dupe in dupes:
-        diffs = [
-            val - master_hashes[key] for key, val in dupe.imagehashes.items()
-        ]
-        diff = median(sorted(diffs)[:3])
-        if diff < 8:
-            diff_pk.append((diff, dupe.pk))
-    if not diff_pk:
-        return []
-    diff_pk.sort()
-    best = diff_pk[0][0] + 0.1
-    return [pk for diff, pk in diff_pk if diff / best < 1.5][:limit]
-
-
-def _get_dupes_raw(qs, ahash, limit=30):
-    """Use raw sql to query. This is the only way to use the GIN index."""
-    table = ImageFile._meta.db_table
-    field = '_imagehash'
-    sql = f"""
-    SELECT * FROM {table} WHERE {field} %% %(query)s
-    ORDER BY similarity({field}, %(query)s ) DESC LIMIT {limit}
-    """
-    params = {'query': str(ahash)}
-    return qs.raw(sql, params)
-
-
 def _create_gin_index(field='_imagehash', delete=False):
     """Create search index for imagehash."""
     table = ImageFile._meta.db_table
@@ -143,7 +126,7 @@ class ImageFileManager(models.Manager):
         """Search for images matching query."""
         qs = self.get_queryset()
         if md5:
-            results = qs.filter(stat__md5=md5)
+            results = qs.identical(md5)
             if results.count():
                 return results
         if fingerprint:
@@ -152,8 +135,7 @@ class ImageFileManager(models.Manager):
             except ValueError as err:
                 raise ValueError('incorrect fingerprint: %s' % err) from err
             master_hashes = file_operations.get_imagehashes(master)
-            dupes = _get_dupes_raw(qs, master_hashes['ahash'], 30)
-            pks = _filter_dupes(dupes, master_hashes)
+            pks = hash_index.similar(master_hashes)
             return qs.filter(pk__in=pks)
 
         if filename:
@@ -395,6 +377,74 @@ class ImageFile(  # type: ignore
         super().save(*args, **kwargs)
 
 
+class DuplicateGroup(TimeStampedModel):
+    """Images that are probably duplicates, awaiting review."""
+
+    MD5 = 'md5'
+    IMAGEHASH = 'imagehash'
+    METHOD_CHOICES = (
+        (MD5, _('identical file')),
+        (IMAGEHASH, _('similar image')),
+    )
+
+    class Meta:
+        verbose_name = _('duplicate group')
+        verbose_name_plural = _('duplicate groups')
+
+    method = models.CharField(
+        verbose_name=_('method'),
+        help_text=_('how the duplicates were found'),
+        choices=METHOD_CHOICES,
+        max_length=20,
+    )
+    distance = models.PositiveSmallIntegerField(
+        verbose_name=_('distance'),
+        help_text=_('largest perceptual hash difference in the group'),
+        default=0,
+    )
+    images = models.ManyToManyField(
+        ImageFile,
+        verbose_name=_('images'),
+        related_name='duplicate_groups',
+    )
+
+    def __str__(self):
+        return ', '.join(str(image) for image in self.images.all())
+
+    def merge(self, cutoff=8):
+        """Merge images in the group into the largest one. Images that are
+        not duplicates of the largest image are left alone. Returns the
+        largest image, or None if the group is empty."""
+        images = self.images.annotate(
+            pixelsize=models.F('full_width') * models.F('full_height')
+        ).order_by(models.F('pixelsize').desc(nulls_last=True))
+        if not images:  # all images have been deleted
+            self.delete()
+            return None
+        first, *others = images
+        others = [
+            image for image in others if is_duplicate(first, image, cutoff)
+        ]
+        # remove membership rows, so they are not moved to the first image
+        DuplicateGroup.images.through.objects.filter(
+            imagefile__in=others
+        ).delete()
+        first.merge_with(others)
+        self.delete()
+        return first
+
+
+def is_duplicate(image, other, cutoff=8):
+    """Images have the same md5 or similar perceptual hashes"""
+    md5 = image.stat.get('md5')
+    if md5 and md5 == other.stat.get('md5'):
+        return True
+    try:
+        return hash_distance(image.stat, other.stat) < cutoff
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
 def async_image_upload(file):
     pass
 
@@ -0,0 +1,231 @@
+"""Image ingestion pipeline.
+
+New and changed images go through a fixed sequence of stages:
+
+    process -> fingerprint -> autocrop -> renditions
+
+All stages run in the same task and share a `PipelineContext`, so the
+ImageFile is loaded from the database once, and the original file is read
+from storage at most once. Each stage records its duration, bytes read and
+failure count in the cache, see `stage_metrics`.
+"""
+
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from io import BytesIO
+import logging
+from pathlib import Path
+import time
+from typing import Dict, Iterable, List, Optional
+
+from PIL import Image
+from django.core.cache import cache
+import numpy
+
+from .cropping.crop_detector import (
+    Feature,
+    ImagePyramid,
+    crop_box_from_features,
+    shared_detector,
+)
+from .file_operations import get_orientation, rotate_upright
+from .governor import render_slots
+from .models import ImageFile
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'imagepipeline:{stage}:{field}'
+METRICS_FIELDS = ['runs', 'failures', 'milliseconds', 'bytes_read']
+DETECTION_SIZE = 600  # same as the `large` thumbnail used before
+
+Stage = namedtuple('Stage', 'name, func')
+StageMetrics = namedtuple('StageMetrics', METRICS_FIELDS)
+
+
+class PipelineContext:
+    """State that is passed between the pipeline stages"""
+
+    def __init__(self, instance: ImageFile, upload: str = None) -> None:
+        self.instance = instance
+        self.upload = Path(upload) if upload else None
+        self.data = None  # type: Optional[bytes]
+        self.bytes_read = 0
+
+    def read(self) -> bytes:
+        """Data of the original file. Read from storage only once."""
+        if self.data is None:
+            with self.instance.original.open('rb') as fp:
+                self.data = fp.read()
+            self.bytes_read += len(self.data)
+        return self.data
+
+    def detection_image(self) -> ImagePyramid:
+        """Upright grayscale image for feature detection. Jpeg files are
+        decoded at reduced scale."""
+        image = Image.open(BytesIO(self.read()))
+        # originals that are not processed yet can have exif rotation
+        orientation = get_orientation(image)
+        image.draft('L', (DETECTION_SIZE, DETECTION_SIZE))
+        image = rotate_upright(image.convert('L'), orientation)
+        return ImagePyramid(numpy.asarray(image))
+
+
+def process(context: PipelineContext):
+    """Compress and clean up uploaded file, and save it to storage"""
+    if context.upload is None:
+        return
+    context.bytes_read += context.upload.stat().st_size
+    processed = False
+    try:
+        with Image.open(context.upload) as image:
+            with render_slots(image.size):
+                context.data = context.instance.process_uploaded_file(image)
+        processed = True
+    finally:
+        context.upload.unlink()  # clean up
+        if not processed:
+            # the next stages do not run, so save the image anyway
+            context.instance.save()
+
+
+def fingerprint(context: PipelineContext):
+    """Calculate md5, size and imagehashes, and save the ImageFile"""
+    instance = context.instance
+    data = None if instance.has_hashes else context.read()
+    if context.upload is None:
+        instance.calculate_hashes(data=data)
+    else:  # new original file
+        instance.calculate_hashes(save=False, data=data)
+        instance.save()
+
+
+def autocrop_stage(context: PipelineContext):
+    """Detect features and save crop box of pending images"""
+    instance = context.instance
+    if instance.cropping_method == instance.CROP_PENDING:
+        autocrop(instance, context.detection_image())
+
+
+def renditions(context: PipelineContext):
+    """Create missing thumbnails"""
+    context.instance.build_thumbs(read=context.read)
+
+
+STAGES = [
+    Stage('process', process),
+    Stage('fingerprint', fingerprint),
+    Stage('autocrop', autocrop_stage),
+    Stage('renditions', renditions),
+]
+
+
+def autocrop(instance: ImageFile, source=None) -> bool:
+    """Detect features and save crop box of ImageFile"""
+    if not instance.original:
+        msg = f'Try to autocrop ImageFile with no file: {instance.pk}'
+        logger.warning(msg)
+        return False
+    if source is None:
+        source = instance.large.read()  # at least 600 x 600 pixels
+    # detectors are kept between tasks, to avoid loading classifiers again
+    detector = shared_detector(n=1 if instance.is_profile_image else 10)
+    features = detector.detect_features(source)
+    crop_box = crop_box_from_features(features)
+    if not features:
+        cropping_method = ImageFile.CROP_NONE
+    else:
+        cropping_method = determine_cropping_method(features)
+    instance.crop_box = crop_box
+    instance.cropping_method = cropping_method
+    logger.debug(
+        '%s %s %s' %
+        (instance, crop_box, instance.get_cropping_method_display())
+    )
+    instance.save(update_fields=['crop_box', 'cropping_method'])
+    return True
+
+
+def determine_cropping_method(features: List[Feature]) -> int:
+    """Determines which cropping method label to use"""
+    if 'face' in features[-1].label:
+        if len(features) == 1:  # single face
+            return ImageFile.CROP_PORTRAIT
+        return ImageFile.CROP_FACES  # multiple faces
+    return ImageFile.CROP_FEATURES  # no faces
+
+
+def record_metrics(stage: str, **values: int):
+    """Add values to the metrics of a stage"""
+    for field, value in values.items():
+        key = METRICS_KEY.format(stage=stage, field=field)
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key, value)
+        except ValueError:  # expired or evicted since add
+            cache.set(key, value, timeout=None)
+
+
+def stage_metrics(stages: Iterable[str] = None) -> Dict[str, StageMetrics]:
+    """Metrics of each stage, summed over all runs"""
+    stages = stages or [stage.name for stage in STAGES]
+    keys = {
+        (stage, field): METRICS_KEY.format(stage=stage, field=field)
+        for stage in stages for field in METRICS_FIELDS
+    }
+    values = cache.get_many(list(keys.values()))
+    metrics = OrderedDict()  # type: Dict[str, StageMetrics]
+    for stage in stages:
+        metrics[stage] = StageMetrics(
+            *[values.get(keys[stage, field], 0) for field in METRICS_FIELDS]
+        )
+    return metrics
+
+
+def reset_metrics():
+    """Delete metrics of all stages"""
+    stages = [stage.name for stage in STAGES]
+    cache.delete_many([
+        METRICS_KEY.format(stage=stage, field=field)
+        for stage in stages for field in METRICS_FIELDS
+    ])
+
+
+@contextmanager
+def measure(stage: str, context: PipelineContext):
+    """Record duration, bytes read and failure of a stage"""
+    bytes_read = context.bytes_read
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        record_metrics(
+            stage,
+            runs=1,
+            failures=int(failed),
+            milliseconds=int(1000 * (time.perf_counter() - start)),
+            bytes_read=context.bytes_read - bytes_read,
+        )
+
+
+def run_pipeline(
+    instance: ImageFile, upload: str = None, stages: Iterable[str] = None
+) -> bool:
+    """Run pipeline stages for an ImageFile. Stops at the first stage that
+    fails. Returns `True` if all stages succeeded."""
+    context = PipelineContext(instance, upload)
+    selected = [s for s in STAGES if stages is None or s.name in stages]
+    instance._pipeline = True  # post save signal should not queue stages
+    try:
+        for stage in selected:
+            try:
+                with measure(stage.name, context):
+                    stage.func(context)
+            except Exception:
+                logger.exception(f'{stage.name} failed for {instance}')
+                return False
+    finally:
+        instance._pipeline = False
+    logger.debug(f'pipeline done: {instance} read {context.bytes_read} B')
+    return True
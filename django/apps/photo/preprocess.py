@@ -8,7 +8,8 @@ import PIL
 from django.conf import settings
 from django.db import models
 
-from .exif import get_metadata, sanitize_image_exif, serialize_exif
+from .exif import get_metadata, parse_exif
+from .file_operations import rotate_upright
 
 IMAGE_AREA_LIMIT = 16_000_000  # Maximum image area (16 megapixels)
 TASK_DELAY = 0  # Delay further image processing for N seconds
@@ -34,28 +35,49 @@ class ProcessImage(models.Model):
 
             assert temp_file.exists(), 'file should exist'
 
+            fingerprint = getattr(self.original.file, 'fingerprint', None)
+            if fingerprint:
+                # calculated by the upload handler
+                self.stat.upload_md5 = fingerprint.md5
+                if fingerprint.imagehashes:
+                    self.imagehashes = fingerprint.imagehashes
+                self.placeholder = fingerprint.placeholder
             new_temp = tempfile.NamedTemporaryFile(
                 dir=settings.FILE_UPLOAD_TEMP_DIR,
                 prefix='persisted.',
                 delete=False,
             ).name
-            shutil.copy(temp_file, new_temp)
+            # move instead of copy, the upload is deleted after the request
+            shutil.move(str(temp_file), new_temp)
             self.original = None
             self.dimensions = 100, 100
             super().save(*args, **kwargs)
             # queue further processing avoid web server delays
-            from .tasks import process_image_upload
-            task = process_image_upload.si(self.pk, new_temp)
+            from .tasks import run_image_pipeline
+            task = run_image_pipeline.si(self.pk, new_temp)
             task.apply_async(countdown=TASK_DELAY)
 
-    def process_uploaded_file(self, pim):
-        """Clean up meta data and compress large images"""
+    def process_uploaded_file(self, pim) -> bytes:
+        """Clean up meta data and compress large images. Returns the data of
+        the processed file."""
         file_format = pim.format
-        exif_bytes = sanitize_image_exif(pim)
-        self.read_metadata_from_imagefile(pim)
+        exif = parse_exif(pim)
+        self.read_metadata_from_imagefile(pim, exif.data)
+        pim = self.draft_decode(pim)
         pim = self.rotate_image(pim)
         pim = self.reduce_dimensions(pim)
-        self.save_original(pim, exif_bytes, file_format, save=False)
+        return self.save_original(
+            pim, exif.exif_bytes, file_format, save=False
+        )
+
+    def draft_decode(self, pim):
+        """Decode large jpeg images at a reduced scale, but not smaller than
+        the area limit. Must be called before the image data is loaded."""
+        resize_by = (IMAGE_AREA_LIMIT / (pim.width * pim.height))**0.5
+        if resize_by <= 0.5:  # jpeg can be scaled by 1/2, 1/4 or 1/8
+            size = [int(d * resize_by) + 1 for d in [pim.width, pim.height]]
+            pim.draft(pim.mode, size)
+        return pim
 
     def reduce_dimensions(self, pim):
         """Shrink large images"""
@@ -65,7 +87,9 @@ class ProcessImage(models.Model):
             pim.thumbnail(size, resample=PIL.Image.LANCZOS)
         return pim
 
-    def save_original(self, pim, exif=b'', file_format='jpeg', save=True):
+    def save_original(
+        self, pim, exif=b'', file_format='jpeg', save=True
+    ) -> bytes:
         """Save processed image to storage backend"""
         self.dimensions = pim.width, pim.height
         blob = BytesIO()
@@ -73,18 +97,17 @@ class ProcessImage(models.Model):
         self.stat.size = self.stat.md5 = None
         self.delete_thumbnails()
         self.original.save(self.filename, blob, save=save)
+        return blob.getvalue()
 
     def rotate_image(self, pim):
         """Rotate image file based on exif rotation"""
-        orientation = self.exif_data.get('Orientation', 1)
-        degrees = {1: 0, 3: 180, 6: 270, 8: 90}.get(orientation)
-        if degrees:
-            pim = pim.rotate(degrees, expand=True)
-        return pim
+        return rotate_upright(pim, self.exif_data.get('Orientation', 1))
 
-    def read_metadata_from_imagefile(self, pim):
+    def read_metadata_from_imagefile(self, pim, exif_data=None):
         """Update ImageFile from image metadata"""
-        self.exif_data = serialize_exif(pim)
+        if exif_data is None:
+            exif_data = parse_exif(pim).data
+        self.exif_data = exif_data
         if not self.description:
             self.description = self.metadata.description
         if not self.copyright_information:
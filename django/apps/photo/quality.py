@@ -0,0 +1,131 @@
+"""Choose the encoder quality of each thumbnail with a perceptual metric.
+
+Instead of using `THUMBNAIL_QUALITY` for all thumbnails, the quality is
+binary searched for the lowest value where the structural similarity (SSIM)
+between the encoded and the uncompressed thumbnail reaches a target. Flat
+images such as diagrams reach the target at low quality, while detailed
+photos get a higher quality than the default.
+
+The chosen quality is stored in the key value store for each source image,
+so the search for the next size of the same image starts from a good guess.
+"""
+
+from io import BytesIO
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+from PIL import Image
+import cv2
+import numpy
+from sorl.thumbnail import default
+
+logger = logging.getLogger(__name__)
+
+QUALITY_RANGE = (40, 90)
+SEARCH_WINDOW = 8  # search this close to a quality that was used before
+MAX_ITERATIONS = 5  # encodes per search window, not counting the fallback
+SEARCH_FORMATS = ['JPEG', 'WEBP']
+
+
+def grayscale(data: bytes) -> numpy.ndarray:
+    """Decode image data to a grayscale array"""
+    with Image.open(BytesIO(data)) as image:
+        return numpy.asarray(image.convert('L'))
+
+
+def ssim(a: numpy.ndarray, b: numpy.ndarray) -> float:
+    """Mean structural similarity of two grayscale images of the same size.
+    1.0 means identical."""
+    a, b = a.astype(numpy.float64), b.astype(numpy.float64)
+    c1, c2 = (0.01 * 255)**2, (0.03 * 255)**2
+
+    def blur(x):
+        return cv2.GaussianBlur(x, (11, 11), 1.5)
+
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a**2
+    var_b = blur(b * b) - mu_b**2
+    covariance = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * covariance + c2)) / (
+        (mu_a**2 + mu_b**2 + c1) * (var_a + var_b + c2)
+    )
+    return float(ssim_map.mean())
+
+
+def search_quality(
+    encode: Callable[[int], bytes],
+    reference: numpy.ndarray,
+    target: float,
+    guess: Optional[int] = None,
+    iterations: int = MAX_ITERATIONS,
+) -> Tuple[int, bytes]:
+    """Binary search for the lowest quality where `encode(quality)` is at
+    least `target` similar to the `reference` image. With a `guess`, qualities
+    close to it are searched first, and higher qualities only if the target
+    is not reached. Returns quality and encoded data."""
+    encoded = {}  # type: Dict[int, bytes]
+
+    def passes(quality):
+        if quality not in encoded:
+            encoded[quality] = encode(quality)
+        return ssim(reference, grayscale(encoded[quality])) >= target
+
+    low, high = QUALITY_RANGE
+    if guess:
+        window_low = max(low, guess - SEARCH_WINDOW)
+        window_high = min(high, guess + SEARCH_WINDOW)
+        start = min(max(guess, window_low), window_high)
+        windows = [(window_low, window_high, start)]
+        if window_high < high:  # widen upwards
+            windows.append((window_high + 1, high, None))
+    else:
+        windows = [(low, high, None)]
+    for low, high, start in windows:
+        quality = bisect_quality(passes, low, high, start, iterations)
+        if quality is not None:
+            return quality, encoded[quality]
+    # target is not reached in the search range
+    quality = QUALITY_RANGE[1]
+    if quality not in encoded:
+        encoded[quality] = encode(quality)
+    return quality, encoded[quality]
+
+
+def bisect_quality(
+    passes: Callable[[int], bool],
+    low: int,
+    high: int,
+    start: Optional[int] = None,
+    iterations: int = MAX_ITERATIONS,
+) -> Optional[int]:
+    """Lowest quality from `low` to `high` that passes, starting at `start`
+    or in the middle. Returns `None` if no quality that was tried passes."""
+    quality = (low + high) // 2 if start is None else start
+    best = None
+    for _ in range(iterations):
+        if passes(quality):
+            best = quality
+            high = quality - 1
+        else:
+            low = quality + 1
+        if low > high:
+            break
+        quality = (low + high) // 2
+    return best
+
+
+def cached_qualities(source_key: Optional[str]) -> Dict[str, int]:
+    """Qualities that were chosen for thumbnails of a source, by format"""
+    if not source_key:
+        return {}
+    return default.kvstore._get(source_key, identity='quality') or {}
+
+
+def cache_quality(source_key: Optional[str], format_: str, quality: int):
+    """Remember the quality chosen for a thumbnail of a source"""
+    if not source_key:
+        return
+    qualities = cached_qualities(source_key)
+    if qualities.get(format_) != quality:
+        qualities[format_] = quality
+        default.kvstore._set(source_key, qualities, identity='quality')
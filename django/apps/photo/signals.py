@@ -6,6 +6,7 @@ from django.dispatch import receiver
 from sorl.thumbnail.helpers import ThumbnailError
 
 from apps.photo import tasks
+from apps.photo.hashindex import hash_index
 
 # from celery import chain
 # from apps.photo import tasks
@@ -17,24 +18,40 @@ logger = logging.getLogger(__name__)
 def image_post_save(sender, instance, created, update_fields, **kwargs):
     """Schedule autocropping and rebuild thumbnail"""
 
-    if instance.original is None:
+    if not instance.original:
         # wait until image was saved with image file
         return
-    # Celery tasks immutable signatures
-    autocrop_signature = tasks.autocrop_image_file.si(instance.pk)
-    post_save_signature = tasks.post_save_task.si(instance.pk)
+    if getattr(instance, '_pipeline', False):
+        # saved by a pipeline stage, the next stages run in the same task
+        return
     if not created:
         old = sender.objects.get(pk=instance.pk)
         if old.stat.get('md5'
                         ) and old.stat.get('md5') != instance.stat.get('md5'):
             # image file has changed. Invalidate thumbnails.
             instance.delete_thumbnails()
+    # Celery tasks immutable signatures
     if instance.cropping_method == instance.CROP_PENDING:
-        logger.debug('autocrop_signature %s' % instance)
-        # chain two task signatures
-        (autocrop_signature | post_save_signature).apply_async(countdown=0)
+        logger.debug('image pipeline %s' % instance)
+        tasks.run_image_pipeline.si(instance.pk).apply_async(countdown=0)
     elif not update_fields:
-        post_save_signature.apply_async(countdown=15)
+        tasks.run_image_pipeline.si(
+            instance.pk, stages=['fingerprint', 'renditions']
+        ).apply_async(countdown=15)
+
+
+@receiver(models.signals.post_save, sender='stories.StoryImage')
+def story_image_post_save(sender, instance, raw, **kwargs):
+    """Build srcset thumbnails for the crop size of the story image"""
+    if raw:
+        return
+    instance.imagefile.queue_srcset(instance.crop_size)
+
+
+@receiver(models.signals.post_delete, sender='photo.ImageFile')
+def image_post_delete(sender, instance, **kwargs):
+    """Remove image from the hash index of all processes"""
+    hash_index.remove(instance.pk)
 
 
 @receiver(models.signals.pre_delete, sender='photo.ImageFile')
@@ -4,49 +4,63 @@ import logging
 from pathlib import Path
 import re
 import subprocess
-from typing import BinaryIO, List
+from typing import BinaryIO, Dict, List, Set
 
-from PIL import Image
-from celery import shared_task
+from celery import group, shared_task
 from celery.task import periodic_task
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
 
 from apps.core import staging
 from apps.issues.models import current_issue
 
-from .cropping.boundingbox import CropBox
-from .cropping.crop_detector import Feature, HybridDetector
-from .models import ImageFile
+from .duplicates import find_duplicates
+from .models import DuplicateGroup, ImageFile
+from .pipeline import autocrop, run_pipeline
 
 logger = logging.getLogger(__name__)
 
+# Pending autocrop backlog is worked off in small batches on a separate
+# queue, so new uploads do not have to wait for the whole backlog.
+BACKLOG_QUEUE = settings.CELERY_TASK_DEFAULT_QUEUE + '.backlog'
+BACKLOG_BATCH_SIZE = 25
+BACKLOG_MAX_BATCHES = 4  # batches in flight at the same time
+BACKLOG_CACHE_KEY = 'autocrop_backlog'
+BACKLOG_TIMEOUT = 60 * 15  # seconds before batches are dispatched again
+
 
 @shared_task(ignore_result=True)
-def process_image_upload(pk: int, temporary_file: str) -> bool:
-    """Process uploaded files"""
-    imagefile = Path(temporary_file)
-    if not imagefile.exists():
-        msg = f'temporary image {imagefile} does not exist'
-        logger.error(msg)
-        return False
+def run_image_pipeline(
+    pk: int, temporary_file: str = None, stages: List[str] = None
+) -> bool:
+    """Run the image pipeline, with the uploaded file if given"""
     try:
         instance = ImageFile.objects.get(pk=pk)
     except ImageFile.DoesNotExist:
         logger.warning(f'ImageFile id: {pk} does not exist')
         return False
-    logger.debug(f'process image start: {instance} {instance.dimensions}')
-    if instance.original:
-        msg = f'ImageFile {instance} has an original'
-        logger.warning(msg)
+    if temporary_file:
+        if not Path(temporary_file).exists():
+            msg = f'temporary image {temporary_file} does not exist'
+            logger.error(msg)
+            return False
+        if instance.original:
+            msg = f'ImageFile {instance} has an original'
+            logger.warning(msg)
+            return False
+    elif not instance.original:
+        logger.debug(f'ImageFile {instance} has no original')
         return False
-    try:
-        instance.process_uploaded_file(Image.open(imagefile))
-    except Exception:
-        logger.exception('processing failed')
-    instance.save()
-    imagefile.unlink()  # clean up
-    logger.debug(f'process image finish: {instance} {instance.dimensions}')
-    return True
+    logger.debug(f'image pipeline start: {instance} {instance.dimensions}')
+    return run_pipeline(instance, temporary_file, stages)
+
+
+@shared_task(ignore_result=True)
+def process_image_upload(pk: int, temporary_file: str) -> bool:
+    """Process uploaded files"""
+    return run_image_pipeline(pk, temporary_file)
 
 
 @shared_task(ignore_result=True)
@@ -55,31 +69,7 @@ def autocrop_image_file(pk: int) -> bool:
         instance = ImageFile.objects.get(pk=pk)
     except ImageFile.DoesNotExist:
         return False
-    if not instance.original:
-        logger.warning(f'Try to autocrop ImageFile with no file: {pk}')
-        return False
-    if instance.is_profile_image:
-        detector = HybridDetector(n=1)
-    else:
-        detector = HybridDetector(n=10)
-    source_image = instance.large  # at least 600 x 600 pixels
-    features = detector.detect_features(source_image.read())
-    if not features:
-        crop_box = CropBox.basic()
-        cropping_method = ImageFile.CROP_NONE
-    else:
-        x, y = features[0].center
-        left, top, right, bottom = sum(features)  # type: ignore
-        crop_box = CropBox(left, top, right, bottom, x, y)
-        cropping_method = determine_cropping_method(features)
-    instance.crop_box = crop_box
-    instance.cropping_method = cropping_method
-    logger.debug(
-        '%s %s %s' %
-        (instance, crop_box, instance.get_cropping_method_display())
-    )
-    instance.save(update_fields=['crop_box', 'cropping_method'])
-    return True
+    return autocrop(instance)
 
 
 @shared_task(ignore_result=True)
@@ -91,44 +81,114 @@ def post_save_task(pk: int) -> bool:
         return False
     if not instance.original:
         return
-    instance.build_thumbs()
-    instance.calculate_hashes()
-    return True
+    return run_pipeline(instance, stages=['renditions', 'fingerprint'])
+
+
+@shared_task(ignore_result=True)
+def autocrop_backlog_batch(pks: List[int]) -> int:
+    """Autocrop and build thumbnails for a batch of pending images"""
+    count = 0
+    for instance in ImageFile.objects.pending().filter(pk__in=pks):
+        if run_pipeline(instance, stages=['autocrop', 'renditions']):
+            count += 1
+        elif instance.cropping_method == ImageFile.CROP_PENDING:
+            logger.warning(f'pending autocrop broke: {instance.pk}')
+            ImageFile.objects.filter(pk=instance.pk).update(
+                cropping_method=ImageFile.CROP_NONE
+            )
+    return count
 
 
-def determine_cropping_method(features: List[Feature]) -> int:
-    """Determines which cropping method label to use"""
-    if 'face' in features[-1].label:
-        if len(features) == 1:  # single face
-            return ImageFile.CROP_PORTRAIT
-        return ImageFile.CROP_FACES  # multiple faces
-    return ImageFile.CROP_FEATURES  # no faces
+@shared_task(ignore_result=True)
+def build_srcset(
+    pk: int, crop_size: List[int] = None, width: int = None
+) -> bool:
+    """Build srcset thumbnails of one width, in each of the formats"""
+    try:
+        instance = ImageFile.objects.get(pk=pk)
+    except ImageFile.DoesNotExist:
+        logger.debug(f'imagefile {pk} does not exist')
+        return False
+    return instance.build_srcset(crop_size and tuple(crop_size), width)
 
 
-@periodic_task(run_every=timedelta(minutes=10))
+@shared_task(ignore_result=True)
+def make_placeholders(pks: List[int]) -> int:
+    """Make placeholders for a batch of images from their small thumbnail"""
+    count = 0
+    for instance in ImageFile.objects.needs_placeholder().filter(pk__in=pks):
+        if instance.calculate_placeholder():
+            count += 1
+    return count
+
+
+@periodic_task(run_every=timedelta(minutes=1), ignore_result=True)
 def clean_up_pending_autocrop() -> int:
-    # In case some images have ended up in limbo
-    limit = 200  # do in batches
-    image_pks = ImageFile.objects.filter(
-        cropping_method=ImageFile.CROP_PENDING
-    ).exclude(
-        original=None,
-    ).order_by('?').values_list(
-        'pk', flat=True
-    )[:limit]
-
-    for image_pk in image_pks[:limit]:
-        try:
-            autocrop_image_file(image_pk)
-            post_save_task(image_pk)
-        except Exception:
-            logger.exception(f'pending autocrop broke: {image_pk}')
-            ImageFile.objects.filter(pk=image_pk).update(
-                cropping_method=ImageFile.CROP_NONE
-            )
+    """Dispatch the next batches of the pending autocrop backlog.
+
+    Images are picked newest first. Recent uploads are skipped, since
+    they are already queued by the post save signal. No new batches are
+    dispatched until the previous ones are done.
+    """
+    in_flight = cache.get(BACKLOG_CACHE_KEY) or []
+    pending = ImageFile.objects.pending().exclude(original=None)
+    if in_flight and pending.filter(pk__in=in_flight).exists():
+        return 0
+    image_pks = list(
+        pending.filter(
+            created__lt=timezone.now() - timedelta(minutes=5)
+        ).order_by('-created').values_list('pk', flat=True)
+        [:BACKLOG_BATCH_SIZE * BACKLOG_MAX_BATCHES]
+    )
+    if not image_pks:
+        return 0
+    cache.set(BACKLOG_CACHE_KEY, image_pks, BACKLOG_TIMEOUT)
+    batches = group(
+        autocrop_backlog_batch.si(image_pks[n:n + BACKLOG_BATCH_SIZE])
+        for n in range(0, len(image_pks), BACKLOG_BATCH_SIZE)
+    )
+    batches.apply_async(queue=BACKLOG_QUEUE)
+    logger.info(f'dispatched {len(image_pks)} pending autocrops')
     return len(image_pks)
 
 
+@shared_task(ignore_result=True)
+def find_duplicate_images(cutoff: int = 8) -> int:
+    """Update unreviewed DuplicateGroups with a fresh clustering of the
+    whole image archive. Groups with unchanged images are kept."""
+    clusters = find_duplicates(ImageFile.objects.all(), cutoff)
+    Membership = DuplicateGroup.images.through
+    with transaction.atomic():
+        members = {}  # type: Dict[int, Set[int]]
+        for group_id, pk in Membership.objects.values_list(
+            'duplicategroup_id', 'imagefile_id'
+        ):
+            members.setdefault(group_id, set()).add(pk)
+        existing = {frozenset(pks): pk for pk, pks in members.items()}
+        new = []
+        for cluster in clusters:
+            group_id = existing.pop(frozenset(cluster.pks), None)
+            if group_id is None:
+                new.append(cluster)
+            else:
+                DuplicateGroup.objects.filter(pk=group_id).exclude(
+                    method=cluster.method, distance=cluster.distance
+                ).update(method=cluster.method, distance=cluster.distance)
+        # groups that have changed, and groups where all images are deleted
+        DuplicateGroup.objects.exclude(pk__in=list(members)).delete()
+        DuplicateGroup.objects.filter(pk__in=existing.values()).delete()
+        groups = DuplicateGroup.objects.bulk_create(
+            DuplicateGroup(method=cluster.method, distance=cluster.distance)
+            for cluster in new
+        )
+        Membership.objects.bulk_create(
+            Membership(duplicategroup_id=group.pk, imagefile_id=pk)
+            for group, cluster in zip(groups, new)
+            for pk in cluster.pks
+        )
+    return len(clusters)
+
+
 @shared_task(ignore_result=True)
 def upload_imagefile_to_desken(pk, target=None):
     """Upload imagefile to desken server."""
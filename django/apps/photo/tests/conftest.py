@@ -1,7 +1,9 @@
 """Module scoped pytest fixtures"""
 from pathlib import PosixPath as Path
 
+from PIL import Image
 from django.core.files import File
+import piexif
 import pytest
 from sorl.thumbnail import default
 
@@ -20,6 +22,16 @@ def jpeg_file():
     return img
 
 
+@pytest.fixture(scope='module')
+def rotated_jpeg_file(jpeg_file, tmp_path_factory):
+    """The jpeg fixture stored sideways, with exif orientation 6"""
+    img = tmp_path_factory.mktemp('rotated') / 'rotated.jpg'
+    exif = piexif.dump({'0th': {piexif.ImageIFD.Orientation: 6}})
+    with Image.open(jpeg_file) as upright:
+        upright.rotate(90, expand=True).save(img, 'jpeg', exif=exif)
+    return img
+
+
 @pytest.fixture(scope='module')
 def png_file():
     img = Path(__file__).parent / 'fixtureimage.png'
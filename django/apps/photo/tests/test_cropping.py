@@ -1,18 +1,33 @@
 """Tests of the cropping detectors."""
 
+from io import BytesIO
 import json
 
+import numpy
 import pytest
+from sorl.thumbnail.base import ThumbnailBackend
 
+from apps.photo.benchmark import (
+    Sample,
+    benchmark_detector,
+    crop_agreement,
+)
 from apps.photo.cropping.boundingbox import Box, CropBox
 from apps.photo.cropping.crop_detector import (
     Cascade,
     Feature,
     FeatureDetector,
+    ImagePyramid,
     KeypointDetector,
     MockFeatureDetector,
+    shared_detector,
+)
+from apps.photo.cropping.crop_engine import (
+    PillowCloseCropEngine,
+    calculate_crop,
+    close_crop,
+    draft_size,
 )
-from apps.photo.cropping.crop_engine import calculate_crop, close_crop
 
 
 @pytest.fixture(params=FeatureDetector.__subclasses__())
@@ -44,6 +59,63 @@ def test_calculate_crop():
     ) == Box(50, 0, 150, 100)
 
 
+def test_draft_size():
+    # no crop, fit inside geometry
+    assert draft_size(4000, 3000, (200, 200)) == (201, 151)
+    # close crop needs a larger part of the image
+    crop = Box(500, 0, 3500, 3000)
+    assert draft_size(4000, 3000, (150, 150), crop) == (201, 151)
+    # never upscale
+    assert draft_size(100, 100, (200, 200)) == (100, 100)
+
+
+def test_pillow_engine(jpeg_file):
+    engine = PillowCloseCropEngine()
+    options = dict(
+        ThumbnailBackend.default_options,
+        crop_box=CropBox.basic().serialize(),
+        expand=0,
+    )
+    with jpeg_file.open('rb') as fp:
+        image = engine.get_image(fp)
+        thumb = engine.create(image, (50, 20), options)
+    assert thumb.size == (50, 20)
+    assert thumb.mode == 'RGB'
+    assert 'crop_box' not in options
+
+
+def test_pillow_engine_draft(jpeg_file):
+    engine = PillowCloseCropEngine()
+    options = dict(ThumbnailBackend.default_options)
+    image = engine.get_image(BytesIO(jpeg_file.read_bytes()))
+    engine.draft(image, [((20, 20), options)])
+    assert image.size == (25, 25)  # scale 1/4
+    image = engine.get_image(BytesIO(jpeg_file.read_bytes()))
+    engine.draft(image, [((20, 20), options), ((90, 90), options)])
+    assert image.size == (100, 97)  # full size is needed
+
+
+def test_pillow_engine_orientation(jpeg_file, rotated_jpeg_file):
+    """Thumbnails of rotated jpegs are upright, also when cropped"""
+    engine = PillowCloseCropEngine()
+    upright = engine.get_image(BytesIO(jpeg_file.read_bytes()))
+    rotated = engine.get_image(BytesIO(rotated_jpeg_file.read_bytes()))
+    assert rotated.size == upright.size[::-1]
+    options = dict(
+        ThumbnailBackend.default_options,
+        crop_box=CropBox(0, 0, 0.5, 1, 0.25, 0.5).serialize(),
+    )
+    expected = engine.create(engine.copy_image(upright), (20, 40), options)
+    options['crop_box'] = CropBox(0, 0, 0.5, 1, 0.25, 0.5).serialize()
+    thumb = engine.create(engine.copy_image(rotated), (20, 40), options)
+    assert thumb.size == expected.size == (20, 40)
+    difference = numpy.abs(
+        numpy.asarray(thumb.convert('L'), dtype=int) -
+        numpy.asarray(expected.convert('L'), dtype=int)
+    )
+    assert difference.mean() < 10
+
+
 def test_cascade_loading():
     VALID_CASCADE = 'haarcascade_smile.xml'
     INVALID_CASCADE = 'no_such_cascade.xml'
@@ -88,6 +160,40 @@ def test_that_both_file_and_bytes_work(jpeg_file):
     assert features == features2
 
 
+def test_image_pyramid(jpeg_file):
+    pyramid = ImagePyramid(jpeg_file)
+    assert pyramid.image.shape == (97, 100)
+    small = pyramid.resized(50)
+    assert small is pyramid.resized(50)  # cached
+    assert small.shape == (49, 51)
+    detector = KeypointDetector(n=5)
+    assert detector.detect_features(pyramid) == detector.detect_features(
+        jpeg_file
+    )
+
+
+def test_shared_detector_is_reused():
+    assert shared_detector(10) is shared_detector(10)
+    assert shared_detector(1) is not shared_detector(10)
+
+
+def test_crop_agreement():
+    basic = CropBox.basic()
+    assert crop_agreement(basic, basic) == (1.0, 0.0)
+    left_half = CropBox(0, 0, 0.5, 1, 0.25, 0.5)
+    assert crop_agreement(left_half, basic) == (0.5, 0.25)
+
+
+def test_benchmark_detector(jpeg_file):
+    reference = CropBox.basic().serialize()
+    sample = Sample('fixture', 'photo', jpeg_file.read_bytes(), reference)
+    result = benchmark_detector('hybrid', 200, [sample])
+    assert result.count == 1
+    assert list(result.stages)[:2] == ['decode', 'resize']
+    assert 'ORB' in result.stages
+    assert 0 < result.overlap <= 1
+
+
 def test_feature_operators():
     f1 = Feature(1, 'f1', 1, 2, 3, 4)
     f2 = Feature(2, 'f2', 2, 1, 4, 3)
@@ -0,0 +1,77 @@
+"""Tests for duplicate image clustering"""
+import numpy
+import pytest
+
+from apps.photo.duplicates import (
+    DuplicateGraph,
+    diameter,
+    imagehash_duplicates,
+)
+from apps.photo.models import DuplicateGroup, ImageFile, is_duplicate
+from apps.photo.tasks import find_duplicate_images
+
+
+def test_duplicate_graph():
+    graph = DuplicateGraph()
+    graph.add(1, 2, 'md5')
+    graph.add(1, 2, 'imagehash')  # identical files win
+    # chain of similar images is split around the best connected center
+    graph.add(3, 4, 'imagehash')
+    graph.add(4, 5, 'imagehash')
+    graph.add(5, 6, 'imagehash')
+    graph.add(6, 7, 'imagehash')
+    assert sorted(graph.groups()) == [
+        ([1, 2], 'md5'),
+        ([3, 4, 5], 'imagehash'),
+        ([6, 7], 'imagehash'),
+    ]
+
+
+def test_diameter():
+    hashes = numpy.array([[0] * 4, [0b1] * 4, [0b11] * 4], numpy.uint64)
+    assert diameter(hashes) == 2
+    assert diameter(hashes[:1]) == 0
+
+
+def test_imagehash_duplicates():
+    hashes = numpy.array([
+        [0, 0, 0, 0],
+        [0b1, 0b11, 0, 0],  # close to first
+        [2**64 - 1] * 4,  # far from both
+    ], numpy.uint64)
+    pks = numpy.array([10, 20, 30])
+    # the first pair shares several chunks, but is found once
+    assert list(imagehash_duplicates(pks, hashes)) == [(10, 20, 0)]
+
+
+@pytest.mark.django_db
+def test_find_duplicate_images(img):
+    img.save()
+    clone = ImageFile(original=img.original, stat=img.stat)
+    clone.save()
+    assert find_duplicate_images() == 1
+    group = DuplicateGroup.objects.get()
+    assert set(group.images.all()) == {img, clone}
+    assert find_duplicate_images() == 1
+    assert DuplicateGroup.objects.get() == group  # unchanged group is kept
+    group.merge()
+    assert ImageFile.objects.count() == 1
+    assert DuplicateGroup.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_merge_empty_group():
+    group = DuplicateGroup.objects.create(method=DuplicateGroup.MD5)
+    assert group.merge() is None
+    assert DuplicateGroup.objects.count() == 0
+
+
+def test_is_duplicate():
+    zero = {key: '0' * 16 for key in ImageFile.HASH_TYPES}
+    near = dict(zero, ahash='1' * 16, dhash='0' * 15 + '3')
+    far = {key: 'f' * 16 for key in ImageFile.HASH_TYPES}
+    assert is_duplicate(ImageFile(stat=zero), ImageFile(stat=near))
+    assert not is_duplicate(ImageFile(stat=zero), ImageFile(stat=far))
+    assert not is_duplicate(ImageFile(stat={}), ImageFile(stat={}))
+    same = ImageFile(stat={'md5': 'abc'})
+    assert is_duplicate(same, ImageFile(stat={'md5': 'abc'}))
@@ -1,13 +1,20 @@
 """ Tests for exif library """
 
+from io import BytesIO
+
+import PIL.Image
+import piexif
 import pytest
 
 from apps.photo.exif import (
+    TYPES,
     clean_exif_data,
     get_metadata,
+    parse_exif,
     parse_exif_timestamp,
     sanitize_image_exif,
     serialize_exif,
+    valid_exif_value,
 )
 from apps.photo.file_operations import pil_image
 
@@ -21,6 +28,56 @@ def test_serialize_exif(jpeg_file):
     assert meta.artist == 'Dennis the Dog'
 
 
+def test_parse_exif():
+    thumbnail = BytesIO()
+    PIL.Image.new('RGB', (16, 12)).save(thumbnail, 'jpeg')
+    exif = {
+        '0th': {
+            piexif.ImageIFD.Orientation: 6,
+            piexif.ImageIFD.Artist: 'Stépân'.encode('utf8'),
+            piexif.ImageIFD.ImageDescription: b'x' * 2000,
+        },
+        'Exif': {piexif.ExifIFD.DateTimeOriginal: b'1999:09:09 22:22:22'},
+        'GPS': {piexif.GPSIFD.GPSLatitudeRef: b'N'},
+        '1st': {},
+        'thumbnail': thumbnail.getvalue(),
+    }
+    blob = BytesIO()
+    PIL.Image.new('RGB', (40, 30)).save(blob, 'jpeg', exif=piexif.dump(exif))
+    exif_bytes, data = parse_exif(PIL.Image.open(blob))
+
+    # serializable data keeps rotation, but drops bloated values
+    assert data['Orientation'] == 6
+    assert data['Artist'] == 'Stépân'
+    assert data['DateTimeOriginal'].timetuple()[:6] == (1999, 9, 9, 22, 22, 22)
+    assert data['GPSInfo'] == {'1': 'N'}
+    assert 'ImageDescription' not in data
+
+    # pruned exif has no thumbnail and no rotation
+    pruned = piexif.load(exif_bytes)
+    assert pruned['thumbnail'] is None
+    assert pruned['0th'][piexif.ImageIFD.Orientation] == 1
+    assert piexif.ImageIFD.ImageDescription not in pruned['0th']
+    assert pruned['GPS'] == {piexif.GPSIFD.GPSLatitudeRef: b'N'}
+
+    # image without exif
+    assert parse_exif(PIL.Image.new('RGB', (4, 3))) == (b'', {})
+
+
+def test_valid_exif_value():
+    assert valid_exif_value(1, TYPES.Short)
+    assert valid_exif_value((1, 2, 3), TYPES.Byte)
+    assert not valid_exif_value(70000, TYPES.Short)
+    assert not valid_exif_value(-1, TYPES.Long)
+    assert valid_exif_value((1, 200), TYPES.Rational)
+    assert valid_exif_value(((59, 1), (55, 1)), TYPES.Rational)
+    assert not valid_exif_value((1, -2), TYPES.Rational)
+    assert valid_exif_value((1, -2), TYPES.SRational)
+    assert valid_exif_value(b'text', TYPES.Ascii)
+    assert not valid_exif_value('text', TYPES.Undefined)
+    assert not valid_exif_value(b'x' * 2000, TYPES.Ascii)
+
+
 def test_exif_strptime():
     dt = parse_exif_timestamp('1999:09:09 22:22:22')
 
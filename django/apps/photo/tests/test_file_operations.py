@@ -1,8 +1,13 @@
 """ Tests for exif library """
+from io import BytesIO
+
+from PIL import Image
 from django.core.files import File as DjangoFile
+import piexif
 import pytest
 
 from apps.photo.file_operations import (
+    fingerprint_file,
     get_exif,
     get_filesize,
     get_imagehashes,
@@ -61,3 +66,42 @@ def test_valid_image(jpeg_file, png_file, broken_image_file):
     assert not valid_image(broken_image_file)
     assert not valid_image('abc')
     assert not valid_image(jpeg_file.parent)
+
+
+def test_fingerprint_file(file, jpeg_file):
+    fingerprint = fingerprint_file(file)
+    assert fingerprint.md5 == get_md5(jpeg_file)
+    assert fingerprint.size == 2966
+    assert fingerprint.mimetype == 'image/jpeg'
+    assert str(fingerprint.imagehashes['ahash'])[:5] == 'ffcfc'
+    assert fingerprint.placeholder.startswith('data:image/')
+
+
+def test_fingerprint_broken_file(broken_image_file):
+    fingerprint = fingerprint_file(broken_image_file)
+    assert fingerprint.size == broken_image_file.stat().st_size
+    assert len(fingerprint.md5) == 32
+
+
+def test_fingerprint_decompression_bomb(jpeg_file, monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    fingerprint = fingerprint_file(jpeg_file)
+    assert fingerprint.size == 2966
+    assert fingerprint.mimetype is None
+    assert fingerprint.imagehashes == {}
+
+
+def test_fingerprint_exif_orientation(jpeg_file):
+    """Hashes are calculated from the upright image"""
+
+    def jpeg(image, **kwargs):
+        blob = BytesIO()
+        image.save(blob, 'jpeg', **kwargs)
+        return blob.getvalue()
+
+    photo = Image.open(jpeg_file)
+    exif = piexif.dump({'0th': {piexif.ImageIFD.Orientation: 6}})
+    rotated = fingerprint_file(jpeg(photo, exif=exif))
+    upright = fingerprint_file(jpeg(photo.rotate(270, expand=True)))
+    for key, value in upright.imagehashes.items():
+        assert rotated.imagehashes[key] - value <= 2, key
@@ -0,0 +1,44 @@
+"""Tests for the image rendering memory governor"""
+import pytest
+
+from apps.photo.governor import (
+    RenderBusy,
+    image_size,
+    render_slots,
+    slots_needed,
+)
+
+
+@pytest.fixture
+def governor(settings, tmpdir):
+    settings.IMAGE_RENDER_MEMORY = 8 * 2**20
+    settings.IMAGE_RENDER_SLOTS = 4
+    settings.IMAGE_RENDER_LOCK_DIR = str(tmpdir)
+    return settings
+
+
+def test_slots_needed(governor):
+    assert slots_needed(10, 10) == 1
+    assert slots_needed(512, 512) == 1  # 2 MB
+    assert slots_needed(600, 600) == 2
+    assert slots_needed(10000, 10000) == 4
+
+
+def test_image_size(jpeg_file):
+    assert image_size(jpeg_file.read_bytes()) == (100, 97)
+    assert image_size(b'not an image') is None
+
+
+def test_render_slots(governor):
+    with render_slots((600, 600)) as count:
+        assert count == 2
+        with render_slots((512, 512), timeout=0):
+            with pytest.raises(RenderBusy):
+                with render_slots((600, 600), timeout=0.3):
+                    pass
+        with render_slots((600, 600), timeout=0):
+            with pytest.raises(RenderBusy):
+                with render_slots(None, timeout=0):
+                    pass
+    with render_slots(None, timeout=0) as count:  # all slots are free again
+        assert count == 4
@@ -0,0 +1,79 @@
+"""Tests for the perceptual hash index"""
+import json
+
+import numpy
+import pytest
+
+from apps.photo.file_operations import image_to_fingerprint, pil_image
+from apps.photo.hashindex import (
+    ImageHashIndex,
+    combined_distance,
+    hamming_distances,
+)
+from apps.photo.models import ImageFile
+
+
+def test_hamming_distances():
+    haystack = numpy.array([[0, 2**64 - 1], [5, 5]], numpy.uint64)
+    needle = numpy.array([1, 0], numpy.uint64)
+    distances = hamming_distances(haystack, needle)
+    assert distances.tolist() == [[1, 64], [1, 2]]
+
+
+def test_combined_distance():
+    distances = numpy.array([[10, 1, 3, 2], [0, 0, 0, 64]])
+    assert combined_distance(distances).tolist() == [2, 0]
+
+
+@pytest.mark.django_db
+def test_hash_index(img):
+    index = ImageHashIndex()
+    img.save()
+    index.load()
+    assert len(index) == 1
+    hashes = img.imagehashes
+    assert index.similar(hashes) == [img.pk]
+
+    # updates are only applied to the loaded index
+    index.update(img.pk + 1, hashes)
+    assert sorted(index.similar(hashes)) == [img.pk, img.pk + 1]
+    index.remove(img.pk + 1)
+    assert index.similar(hashes) == [img.pk]
+
+    # images deleted by other processes are removed when syncing
+    index.update(img.pk + 1, hashes)
+    index.sync(force=True)
+    assert index.similar(hashes) == [img.pk]
+    ImageFile.objects.filter(pk=img.pk).delete()
+    # pruned when syncing, even if the published removal is missed
+    index.sync(force=True)
+    assert index.similar(hashes) == []
+
+
+@pytest.mark.django_db
+def test_hash_index_removal(img):
+    index = ImageHashIndex()
+    img.save()
+    index.load()
+    hashes = img.imagehashes
+    for pk in range(img.pk + 1, img.pk + 4):
+        index.update(pk, hashes)
+    # removals published by other processes
+    index._on_message({'data': json.dumps([img.pk + 1])})
+    assert len(index) == 4  # one tombstone
+    assert img.pk + 1 not in index.similar(hashes)
+    index._on_message({'data': 'not json'})
+    # tombstones are compacted when they are more than a quarter of the rows
+    index.remove(img.pk + 2)
+    assert len(index) == 2
+    assert sorted(index.similar(hashes)) == [img.pk, img.pk + 3]
+    pks, rows = index.arrays()
+    assert sorted(pks.tolist()) == [img.pk, img.pk + 3]
+
+
+@pytest.mark.django_db
+def test_fingerprint_search(img, jpeg_file):
+    img.save()
+    fingerprint = image_to_fingerprint(pil_image(jpeg_file))
+    result = ImageFile.objects.search(fingerprint=fingerprint)
+    assert list(result) == [img]
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+from sorl.thumbnail import default
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from apps.photo.kvstore import LocalCache
+
+
+def test_local_cache_lru():
+    cache = LocalCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)  # evicts least recently used
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    info = cache.info()
+    assert (info.hits, info.misses, info.currsize) == (2, 1, 2)
+
+
+def test_local_cache_ttl():
+    cache = LocalCache(ttl=-1)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+    assert cache.info().currsize == 0
+
+
+@pytest.mark.django_db
+def test_delete_thumbnails_invalidates_local_cache(img):
+    img.save()
+    thumb = img.small
+    kvstore = default.kvstore
+    assert kvstore.get(thumb) is not None
+    hits = kvstore.cache_info().hits
+    assert kvstore.get(thumb) is not None
+    assert kvstore.cache_info().hits == hits + 1
+    img.delete_thumbnails()
+    assert kvstore.get(thumb) is None
+
+
+def test_thumbnail_lists_are_not_cached():
+    """Lists of thumbnails are rewritten by other processes, so they are
+    always read from redis"""
+    kvstore = default.kvstore
+    kvstore._set('source', ['a'], identity='thumbnails')
+    key = add_prefix('source', identity='thumbnails')
+    assert kvstore.cache.get(key) is None
+    kvstore.connection.set(key, json.dumps(['a', 'b']))  # another process
+    assert kvstore._get('source', identity='thumbnails') == ['a', 'b']
+    kvstore._delete('source', identity='thumbnails')
@@ -1,4 +1,15 @@
+from io import BytesIO
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from PIL import Image
+from django.core.cache import cache
 import pytest
+from sorl.thumbnail import default
+
+from apps.photo import preprocess, tasks, thumbimage
+from apps.photo.models import ImageFile
+from apps.photo.thumb_backend import single_flight
 
 # from apps.photo.exif import extract_exif_data
 
@@ -74,3 +85,121 @@ def test_custom_field(img):
     # put x, y inside box
     assert img.crop_box.x == img.crop_box.left
     assert img.crop_box.y == img.crop_box.bottom
+
+
+@pytest.mark.django_db
+def test_build_thumbs(img):
+    """All renditions are created in one pass and stored in kvstore"""
+    img.save()
+    img.build_thumbs()
+    for size, options in img.renditions():
+        thumb = default.backend.get_thumbnail(img.original, size, **options)
+        assert default.kvstore.get(thumb) is not None
+
+
+@pytest.mark.django_db
+def test_get_many_thumbnails(img):
+    """Thumbnails of several sizes are looked up together"""
+    img.save()
+    requests = [
+        (img.original, *img.thumbnail_spec(name))
+        for name in ['small', 'large']
+    ]
+    small, large = default.backend.get_many_thumbnails(requests)
+    assert large.name == img.large.name
+    assert default.kvstore.get(large) is not None
+    cached = default.kvstore.get_many([large, small])
+    assert [t.name for t in cached] == [large.name, small.name]
+
+
+@pytest.mark.django_db
+def test_thumbnail_url(img, client):
+    """Thumbnail urls are computed without creating the thumbnail"""
+    img.save()
+    img.rename_file()  # normalized file name ends with the primary key
+    img.save()
+    img.delete_thumbnails()
+    url = img.thumbnail_url('large')
+    assert Path(url).stem == Path(img.original.name).stem
+    response = client.get(url)  # fallback view creates the thumbnail
+    assert response.status_code == 302
+    assert img.large.url == url == response.url
+    # the image is found by primary key only
+    unknown = url.replace(f'.{img.pk:0>5}.', '.')
+    assert client.get(unknown).status_code == 404
+
+
+@pytest.mark.django_db
+def test_thumbnail_url_without_fallback_view(img, settings, monkeypatch):
+    """Without a fallback view, missing thumbnails are built in the
+    background and the original is used until then"""
+    settings.THUMBNAIL_FALLBACK_VIEW = False
+    signature = MagicMock()
+    monkeypatch.setattr(tasks.run_image_pipeline, 'si', signature)
+    img.save()
+    img.delete_thumbnails()
+    cache.delete(f'queue_renditions:{img.pk}')
+    assert img.thumbnail_url('large') == img.original.url
+    assert img.thumbnail_url('small') == img.original.url
+    signature.assert_called_once_with(img.pk, stages=['renditions'])
+
+    img.build_thumbs()
+    fresh = ImageFile.objects.get(pk=img.pk)
+    thumbimage.prefetch_thumbnails([(fresh, [fresh.thumbnail_name('large')])])
+    monkeypatch.setattr(thumbimage, 'lookup_thumbnails', None)  # prefetched
+    assert fresh.thumbnail_url('large') == img.large.url
+
+
+@pytest.mark.django_db
+def test_srcset(img, monkeypatch):
+    """Srcset only includes thumbnails that have been built. Missing
+    thumbnails are built in background tasks, one for each width."""
+    signature = MagicMock()
+    monkeypatch.setattr(tasks.build_srcset, 'si', signature)
+    img.save()
+    img.delete_thumbnails()
+    cache.delete(f'queue_srcset:{img.srcset_names()[0]}')
+    assert img.srcset() == []
+    signature.assert_called_once_with(img.pk, None, img.full_width)
+    assert img.build_srcset(width=img.full_width)
+    sources = dict(img.srcset())
+    assert list(sources)[-1] == 'image/jpeg'
+    for mimetype, srcset in sources.items():
+        (url, width), = srcset  # no width larger than the original
+        assert width == img.full_width
+        assert Path(url).stem == Path(img.original.name).stem
+    img.build_srcset(crop_size=(1200, 675))
+    cropped = dict(img.srcset(crop_size=(1200, 675)))
+    assert [w for url, w in cropped['image/jpeg']] == [400]
+    assert img.srcset(crop_size=(1200, 1200)) == []
+
+
+def test_single_flight_lock():
+    with single_flight('foo') as acquired:
+        assert acquired
+        with single_flight('foo', blocking=False) as acquired_again:
+            assert not acquired_again
+        with single_flight('bar', blocking=False) as other_key:
+            assert other_key
+    with single_flight('foo', blocking=False) as acquired:
+        assert acquired
+
+
+def test_single_flight_refresh():
+    with single_flight('foo') as acquired:
+        lock = acquired.lock
+        lock.redis.pexpire(lock.name, 1000)
+        acquired.refreshed -= 30  # thirty seconds since the last refresh
+        acquired.refresh()
+        assert lock.redis.pttl(lock.name) > 30000
+
+
+def test_draft_decode(monkeypatch):
+    """Large jpeg images are decoded at reduced size"""
+    monkeypatch.setattr(preprocess, 'IMAGE_AREA_LIMIT', 200 * 150)
+    blob = BytesIO()
+    Image.new('RGB', (1600, 1200), 'red').save(blob, 'jpeg')
+    pim = ImageFile().draft_decode(Image.open(blob))
+    assert pim.size == (400, 300)  # scaled by 1/4, still above the limit
+    pim = ImageFile().reduce_dimensions(pim)
+    assert pim.size == (200, 150)
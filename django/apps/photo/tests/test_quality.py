@@ -0,0 +1,84 @@
+"""Tests for quality search with a perceptual metric"""
+from io import BytesIO
+
+from PIL import Image
+import numpy
+from sorl.thumbnail import default
+
+from apps.photo.cropping.crop_engine import (
+    PillowCloseCropEngine,
+    QualitySearchMixin,
+)
+from apps.photo.quality import (
+    QUALITY_RANGE,
+    SEARCH_WINDOW,
+    cache_quality,
+    cached_qualities,
+    grayscale,
+    search_quality,
+    ssim,
+)
+
+
+def encoder(image):
+    def encode(quality):
+        blob = BytesIO()
+        image.save(blob, 'jpeg', quality=quality)
+        return blob.getvalue()
+
+    return encode
+
+
+def test_ssim():
+    noise = numpy.random.RandomState(0).randint(0, 255, (64, 64))
+    assert ssim(noise, noise) == 1.0
+    assert ssim(noise, noise.T) < 0.1
+    assert 0.9 < ssim(noise, noise // 2 * 2) < 1.0
+
+
+def test_search_quality(jpeg_file):
+    flat = Image.new('RGB', (64, 64), 'navy')
+    reference = numpy.asarray(flat.convert('L'))
+    quality, data = search_quality(encoder(flat), reference, target=0.95)
+    assert quality == QUALITY_RANGE[0]
+    assert grayscale(data).shape == (64, 64)
+
+    photo = Image.open(jpeg_file)
+    reference = numpy.asarray(photo.convert('L'))
+    low, _ = search_quality(encoder(photo), reference, target=0.9)
+    high, _ = search_quality(encoder(photo), reference, target=0.97)
+    assert QUALITY_RANGE[0] <= low <= high <= QUALITY_RANGE[1]
+    # the target cannot be reached, so the highest quality is used
+    best, _ = search_quality(encoder(photo), reference, target=1.01)
+    assert best == QUALITY_RANGE[1]
+
+
+def test_search_quality_widens_guess(jpeg_file):
+    """Higher qualities are searched if the guess is too low"""
+    photo = Image.open(jpeg_file)
+    reference = numpy.asarray(photo.convert('L'))
+    unguessed, _ = search_quality(encoder(photo), reference, target=0.99)
+    guessed, data = search_quality(
+        encoder(photo), reference, target=0.99, guess=QUALITY_RANGE[0]
+    )
+    assert guessed > QUALITY_RANGE[0] + SEARCH_WINDOW
+    assert guessed < QUALITY_RANGE[1]
+    assert abs(guessed - unguessed) <= 2
+    assert ssim(reference, grayscale(data)) >= 0.99
+
+
+def test_engine_grayscale():
+    """Engines without their own grayscale use a png round trip"""
+    engine = PillowCloseCropEngine()
+    image = Image.new('RGB', (10, 8), 'orange')
+    gray = QualitySearchMixin.grayscale(engine, image)
+    assert gray.shape == (8, 10)
+    assert (gray == engine.grayscale(image)).all()
+
+
+def test_cached_qualities():
+    assert cached_qualities(None) == {}
+    cache_quality('foo', 'JPEG', 50)
+    cache_quality('foo', 'WEBP', 60)
+    assert cached_qualities('foo') == {'JPEG': 50, 'WEBP': 60}
+    default.kvstore._delete('foo', identity='quality')
@@ -2,7 +2,18 @@ from django.core.files import File
 import pytest
 
 from apps.photo.models import ImageFile
-from apps.photo.tasks import autocrop_image_file, post_save_task
+from apps.photo.pipeline import (
+    PipelineContext,
+    reset_metrics,
+    run_pipeline,
+    stage_metrics,
+)
+from apps.photo.tasks import (
+    autocrop_backlog_batch,
+    autocrop_image_file,
+    make_placeholders,
+    post_save_task,
+)
 
 
 @pytest.mark.django_db
@@ -22,3 +33,88 @@ def test_post_save(jpeg_file):
     img.refresh_from_db()
     assert img.stat.get('md5')
     assert img._imagehash
+
+
+@pytest.mark.django_db
+def test_autocrop_backlog_batch(jpeg_file):
+    img = ImageFile()
+    with jpeg_file.open('rb') as fp:
+        img.original.save('foobar.jpg', File(fp))
+    ImageFile.objects.filter(pk=img.pk).update(
+        cropping_method=ImageFile.CROP_PENDING
+    )
+    assert autocrop_backlog_batch([img.pk, img.pk + 1]) == 1
+    assert not ImageFile.objects.pending().filter(pk=img.pk).exists()
+
+
+@pytest.mark.django_db
+def test_make_placeholders(jpeg_file):
+    img = ImageFile()
+    with jpeg_file.open('rb') as fp:
+        img.original.save('foobar.jpg', File(fp))
+    ImageFile.objects.filter(pk=img.pk).update(placeholder='')
+    assert ImageFile.objects.needs_placeholder().filter(pk=img.pk).exists()
+    assert make_placeholders([img.pk]) == 1
+    img.refresh_from_db()
+    assert img.placeholder.startswith('data:image/')
+    assert not ImageFile.objects.needs_placeholder().exists()
+    # done already
+    assert make_placeholders([img.pk]) == 0
+
+
+@pytest.mark.django_db
+def test_image_pipeline(jpeg_file):
+    img = ImageFile()
+    with jpeg_file.open('rb') as fp:
+        img.original.save('foobar.jpg', File(fp))
+    ImageFile.objects.filter(pk=img.pk).update(
+        cropping_method=ImageFile.CROP_PENDING, _imagehash='', stat={}
+    )
+    img = ImageFile.objects.get(pk=img.pk)
+    img.delete_thumbnails()
+    reset_metrics()
+
+    assert run_pipeline(img)
+    img.refresh_from_db()
+    assert img.cropping_method != img.CROP_PENDING
+    assert img.stat.get('md5')
+    assert img._imagehash
+
+    metrics = stage_metrics()
+    assert [m.runs for m in metrics.values()] == [1, 1, 1, 1]
+    assert not any(m.failures for m in metrics.values())
+    # the original is read from storage once, and shared by all stages
+    assert metrics['fingerprint'].bytes_read == img.stat.size
+    assert metrics['autocrop'].bytes_read == 0
+    assert metrics['renditions'].bytes_read == 0
+
+
+def test_detection_image_orientation(jpeg_file, rotated_jpeg_file):
+    """Features are detected in the upright image"""
+    upright = PipelineContext(ImageFile())
+    upright.data = jpeg_file.read_bytes()
+    rotated = PipelineContext(ImageFile())
+    rotated.data = rotated_jpeg_file.read_bytes()
+    expected = upright.detection_image().image.astype(int)
+    image = rotated.detection_image().image.astype(int)
+    assert image.shape == expected.shape
+    assert abs(image - expected).mean() < 10
+
+
+@pytest.mark.django_db
+def test_image_pipeline_process_fails(jpeg_file, tmp_path, monkeypatch):
+    """The image is saved and the upload removed if processing fails"""
+    img = ImageFile()
+    img.save()
+    upload = tmp_path / 'upload.jpg'
+    upload.write_bytes(jpeg_file.read_bytes())
+
+    def broken(self, image):
+        self.dimensions = image.size
+        raise OSError('broken')
+
+    monkeypatch.setattr(ImageFile, 'process_uploaded_file', broken)
+    assert not run_pipeline(img, str(upload))
+    assert not upload.exists()
+    img.refresh_from_db()
+    assert img.dimensions == (100, 97)
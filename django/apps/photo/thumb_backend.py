@@ -1,11 +1,348 @@
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from io import BytesIO
+import logging
 import os.path
+import time
+from typing import Dict
 
-from sorl.thumbnail.base import EXTENSIONS, ThumbnailBackend
+from PIL import Image
+from redis.exceptions import LockError
+from sorl.thumbnail import default
+from sorl.thumbnail.base import EXTENSIONS as SORL_EXTENSIONS
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
 from sorl.thumbnail.conf import settings
 from sorl.thumbnail.helpers import serialize, tokey
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.parsers import parse_geometry
+
+from .governor import image_size, render_slots
+
+logger = logging.getLogger(__name__)
+
+# seconds before a thumbnail lock expires. Locks are refreshed before each
+# rendition, so this must cover waiting for render slots and one render.
+LOCK_TIMEOUT = 60
+LOCK_WAIT = 20  # seconds to wait for another process to create a thumbnail
+EXTENSIONS = dict(SORL_EXTENSIONS, AVIF='avif')
+
+
+def get_many(kvstore, image_files):
+    """Get several image files from key value store. Uses a single request
+    if the key value store supports it."""
+    if hasattr(kvstore, 'get_many'):
+        return kvstore.get_many(image_files)
+    return [kvstore.get(image_file) for image_file in image_files]
+
+
+class FlightLock:
+    """Redis lock held by the process that creates a thumbnail. Is true if
+    the lock was acquired."""
+
+    def __init__(self, lock=None, acquired=True):
+        self.lock = lock
+        self.acquired = acquired
+        self.refreshed = time.monotonic()
+
+    def __bool__(self):
+        return self.acquired
+
+    def refresh(self):
+        """Reset the time before the lock expires to `LOCK_TIMEOUT`, so it
+        is not taken over by another process during a long render."""
+        if self.lock is None or not self.acquired:
+            return
+        now = time.monotonic()
+        try:
+            self.lock.extend(now - self.refreshed)
+        except LockError:
+            logger.warning(f'thumbnail lock {self.lock.name} expired')
+        self.refreshed = now
+
+    def release(self):
+        if self.lock is None or not self.acquired:
+            return
+        try:
+            self.lock.release()
+        except LockError:
+            logger.warning(f'thumbnail lock {self.lock.name} expired')
+
+
+@contextmanager
+def single_flight(key, blocking=True):
+    """Redis lock so that only one process creates each thumbnail.
+
+    Yields a `FlightLock`, which is true if the lock was acquired. A
+    blocking lock waits at most `LOCK_WAIT` seconds for other processes.
+    """
+    connection = getattr(default.kvstore, 'connection', None)
+    if connection is None:  # not a redis kvstore
+        yield FlightLock()
+        return
+    lock = connection.lock(
+        f'{settings.THUMBNAIL_KEY_PREFIX}||lock||{key}', timeout=LOCK_TIMEOUT
+    )
+    acquired = lock.acquire(blocking=blocking, blocking_timeout=LOCK_WAIT)
+    flight = FlightLock(lock, acquired)
+    try:
+        yield flight
+    finally:
+        flight.release()
+
+
+@lru_cache()
+def engine_supports(format_: str) -> bool:
+    """Check if the thumbnail engine can write an image format. AVIF
+    support depends on which codecs are installed, so a tiny image is
+    encoded once in each process."""
+    blob = BytesIO()
+    Image.new('RGB', (8, 8), 'white').save(blob, 'png')
+    source = SourceImageFile('format-test.png', read=blob.getvalue)
+    engine = default.engine
+    try:
+        image = engine.get_image(source)
+        try:
+            return bool(engine._get_raw_data(image, format_, 50, {}))
+        finally:
+            engine.cleanup(image)
+    except Exception:
+        logger.info(f'thumbnail engine cannot write {format_}')
+        return False
+
+
+class SourceImageFile(ImageFile):
+    """Source image file that is read with a custom function, for instance
+    to reuse data that has already been read from storage."""
+
+    def __init__(self, file_, read, storage=None):
+        super().__init__(file_, storage)
+        self._read = read
+
+    def read(self):
+        return self._read()
 
 
 class KeepNameThumbnailBackend(ThumbnailBackend):
+    def get_thumbnail(self, file_, geometry_string, **options):
+        """Same as sorl's get_thumbnail, but when several processes request
+        the same missing thumbnail, only one of them creates it. Raises
+        `RenderBusy` if there is not enough memory to create it."""
+        if not file_:
+            return super().get_thumbnail(file_, geometry_string, **options)
+        source = ImageFile(file_)
+        options = self._prepare_options(source, options)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        thumbnail = ImageFile(name, default.storage)
+        cached = default.kvstore.get(thumbnail)
+        if cached:
+            return cached
+        with single_flight(thumbnail.key) as acquired:
+            cached = default.kvstore.get(thumbnail)
+            if cached:
+                return cached
+            if not acquired:
+                logger.warning(f'timed out waiting for {name}')
+            self._create_thumbnails(
+                source, [(geometry_string, options, thumbnail)], [acquired]
+            )
+            return thumbnail
+
+    def get_thumbnails(self, file_, renditions):
+        """Get or create several thumbnails of the same source file.
+
+        `renditions` is a list of `(geometry_string, options)` pairs. The
+        thumbnails that are not found in the key value store are all created
+        from a single decoded copy of the source image. Returns thumbnails
+        in the same order as `renditions`.
+        """
+        if not file_:
+            raise ValueError('falsey file_ argument in get_thumbnails()')
+        return self.get_many_thumbnails(
+            [(file_, geometry, options) for geometry, options in renditions],
+            raise_errors=True,
+        )
+
+    def get_many_thumbnails(self, requests, raise_errors=False):
+        """Get or create thumbnails of several source files.
+
+        `requests` is a list of `(file_, geometry_string, options)` tuples.
+        All thumbnails are looked up in the key value store at once, and
+        missing thumbnails are created from one decoded image per source.
+        Returns thumbnails in the same order as `requests`, with `None` for
+        thumbnails that could not be created.
+        """
+        sources = {}  # type: Dict[str, ImageFile]
+        items = []
+        for file_, geometry_string, options in requests:
+            if not isinstance(file_, ImageFile):
+                file_ = ImageFile(file_)
+            source = sources.setdefault(file_.key, file_)
+            options = self._prepare_options(source, dict(options))
+            name = self._get_thumbnail_filename(
+                source, geometry_string, options
+            )
+            thumbnail = ImageFile(name, default.storage)
+            items.append((source, geometry_string, options, thumbnail))
+
+        cached = get_many(default.kvstore, [item[-1] for item in items])
+        found = {}  # type: Dict[str, ImageFile]
+        missing = OrderedDict()  # type: Dict[str, Dict[str, tuple]]
+        for (source, *rendition), hit in zip(items, cached):
+            thumbnail = rendition[-1]
+            if hit:
+                found[thumbnail.name] = hit
+            elif thumbnail.name not in found:
+                found[thumbnail.name] = thumbnail
+                renditions = missing.setdefault(source.key, OrderedDict())
+                renditions[thumbnail.name] = rendition
+
+        failed = set()
+        for key, renditions in missing.items():
+            try:
+                source = sources[key]
+                created = self._create_single_flight(
+                    source, list(renditions.values())
+                )
+                found.update(created)
+            except Exception:
+                if raise_errors:
+                    raise
+                logger.exception(f'Cannot create thumbnails for {key}')
+                failed.update(renditions)
+        return [
+            None if item[-1].name in failed else found[item[-1].name]
+            for item in items
+        ]
+
+    def get_thumbnail_name(self, file_, geometry_string, **options):
+        """Storage name of a thumbnail. Computed without looking up anything
+        in the key value store or file storage."""
+        source = ImageFile(file_)
+        options = self._prepare_options(source, options)
+        return self._get_thumbnail_filename(source, geometry_string, options)
+
+    def _prepare_options(self, source, options):
+        """Fill in default options, same as `ThumbnailBackend.get_thumbnail`
+        does, so the thumbnail names are identical."""
+        if settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
+
+    def _create_single_flight(self, source, renditions):
+        """Create thumbnails that are not locked by other processes, then
+        wait for the others. Returns thumbnails by name."""
+        created = {}
+        with ExitStack() as stack:
+            mine, others, locks = [], [], []
+            for rendition in renditions:
+                acquired = stack.enter_context(
+                    single_flight(rendition[-1].key, blocking=False)
+                )
+                if acquired:
+                    mine.append(rendition)
+                    locks.append(acquired)
+                else:
+                    others.append(rendition)
+            # other processes may have finished since the first lookup
+            cached = get_many(default.kvstore, [r[-1] for r in mine])
+            mine = [r for r, hit in zip(mine, cached) if not hit]
+            created.update((hit.name, hit) for hit in cached if hit)
+            if mine:
+                self._create_thumbnails(source, mine, locks)
+
+        for rendition in others:
+            thumbnail = rendition[-1]
+            with single_flight(thumbnail.key) as acquired:
+                cached = default.kvstore.get(thumbnail)
+                if not cached:  # the other process failed or timed out
+                    self._create_thumbnails(source, [rendition], [acquired])
+                    cached = thumbnail
+            created[thumbnail.name] = cached
+        return created
+
+    def _create_thumbnails(self, source, renditions, locks=()):
+        """Decode source once and render all thumbnails from it. Render
+        slots are held while decoding, and for each rendition, so other
+        renders can run in between. `locks` are refreshed before each
+        rendition."""
+        engine = default.engine
+        data = source.read()
+        reader = SourceImageFile(source, read=lambda: data)
+        with render_slots(image_size(data)):
+            source_image = engine.get_image(reader)
+        try:
+            source.set_size(engine.get_image_size(source_image))
+            self._render_thumbnails(
+                engine,
+                source_image,
+                renditions,
+                source_key=source.key,
+                locks=locks,
+            )
+        finally:
+            engine.cleanup(source_image)
+
+        self._store_thumbnails(source, [t for *_, t in renditions])
+        logger.debug(f'created {len(renditions)} thumbnails for {source}')
+
+    def _render_thumbnails(
+        self, engine, source_image, renditions, source_key=None, locks=()
+    ):
+        """Render and write thumbnails from a source image that is not loaded
+        yet, starting with the largest one. If the engine supports it, the
+        source is decoded at a reduced size that is large enough for all the
+        renditions. Each rendition holds render slots for the decoded size
+        of the source while it is rendered."""
+        image_info = engine.get_image_info(source_image)
+        sized = []
+        for geometry_string, options, thumbnail in renditions:
+            ratio = engine.get_image_ratio(source_image, options)
+            geometry = parse_geometry(geometry_string, ratio)
+            sized.append((geometry, options, thumbnail))
+        if hasattr(engine, 'draft'):
+            engine.draft(source_image, [item[:2] for item in sized])
+
+        def area(item):
+            (width, height), options, thumbnail = item
+            return width * height
+
+        for geometry, options, thumbnail in sorted(
+            sized, key=area, reverse=True
+        ):
+            for lock in locks:
+                lock.refresh()
+            options['image_info'] = image_info
+            options['source_key'] = source_key  # for quality search
+            with render_slots(engine.get_image_size(source_image)):
+                image = engine.copy_image(source_image)
+                try:
+                    logger.debug(f'creating {thumbnail.name} at {geometry}')
+                    thumb = engine.create(image, geometry, options)
+                    engine.write(thumb, options, thumbnail)
+                    thumbnail.set_size(engine.get_image_size(thumb))
+                finally:
+                    engine.cleanup(image)
+
+    def _store_thumbnails(self, source, thumbnails):
+        """Add thumbnails to key value store, and update the source's list of
+        thumbnails with a single write."""
+        kvstore = default.kvstore
+        kvstore.get_or_set(source)
+        keys = set(kvstore._get(source.key, identity='thumbnails') or [])
+        for thumbnail in thumbnails:
+            thumbnail.set_size()
+            kvstore._set(thumbnail.key, thumbnail)
+            keys.add(thumbnail.key)
+        kvstore._set(source.key, list(keys), identity='thumbnails')
+
     def _get_thumbnail_filename(self, source, geometry_string, options):
         """
         Computes the destination filename.
@@ -1,12 +1,39 @@
+from collections import OrderedDict
 import logging
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from sorl import thumbnail
+from sorl.thumbnail import default
 from sorl.thumbnail.helpers import ThumbnailError
+from sorl.thumbnail.images import ImageFile
+
+from .thumb_backend import SourceImageFile, engine_supports, get_many
 
 logger = logging.getLogger(__name__)
 IMGSIZES = [200, 800, 1500]
+QUEUE_TIMEOUT = 60 * 5  # seconds before missing thumbnails are queued again
+
+
+def lookup_thumbnails(filenames):
+    """Find which thumbnails exist in the key value store, with a single
+    request. Returns a dict of filename to bool."""
+    filenames = list(filenames)
+    thumbnails = [ImageFile(name, default.storage) for name in filenames]
+    cached = get_many(default.kvstore, thumbnails)
+    return {name: bool(hit) for name, hit in zip(filenames, cached)}
+
+
+def prefetch_thumbnails(lookups):
+    """Look up thumbnails of several images with a single key value store
+    request. `lookups` are `(image, filenames)` pairs. The results are kept
+    on each image and used by `ThumbImageFile.thumbnails_exist`."""
+    lookups = list(lookups)
+    found = lookup_thumbnails({name for _, names in lookups for name in names})
+    for image, names in lookups:
+        known = image.__dict__.setdefault('_thumbnails_exist', {})
+        known.update((name, found[name]) for name in names)
 
 
 class BrokenImage:
@@ -23,25 +50,211 @@ class ThumbImageFile(models.Model):
 
     @property
     def small(self):
-        return self.thumbnail('{0}x{0}'.format(*IMGSIZES))
+        return self.named_thumbnail('small')
 
     @property
     def medium(self):
-        return self.thumbnail('{1}x{1}'.format(*IMGSIZES), upscale=False)
+        return self.named_thumbnail('medium')
 
     @property
     def large(self):
-        return self.thumbnail('{2}x{2}'.format(*IMGSIZES), upscale=False)
+        return self.named_thumbnail('large')
 
     @property
     def preview(self):
         """Return thumb of cropped image"""
+        return self.named_thumbnail('preview')
+
+    def thumbnail_spec(self, name):
+        """Geometry and options of a named thumbnail size"""
+        if name == 'small':
+            return '{0}x{0}'.format(*IMGSIZES), {}
+        if name == 'medium':
+            return '{1}x{1}'.format(*IMGSIZES), {'upscale': False}
+        if name == 'large':
+            return '{2}x{2}'.format(*IMGSIZES), {'upscale': False}
+        if name == 'preview':
+            return '150x150', self.preview_options()
+        raise ValueError(f'unknown thumbnail: {name}')
+
+    def named_thumbnail(self, name):
+        """Thumbnail of a named size, from the key value store"""
+        size, options = self.thumbnail_spec(name)
+        return self.thumbnail(size, **options)
+
+    def preview_options(self):
         options = dict(crop_box=self.get_crop_box())
         if self.category == self.DIAGRAM:
             options.update(expand=1)
         if self.category == self.PROFILE:
             options.update(expand=0.2, colorspace='GRAY')
-        return self.thumbnail('150x150', **options)
+        return options
+
+    def renditions(self):
+        """All thumbnail sizes that are built in advance. Srcset thumbnails
+        are built separately, see `queue_srcset`."""
+        from apps.stories.models.story import FACEBOOK_THUMBSIZE
+        crop_box = self.get_crop_box()
+        width, height = self.default_crop_size()
+        cropped = f'{width}x{height}'
+        named = ['small', 'medium', 'large', 'preview']
+        return [self.thumbnail_spec(name) for name in named] + [
+            (cropped, {'crop_box': crop_box, 'expand': 1}),
+            (FACEBOOK_THUMBSIZE, {'crop_box': crop_box}),
+        ]
+
+    def default_crop_size(self):
+        """Same as `StoryImage.crop_size` with automatic aspect ratio"""
+        from apps.stories.models.storychildren import DEFAULT_IMAGE_SIZE
+        width, height = DEFAULT_IMAGE_SIZE
+        if not self.is_photo and self.full_width:
+            height = width * (self.full_height / self.full_width)
+        return int(width), int(height)
+
+    def srcset_renditions(self, crop_size=None):
+        """Thumbnails for responsive images as `(format, width, geometry,
+        options)` tuples, in each of the srcset widths and formats. With a
+        `crop_size` of (width, height), thumbnails are cropped to the same
+        aspect ratio, like `StoryImage.cropped`. Widths larger than the
+        original image are skipped."""
+        formats = [
+            format_ for format_ in settings.THUMBNAIL_SRCSET_FORMATS
+            if engine_supports(format_)
+        ]
+        full_width = self.full_width or 0
+        full_height = self.full_height or 0
+        crop_box = self.get_crop_box()
+        ladder = []
+        for size in sorted(settings.THUMBNAIL_SRCSET_WIDTHS):
+            if crop_size:
+                height = int(size * crop_size[1] / crop_size[0])
+                geometry = f'{size}x{height}'
+                options = {'crop_box': crop_box, 'expand': 1}
+                width, largest = size, size >= full_width
+            else:  # fit inside a square, same as the `large` thumbnail
+                geometry = f'{size}x{size}'
+                options = {'upscale': False}
+                longest = max(full_width, full_height)
+                width, largest = size, size >= longest
+                if full_width:
+                    width = int(round(full_width * min(size / longest, 1)))
+            for format_ in formats:
+                quality = settings.THUMBNAIL_SRCSET_QUALITY.get(
+                    format_, settings.THUMBNAIL_QUALITY
+                )
+                ladder.append((
+                    format_,
+                    width,
+                    geometry,
+                    dict(options, format=format_, quality=quality),
+                ))
+            if largest and full_width:
+                break
+        return ladder
+
+    def srcset_names(self, crop_size=None):
+        """Storage names of the thumbnails in `srcset_renditions`"""
+        return [
+            default.backend.get_thumbnail_name(
+                self.original, geometry, **options
+            ) for *_, geometry, options in self.srcset_renditions(crop_size)
+        ]
+
+    def srcset(self, crop_size=None):
+        """Responsive image sources as `(mimetype, [(url, width), ...])`
+        pairs, preferred format first. Only thumbnails that are found in the
+        key value store are included, and missing ones are queued with
+        `queue_srcset`."""
+        if not self.original:
+            return []
+        ladder = self.srcset_renditions(crop_size)
+        names = self.srcset_names(crop_size)
+        exists = self.thumbnails_exist(names)
+        if not all(exists):
+            self.queue_srcset(crop_size)
+        sources = OrderedDict()
+        for rendition, name, found in zip(ladder, names, exists):
+            if not found:
+                continue
+            format_, width, *_ = rendition
+            mimetype = f'image/{format_.lower()}'
+            url = default.storage.url(name)
+            sources.setdefault(mimetype, []).append((url, width))
+        return list(sources.items())
+
+    def build_srcset(self, crop_size=None, width=None):
+        """Make sure srcset thumbnails exist, only those of `width` if given.
+        Returns True if they do."""
+        if not self.original:
+            return False
+        renditions = [
+            (geometry, options) for _, size, geometry, options in
+            self.srcset_renditions(crop_size) if width in (None, size)
+        ]
+        self.__dict__.pop('_thumbnails_exist', None)
+        try:
+            default.backend.get_thumbnails(self.original, renditions)
+        except Exception:
+            logger.exception(f'Cannot build srcset thumbnails for {self}')
+            return False
+        return True
+
+    def queue_srcset(self, crop_size=None):
+        """Build srcset thumbnails of a crop size in low priority background
+        tasks, one for each width. The tasks are queued at most once every
+        `QUEUE_TIMEOUT` seconds for each crop size and crop box."""
+        from .tasks import BACKLOG_QUEUE, build_srcset
+        if not (self.pk and self.original):
+            return
+        names = self.srcset_names(crop_size)
+        if not cache.add(f'queue_srcset:{names[0]}', True, QUEUE_TIMEOUT):
+            return
+        ladder = self.srcset_renditions(crop_size)
+        for width in sorted({width for _, width, *_ in ladder}):
+            build_srcset.si(self.pk, crop_size, width).apply_async(
+                queue=BACKLOG_QUEUE
+            )
+
+    def thumbnail_name(self, name):
+        """Storage name of a named thumbnail, computed without lookups"""
+        size, options = self.thumbnail_spec(name)
+        return default.backend.get_thumbnail_name(
+            self.original, size, **options
+        )
+
+    def thumbnails_exist(self, filenames):
+        """Whether each of the thumbnails is found in the key value store.
+        Results are kept on the instance, so a list of images can be looked up
+        in advance with `prefetch_thumbnails`."""
+        known = self.__dict__.setdefault('_thumbnails_exist', {})
+        unknown = [name for name in filenames if name not in known]
+        if unknown:
+            known.update(lookup_thumbnails(unknown))
+        return [known[name] for name in filenames]
+
+    def thumbnail_url(self, name):
+        """Url of a named thumbnail. If the web server falls back to
+        `views.thumbnail_fallback` for missing thumbnails, the url is
+        computed without any lookups. Otherwise missing thumbnails are built
+        in the background, and the url of the original is used until then."""
+        if not self.original:
+            return BrokenImage.url
+        filename = self.thumbnail_name(name)
+        if settings.THUMBNAIL_FALLBACK_VIEW or all(
+            self.thumbnails_exist([filename])
+        ):
+            return default.storage.url(filename)
+        self.queue_renditions()
+        return self.original.url
+
+    def queue_renditions(self):
+        """Build missing thumbnails in a background task. The task is queued
+        at most once every `QUEUE_TIMEOUT` seconds for each image."""
+        from .tasks import run_image_pipeline
+        if not self.pk:
+            return
+        if cache.add(f'queue_renditions:{self.pk}', True, QUEUE_TIMEOUT):
+            run_image_pipeline.si(self.pk, stages=['renditions']).apply_async()
 
     def thumbnail(self, size='x150', **options):
         """Create thumb of image"""
@@ -53,17 +266,25 @@ class ThumbImageFile(models.Model):
             logger.exception(f'Cannot create thumbnail for {self}')
             return BrokenImage()
 
-    def build_thumbs(self):
-        """Make sure thumbs exists"""
+    def build_thumbs(self, read=None):
+        """Make sure thumbs exists. The original is read with `read()` if
+        given, and only if some thumbnails are missing."""
         if not self.original:
             return
-        self.large
-        self.small
-        self.preview
+        source = self.original
+        if read is not None:
+            source = SourceImageFile(self.original, read)
+        self.__dict__.pop('_thumbnails_exist', None)
+        try:
+            default.backend.get_thumbnails(source, self.renditions())
+        except Exception:
+            logger.exception(f'Cannot build thumbnails for {self}')
+            return
         logger.info(f'built thumbs {self}')
 
     def delete_thumbnails(self, delete_file=False):
         """Delete all thumbnails, optinally delete original too"""
+        self.__dict__.pop('_thumbnails_exist', None)
         try:
             thumbnail.delete(self.original, delete_file=delete_file)
         except ThumbnailError:
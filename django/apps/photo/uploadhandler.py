@@ -0,0 +1,42 @@
+"""Upload handler that fingerprints image files while they are received."""
+
+import logging
+
+from PIL import Image
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+from .file_operations import StreamingFingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class FingerprintUploadHandler(TemporaryFileUploadHandler):
+    """Temporary file upload handler that calculates md5 of each chunk as it
+    streams in, and perceptual hashes when the file is complete.
+
+    The result is available as the `fingerprint` attribute of the uploaded
+    file, so duplicates can be found before anything is stored.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.fingerprint = StreamingFingerprint()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.fingerprint.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        try:
+            uploaded_file.fingerprint = self.fingerprint.finish(uploaded_file)
+        except (OSError, Image.DecompressionBombError):
+            logger.exception(f'cannot fingerprint {uploaded_file.name}')
+            return uploaded_file
+        finally:
+            uploaded_file.seek(0)
+        logger.debug(
+            f'upload {uploaded_file.name} md5: '
+            f'{uploaded_file.fingerprint.md5}'
+        )
+        return uploaded_file
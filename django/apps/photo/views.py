@@ -0,0 +1,50 @@
+"""Views for photos"""
+
+import logging
+from pathlib import PurePosixPath
+import re
+
+from django.http import Http404, HttpResponse
+from django.shortcuts import redirect
+from sorl.thumbnail import default
+
+from .governor import RenderBusy
+from .models import ImageFile
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail_fallback(request, path):
+    """Create a missing thumbnail when it is first requested.
+
+    With `THUMBNAIL_FALLBACK_VIEW`, thumbnail urls from
+    `ImageFile.thumbnail_url` are computed without checking that the file
+    exists. The web server should fall back to this view when a thumbnail is
+    not found. The image is found by the primary
+    key in the file name, so unknown urls are cheap to reject.
+    """
+    # thumbnails have the same file name as the original, except the suffix,
+    # and normalized file names end with the primary key, see `filename`
+    match = re.search(r'\.(\d+)$', PurePosixPath(path).stem)
+    if not match:
+        raise Http404('unknown thumbnail')
+    candidates = ImageFile.objects.exclude(original='').filter(
+        pk=int(match.group(1))
+    )
+    for image in candidates:
+        for size, options in image.renditions():
+            name = default.backend.get_thumbnail_name(
+                image.original, size, **options
+            )
+            if name == path:
+                try:
+                    thumbnail = default.backend.get_thumbnail(
+                        image.original, size, **options
+                    )
+                except RenderBusy:
+                    response = HttpResponse('busy', status=503)
+                    response['Retry-After'] = 5
+                    return response
+                return redirect(thumbnail.url)
+    logger.debug(f'no rendition matches {path}')
+    raise Http404('unknown thumbnail')
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from apps.stories.models import Story
+
+
+class Command(BaseCommand):
+    help = 'Calculate search vectors of stories in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Update all stories, not only those without search vector.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            dest='batch_size',
+            default=500,
+            help='Number of stories to update in each query.'
+        )
+
+    def handle(self, *args, **options):
+        stories = Story.objects.all()
+        if not options['all']:
+            stories = stories.filter(search_vector=None)
+        pks = list(stories.order_by('pk').values_list('pk', flat=True))
+        size = options['batch_size']
+        # each batch is a short transaction, so rows are not locked for long
+        for start in range(0, len(pks), size):
+            batch = pks[start:start + size]
+            Story.objects.filter(pk__in=batch).update_search_vector()
+            self.stdout.write(f'{start + len(batch)} of {len(pks)} stories')
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+# Trigram index for the fallback search of short queries. Headlines of
+# existing stories are filled in, same as `FullTextSearchQuerySet.headline`.
+
+BACKFILL = """
+UPDATE stories_story SET search_headline = concat(
+    working_title, ' ', kicker, ' ', title, ' ', lede
+);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0016_postgresql_create_trigram_extension'),
+        ('stories', '0013_auto_20181117_0241'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='search_headline',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+        migrations.RunSQL(
+            'CREATE INDEX stories_story_search_headline_trgm ON stories_story '
+            'USING gin (search_headline gin_trgm_ops);',
+            'DROP INDEX stories_story_search_headline_trgm;',
+        ),
+    ]
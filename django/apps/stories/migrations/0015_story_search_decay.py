@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+# Publication time bucket of existing stories, same as
+# `FullTextSearchQuerySet.update_search_decay`.
+
+BACKFILL = """
+UPDATE stories_story SET search_decay = least(15, greatest(1, floor(log(
+    2::numeric,
+    greatest(1, extract(epoch FROM (
+        now() - coalesce(publication_date, created)
+    )) / (60 * 60 * 24))::numeric
+))));
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0014_story_search_headline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='search_decay',
+            field=models.PositiveSmallIntegerField(
+                db_index=True, default=1, editable=False
+            ),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
@@ -1,4 +1,12 @@
+from datetime import datetime, timedelta
+import hashlib
+import heapq
+import json
+from typing import List, Optional, Tuple
+import unicodedata
+
 from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.lookups import PostgresSimpleLookup
 from django.contrib.postgres.search import (
     SearchQuery,
     SearchRank,
@@ -6,6 +14,7 @@ from django.contrib.postgres.search import (
     SearchVectorField,
     TrigramSimilarity,
 )
+from django.core.cache import cache
 from django.db.models import (
     Case,
     CharField,
@@ -14,13 +23,70 @@ from django.db.models import (
     FloatField,
     Func,
     Model,
+    PositiveSmallIntegerField,
+    Q,
     QuerySet,
+    TextField,
     Value,
     When,
 )
 from django.db.models.functions import Concat
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils.timezone import now
 
+AGE_BUCKETS = 16  # the oldest bucket starts 2**15 days ago
+SEARCH_GENERATION_KEY = 'search:generation'
+SEARCH_CACHE_KEY = 'search:{generation}:{digest}'
+SEARCH_CACHE_TIMEOUT = 10 * 60  # publication dates also change results
+
+
+def age_buckets(when: datetime, count: int = AGE_BUCKETS
+                ) -> List[Tuple[Optional[datetime], Optional[datetime], int]]:
+    """Publication time ranges as (newest, oldest, decay), newest first.
+    Each range is twice as long as the one before, so the decay is the same
+    as `LogAge`, rounded down to a whole number."""
+    buckets = []
+    newest = None  # type: Optional[datetime]
+    for k in range(1, count):
+        oldest = when - timedelta(days=2**k)
+        buckets.append((newest, oldest, max(1, k - 1)))
+        newest = oldest
+    buckets.append((newest, None, count - 1))
+    return buckets
+
+
+def age_decay(published: datetime, when: datetime = None) -> int:
+    """The `search_decay` of a publication time, see `age_buckets`"""
+    if when is None:
+        when = now()
+    for newest, oldest, decay in age_buckets(when):
+        if oldest is None or published >= oldest:
+            return decay
+
+
+def normalize_query(query: str) -> str:
+    """Queries that differ only in case, whitespace or how accented letters
+    are encoded give the same search results."""
+    return ' '.join(unicodedata.normalize('NFC', query).lower().split())
+
+
+def search_generation() -> int:
+    """Counter that is part of the key of all cached search results"""
+    generation = cache.get(SEARCH_GENERATION_KEY)
+    if generation is None:
+        cache.add(SEARCH_GENERATION_KEY, 0, timeout=None)
+        generation = cache.get(SEARCH_GENERATION_KEY, 0)
+    return generation
+
+
+def bump_search_generation():
+    """Invalidate all cached search results"""
+    try:
+        cache.incr(SEARCH_GENERATION_KEY)
+    except ValueError:  # key does not exist
+        cache.add(SEARCH_GENERATION_KEY, 1, timeout=None)
+
 
 class TrigramWordSimilarity(Func):
     output_field = FloatField()
@@ -32,6 +98,16 @@ class TrigramWordSimilarity(Func):
         super().__init__(string, expression, **extra)
 
 
+class TrigramWordSimilar(PostgresSimpleLookup):
+    """Word similarity above `pg_trgm.word_similarity_threshold`. Can use a
+    trigram index on the field."""
+    lookup_name = 'trigram_word_similar'
+    operator = '%%>'
+
+
+TextField.register_lookup(TrigramWordSimilar)
+
+
 class LogAge(Func):
     """Calculate log 2 of days since datetime column"""
     # Minimum age 1 day. Prevent log of zero error and unintended large
@@ -66,6 +142,21 @@ class LogAge(Func):
 class FullTextSearchQuerySet(QuerySet):
     """Queryset mixin for performing search and indexing for the Story model"""
     config = 'norwegian'
+    # changes to these fields change the search vector
+    vector_fields = [
+        'language',
+        'working_title',
+        'title',
+        'kicker',
+        'theme_word',
+        'lede',
+        'bodytext_markup',
+    ]
+    # changes to these fields change which rows are found, and their order
+    result_fields = [
+        'publication_status',
+        'publication_date',
+    ]
     case_config = Case(
         When(language='en', then=Value('english')), default=Value(config)
     )
@@ -87,22 +178,118 @@ class FullTextSearchQuerySet(QuerySet):
             config=case_config,
         )
     )
+    headline = Concat(
+        F('working_title'),
+        Value(' '),
+        F('kicker'),
+        Value(' '),
+        F('title'),
+        Value(' '),
+        F('lede'),
+        output_field=TextField(),
+    )
 
-    def search(self, query):
+    def search(self, query, limit=None):
+        """Search results, ranked by relevance and age. With a `limit`, only
+        the top results are returned, see `top_ranked`."""
         if not isinstance(query, str):
             msg = f'expected query to be str, got {type(query)}, {query!r}'
             raise ValueError(msg)
         result = None
         if len(query) > 5:
             result = self.search_vector_rank(query)
-        if not result:
+        if result is None or not result.exists():
             result = self.trigram_search_rank(query)
+        if limit is not None:
+            top = self.top_ranked(result, limit)
+            combined_rank = Case(
+                *[When(pk=pk, then=Value(score)) for score, pk in top],
+                output_field=FloatField(),
+            )
+            return self.filter(pk__in=[pk for score, pk in top]).annotate(
+                combined_rank=combined_rank
+            ).order_by('-combined_rank')
         return result.with_age('publication_date').annotate(
             combined_rank=ExpressionWrapper(
                 F('rank') / F('age'), FloatField()
             )
         ).order_by('-combined_rank')
 
+    def cached_search(
+        self, query, filters, field='pk', limit=None, order_by=None
+    ):
+        """List of `field` values of search results. The list is cached until
+        any search vector changes. `filters` is part of the cache key, and
+        must identify the rows in this queryset."""
+        query = normalize_query(query)
+        key = json.dumps(
+            [self.model._meta.label, query, filters, field, limit, order_by],
+            sort_keys=True,
+            default=str,
+        )
+        cache_key = SEARCH_CACHE_KEY.format(
+            generation=search_generation(),
+            digest=hashlib.md5(key.encode()).hexdigest(),
+        )
+        values = cache.get(cache_key)
+        if values is None:
+            result = self.search(query, limit=limit)
+            if order_by:
+                result = result.order_by(*order_by)
+            values = list(result.values_list(field, flat=True))
+            cache.set(cache_key, values, timeout=SEARCH_CACHE_TIMEOUT)
+        return values
+
+    def top_ranked(self, ranked, limit):
+        """Top `limit` rows of a queryset with a `rank` annotation, scored by
+        rank divided by age decay. Returns a list of (score, pk).
+
+        Instead of calculating the age and ranking all matches, the matches
+        are searched one publication time bucket at a time, newest first, and
+        each bucket query is limited. The bucket is the indexed column
+        `search_decay`, see `update_search_decay`. The rank is scaled to
+        below 1, so the search stops when no row in an older bucket can beat
+        the top rows.
+        """
+        if limit < 1:
+            return []
+        top = []  # type: List[Tuple[float, int]]
+        for decay in range(1, AGE_BUCKETS):
+            if len(top) == limit and top[0][0] >= 1 / decay:
+                break
+            bucket = ranked.filter(search_decay=decay)
+            rows = bucket.order_by('-rank').values_list('pk', 'rank')
+            for pk, rank in rows[:limit]:
+                score = rank / (1 + rank) / decay
+                if len(top) < limit:
+                    heapq.heappush(top, (score, pk))
+                elif score > top[0][0]:
+                    heapq.heapreplace(top, (score, pk))
+                else:
+                    break  # the rest of the bucket has lower rank
+        return sorted(top, reverse=True)
+
+    def update_search_decay(self, when=None):
+        """Store the publication time bucket of each row as `search_decay`.
+        Only rows that have moved to an older bucket are updated."""
+        if when is None:
+            when = now()
+        rows = 0
+        for newest, oldest, decay in age_buckets(when):
+            bucket = self.exclude(search_decay=decay)
+            if newest is not None:
+                bucket = bucket.filter(
+                    Q(publication_date__lt=newest)
+                    | Q(publication_date=None, created__lt=newest)
+                )
+            if oldest is not None:
+                bucket = bucket.filter(
+                    Q(publication_date__gte=oldest)
+                    | Q(publication_date=None, created__gte=oldest)
+                )
+            rows += bucket.update(search_decay=decay)
+        return rows
+
     def with_age(self, field='created', when=None):
         if when is None:
             when = now()
@@ -119,12 +306,11 @@ class FullTextSearchQuerySet(QuerySet):
         if cutoff is None:
             cutoff = 1 - min(5, len(query)) / 10
 
-        head = Concat(
-            F('working_title'), Value(' '), F('kicker'), Value(' '),
-            F('title'), Value(' '), F('lede')
-        )
-        ranker = TrigramWordSimilarity(head, query)
-        return self.annotate(rank=ranker).filter(rank__gt=cutoff)
+        # the trigram index finds candidates above the similarity threshold
+        # of the database connection, which is the lowest possible cutoff
+        ranker = TrigramWordSimilarity('search_headline', query)
+        return self.filter(search_headline__trigram_word_similar=query
+                           ).annotate(rank=ranker).filter(rank__gt=cutoff)
 
     def search_vector_rank(self, query, cutoff=0.2):
         """Perform postgresql full text search using search vector."""
@@ -134,8 +320,24 @@ class FullTextSearchQuerySet(QuerySet):
         return self.annotate(rank=ranker).filter(rank__gt=cutoff)
 
     def update_search_vector(self):
-        """Calculate and store search vector in the database."""
-        return self.update(search_vector=self.vector)
+        """Calculate and store search vector and headline in the database."""
+        rows = self.update(
+            search_vector=self.vector, search_headline=self.headline
+        )
+        bump_search_generation()
+        return rows
+
+    def update(self, **kwargs):
+        """Update rows, and their search vector if a search field changed"""
+        if not set(kwargs) & set(self.vector_fields):
+            rows = super().update(**kwargs)
+            if set(kwargs) & set(self.result_fields):
+                bump_search_generation()
+            return rows
+        pks = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        self.model._default_manager.filter(pk__in=pks).update_search_vector()
+        return rows
 
 
 class FullTextSearchMixin(Model):
@@ -144,6 +346,16 @@ class FullTextSearchMixin(Model):
         editable=False,
         null=True,
     )
+    search_headline = TextField(
+        editable=False,
+        blank=True,
+        default='',
+    )
+    search_decay = PositiveSmallIntegerField(
+        editable=False,
+        default=1,
+        db_index=True,
+    )
 
     class Meta:
         indexes = [
@@ -151,3 +363,70 @@ class FullTextSearchMixin(Model):
             GinIndex(fields=['search_vector']),
         ]
         abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.mark_search_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self.mark_search_values(fields)
+
+    def search_values(self):
+        """Loaded values of the fields of the search vector, and other fields
+        that change search results. Deferred fields are left out."""
+        queryset = self._default_manager.none()
+        fields = queryset.vector_fields + queryset.result_fields
+        return {
+            field: self.__dict__[field]
+            for field in fields if field in self.__dict__
+        }
+
+    def mark_search_values(self, fields=None):
+        """Remember current values of search fields as saved in the db"""
+        values = self.search_values()
+        if fields is not None:
+            values = {f: values[f] for f in fields if f in values}
+        loaded = getattr(self, '_search_values', {})
+        self._search_values = {**loaded, **values}
+
+    def changed_search_fields(self, fields=None):
+        """Fields of `search_values` that have changed since the instance was
+        loaded from or saved to the database"""
+        loaded = getattr(self, '_search_values', {})
+        current = self.search_values()
+        if fields is not None:
+            current = {f: current[f] for f in fields if f in current}
+        return {
+            field
+            for field, value in current.items()
+            if field not in loaded or loaded[field] != value
+        }
+
+    def save(self, *args, **kwargs):
+        """Save, and update the search vector if a search field has changed.
+        Cached search results are invalidated only if the search vector or
+        the publication status or date has changed. The search decay bucket
+        is set from the publication date."""
+        update_fields = kwargs.get('update_fields')
+        changed = self.changed_search_fields(update_fields)
+        published = self.publication_date or self.created or now()
+        self.search_decay = age_decay(published)
+        if update_fields:
+            kwargs['update_fields'] = {*update_fields, 'search_decay'}
+        super().save(*args, **kwargs)
+        queryset = self._default_manager.filter(pk=self.pk)
+        if changed & set(queryset.vector_fields):
+            queryset.update_search_vector()
+        elif changed:
+            bump_search_generation()
+        self.mark_search_values(update_fields)
+
+
+@receiver(post_delete)
+def search_row_deleted(sender, **kwargs):
+    """Deleted rows are removed from cached search results"""
+    if issubclass(sender, FullTextSearchMixin):
+        bump_search_generation()
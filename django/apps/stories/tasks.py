@@ -8,7 +8,7 @@ from celery.schedules import crontab
 from celery.task import periodic_task
 from celery.utils.log import get_task_logger
 from django.core.cache import cache
-from django.db.models import F, Q
+from django.db.models import F
 from django.utils import timezone
 
 from apps.issues.models import current_issue
@@ -19,22 +19,11 @@ from .models import Story
 logger = get_task_logger(__name__)
 
 # cron timing
-UPDATE_SEARCH = timedelta(hours=1)
 DEVALUE_HOTNESS = timedelta(hours=1)
+UPDATE_SEARCH_DECAY = timedelta(hours=1)
 PERSIST_STORY_VISITS = timedelta(minutes=10)
 
 
-@periodic_task(run_every=UPDATE_SEARCH, ignore_result=True)
-def update_search_task():
-    """Update database search index for newly modified stories."""
-    qs = Story.objects.filter(
-        Q(search_vector=None)
-        | Q(modified__gt=timezone.now() - UPDATE_SEARCH * 1.5)
-    )
-    qs.update_search_vector()
-    return qs.count()
-
-
 @periodic_task(run_every=crontab(hour=6, minute=0))
 def archive_stale_stories(days=14):
     """Archive prodsys content that has not been touched for a while."""
@@ -84,3 +73,11 @@ def devalue_hotness_task(chill_percentage=1):
     logger.info(f'decreasing hotness by {factor}%')
     Story.objects.devalue_hotness(factor)
     return chill_percentage
+
+
+@periodic_task(run_every=UPDATE_SEARCH_DECAY, ignore_result=True)
+def update_search_decay_task():
+    """Move stories to older publication time buckets for search ranking."""
+    count = Story.objects.update_search_decay()
+    logger.info(f'updated search decay of {count} stories')
+    return count
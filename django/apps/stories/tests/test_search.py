@@ -0,0 +1,150 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.postgres.search import SearchQuery
+from django.core.management import call_command
+from django.utils.timezone import now
+import pytest
+
+from apps.stories.models import Story
+from apps.stories.models.search_mixin import (
+    normalize_query,
+    search_generation,
+)
+
+
+def matches(word):
+    query = SearchQuery(word, config='norwegian')
+    return Story.objects.filter(search_vector=query).count()
+
+
+@pytest.mark.django_db
+def test_search_vector_on_save():
+    story = Story.objects.create(title='Story', lede='lorem ipsum')
+    assert matches('ipsum') == 1
+
+    Story.objects.filter(pk=story.pk).update(lede='dolor sit amet')
+    assert matches('ipsum') == 0
+    assert matches('dolor') == 1
+
+    story.refresh_from_db()
+    story.title = 'Overskrift'
+    story.save(update_fields=['title'])
+    assert matches('overskrift') == 1
+
+
+@pytest.mark.django_db
+def test_search_vector_unchanged_on_save():
+    """Saving without changes to search fields keeps cached results"""
+    Story.objects.create(title='Story', lede='lorem ipsum')
+    story = Story.objects.get()
+    generation = search_generation()
+    story.save()
+    story.save(update_fields=['lede'])
+    assert search_generation() == generation
+
+    story.lede = 'dolor sit amet'
+    story.save()
+    assert search_generation() > generation
+    assert matches('dolor') == 1
+
+    Story.objects.filter(pk=story.pk).update(lede='lorem ipsum')
+    story.refresh_from_db()
+    story.lede = 'dolor sit amet'
+    story.save()
+    assert matches('dolor') == 1
+
+
+@pytest.mark.django_db
+def test_update_search_vectors_command():
+    story = Story.objects.create(title='Story', lede='lorem ipsum')
+    Story.objects.filter(pk=story.pk).update(search_vector=None)
+    assert matches('ipsum') == 0
+    call_command('update_search_vectors', batch_size=1, stdout=StringIO())
+    assert matches('ipsum') == 1
+
+
+@pytest.mark.django_db
+def test_trigram_search():
+    story = Story.objects.create(title='Universitetet', lede='lorem ipsum')
+    assert Story.objects.trigram_search_rank('unive').count() == 1
+    assert Story.objects.trigram_search_rank('xyz').count() == 0
+
+    Story.objects.filter(pk=story.pk).update(title='Studentene')
+    assert Story.objects.trigram_search_rank('stud').count() == 1
+
+
+@pytest.mark.django_db
+def test_search_top_ranked():
+    today = now()
+    old, new, other = Story.objects.bulk_create([
+        Story(title='Studentene', publication_date=today - timedelta(999)),
+        Story(title='Studentene', publication_date=today - timedelta(1)),
+        Story(title='Andre', publication_date=today),
+    ])
+    Story.objects.update_search_vector()
+    assert Story.objects.update_search_decay() == 1
+    assert Story.objects.update_search_decay() == 0
+    old.refresh_from_db()
+    assert old.search_decay == 9  # 2**9 <= 999 days < 2**10
+    result = Story.objects.search('studentene', limit=10)
+    assert list(result) == [new, old]
+    assert list(Story.objects.search('studentene', limit=1)) == [new]
+    assert list(Story.objects.search('studentene', limit=0)) == []
+    ranked = Story.objects.search('studentene')
+    assert [pk for score, pk in Story.objects.top_ranked(ranked, 2)] == [
+        story.pk for story in ranked
+    ]
+
+
+@pytest.mark.django_db
+def test_search_generation_on_status_change_and_delete():
+    """Cached results are invalidated when stories are published or
+    deleted"""
+    Story.objects.create(title='Story', lede='lorem ipsum')
+    story = Story.objects.get()
+    generation = search_generation()
+    story.publication_status = Story.STATUS_JOURNALIST
+    story.save()
+    assert search_generation() > generation
+
+    generation = search_generation()
+    Story.objects.filter(pk=story.pk).update(
+        publication_status=Story.STATUS_DRAFT
+    )
+    assert search_generation() > generation
+
+    generation = search_generation()
+    story.delete()
+    assert search_generation() > generation
+
+
+@pytest.mark.django_db
+def test_search_decay_on_save():
+    story = Story.objects.create(
+        title='Studentene', publication_date=now() - timedelta(999)
+    )
+    assert story.search_decay == 9
+    story.publication_date = now()
+    story.save(update_fields=['publication_date'])
+    story.refresh_from_db()
+    assert story.search_decay == 1
+
+
+def test_normalize_query():
+    decomposed = 'Ga\u030ardsbruk  OG\tfjo\u0308s '
+    assert normalize_query(decomposed) == 'g\u00e5rdsbruk og fj\u00f6s'
+
+
+@pytest.mark.django_db
+def test_cached_search():
+    story = Story.objects.create(title='Studentene', lede='lorem ipsum')
+    stories = Story.objects.all()
+    assert stories.cached_search('Studentene ', filters=[]) == [story.pk]
+    assert stories.cached_search('Studentene', filters=['x']) == [story.pk]
+
+    other = Story.objects.create(title='Studentene')
+    assert len(stories.cached_search('studentene', filters=[])) == 2
+
+    Story.objects.filter(pk=other.pk).update(title='Andre')
+    assert stories.cached_search(' STUDENTENE', filters=[]) == [story.pk]
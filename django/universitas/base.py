@@ -1,6 +1,7 @@
 """ Django settings for universitas_no project. """
 
 from django.utils.translation import ugettext_lazy as _
+from kombu import Queue
 
 from .email_settings import *  # noqa
 from .file_settings import *  # noqa
@@ -81,6 +82,10 @@ REST_AUTH_SERIALIZERS = {
 
 # CELERY TASK RUNNER
 CELERY_TASK_DEFAULT_QUEUE = SITE_URL
+CELERY_TASK_QUEUES = [
+    Queue(CELERY_TASK_DEFAULT_QUEUE),
+    Queue(CELERY_TASK_DEFAULT_QUEUE + '.backlog'),  # bulk maintenance jobs
+]
 CELERY_ACCEPT_CONTENT = ['json', 'pickle']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
@@ -155,9 +160,24 @@ WSGI_APPLICATION = 'universitas.wsgi.application'
 ROOT_URLCONF = 'universitas.urls'
 
 # SORL
-THUMBNAIL_KVSTORE = 'sorl.thumbnail.kvstores.redis_kvstore.KVStore'
+THUMBNAIL_KVSTORE = 'apps.photo.kvstore.KVStore'
+THUMBNAIL_LOCAL_CACHE_SIZE = 2000  # kvstore entries cached in each process
+THUMBNAIL_LOCAL_CACHE_TTL = 300  # seconds
 THUMBNAIL_ENGINE = 'apps.photo.cropping.crop_engine.CloseCropEngine'
+# Pillow engine. Compare with `manage.py benchmark_thumbnail_engines`
+# THUMBNAIL_ENGINE = 'apps.photo.cropping.crop_engine.PillowCloseCropEngine'
 THUMBNAIL_QUALITY = 75
+# Memory for concurrent image rendering on each host, see photo/governor.py
+IMAGE_RENDER_MEMORY = 512 * 2**20  # bytes
+IMAGE_RENDER_SLOTS = 8
+IMAGE_RENDER_TIMEOUT = 20  # seconds to wait for free memory
+IMAGE_RENDER_LOCK_DIR = '/var/staging/render/'  # shared by all containers
+# Search jpeg and webp quality per thumbnail. `None` to always use the above.
+THUMBNAIL_TARGET_SSIM = 0.95
+# Responsive image ladder. AVIF is skipped if the engine cannot write it.
+THUMBNAIL_SRCSET_WIDTHS = [400, 800, 1200, 1600]
+THUMBNAIL_SRCSET_FORMATS = ['AVIF', 'WEBP', 'JPEG']
+THUMBNAIL_SRCSET_QUALITY = {'AVIF': 50, 'WEBP': 70, 'JPEG': 75}
 # Use temporary file upload handler to do some queued local operations before
 # saving files to the remote server.
 FILE_UPLOAD_HANDLERS = [
@@ -188,6 +208,10 @@ DATABASES = {
         'PASSWORD': env.pg_password or 'postgres',
         'HOST': env.pg_host or 'postgres',
         'PORT': env.pg_port or '',  # Set to empty string for default.
+        'OPTIONS': {
+            # lowest cutoff of `FullTextSearchQuerySet.trigram_search_rank`
+            'options': '-c pg_trgm.word_similarity_threshold=0.5',
+        },
     }
 }
 # CACHE
@@ -30,11 +30,17 @@ if env.digitalocean_enabled:
     MEDIA_URL = f'https://{AWS_STORAGE_BUCKET_NAME}/media/'
     STATICFILES_STORAGE =\
         'django.contrib.staticfiles.storage.StaticFilesStorage'
-    DEFAULT_FILE_STORAGE = 'utils.aws_custom_storage.MediaStorage'
+    DEFAULT_FILE_STORAGE = 'utils.aws_custom_storage.CachedMediaStorage'
+    MEDIA_CACHE_DIR = env.MEDIA_CACHE_DIR or '/var/cache/media/'
+    MEDIA_CACHE_SIZE = 2 * 2**30  # bytes
     THUMBNAIL_STORAGE = 'utils.aws_custom_storage.ThumbStorage'
+    # missing thumbnails are not routed to `views.thumbnail_fallback` by the
+    # cdn, so thumbnail urls are only used after the thumbnail is built.
+    THUMBNAIL_FALLBACK_VIEW = False
 else:
     # Defaults for development and testing
     DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
     STATICFILES_STORAGE =\
         'django.contrib.staticfiles.storage.StaticFilesStorage'
     THUMBNAIL_STORAGE = 'utils.local_file_storage.OverwriteStorage'
+    THUMBNAIL_FALLBACK_VIEW = True
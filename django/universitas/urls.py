@@ -10,6 +10,7 @@ from django.views.generic.base import RedirectView
 
 from api.urls import urlpatterns as api_urls
 from apps.core.views import HumansTxtView, RobotsTxtView, react_frontpage_view
+from apps.photo.views import thumbnail_fallback
 from apps.stories.feeds import LatestStories
 
 admin.autodiscover()
@@ -29,6 +30,12 @@ urlpatterns = [
     re_path(r'^.*?([\w\-]+\.(?:png|ico))$', favicon_redirect),
     # API
     re_path(r'^api/', include(api_urls)),
+    # Missing thumbnails, when media files are served by nginx
+    re_path(
+        r'^media/(?P<path>{}.+)$'.format(settings.THUMBNAIL_PREFIX),
+        thumbnail_fallback,
+        name='thumbnail_fallback',
+    ),
     # React apps
     re_path(
         r'^adsense-fallback/$',
@@ -1,6 +1,18 @@
 """Custom overrides for the Amazon storage"""
+import hashlib
+import logging
+import os
+from pathlib import Path
+import tempfile
+import time
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+from django.core.files import File
 from storages.backends.s3boto3 import S3Boto3Storage
 
+logger = logging.getLogger(__name__)
+
 
 class CustomS3BotoStorage(S3Boto3Storage):
     cache_max_age = 0
@@ -32,3 +44,130 @@ class ThumbStorage(CustomS3BotoStorage):
 
     cache_max_age = 60 * 60 * 24 * 10000
     location = 'media'
+
+
+class LocalCacheMixin:
+    """Keep downloaded files in a size bounded local disk cache.
+
+    Cached files are named by the object's ETag, so a file is only reused
+    while the remote object is unchanged. The least recently used files are
+    evicted when the cache grows larger than `MEDIA_CACHE_SIZE` bytes.
+    """
+
+    scan_interval = 60 * 5  # seconds between scans of the cache directory
+    low_water = 0.9  # fraction of the cache size that is kept when evicting
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_dir = Path(
+            getattr(settings, 'MEDIA_CACHE_DIR', None)
+            or Path(tempfile.gettempdir()) / 'media_cache'
+        )
+        self.cache_size = getattr(settings, 'MEDIA_CACHE_SIZE', 2 * 2**30)
+        self._cache_total = 0  # bytes, updated by downloads in this process
+        self._scanned = None  # time of the last scan
+
+    def _cache_prefix(self, name):
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        return self.cache_dir / digest[:2] / digest
+
+    def _open(self, name, mode='rb'):
+        if mode != 'rb':
+            return super()._open(name, mode)
+        try:
+            path = self._cached_path(name)
+        except (BotoCoreError, ClientError, OSError):
+            logger.exception(f'cannot cache {name}')
+            return super()._open(name, mode)
+        path.touch()  # mark as recently used
+        return File(path.open('rb'), name)
+
+    def _cached_path(self, name):
+        """Local copy of file, downloaded if missing or changed"""
+        key = self._encode_name(self._normalize_name(self._clean_name(name)))
+        obj = self.bucket.Object(key)
+        prefix = self._cache_prefix(name)
+        etag = obj.e_tag.strip('"')
+        path = prefix.with_name(f'{prefix.name}-{etag}')
+        if path.exists():
+            return path
+        self._forget(name)  # older versions
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                obj.download_fileobj(fp)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._cache_total += path.stat().st_size
+        self._evict()
+        return path
+
+    def _forget(self, name):
+        """Remove cached copies of file"""
+        prefix = self._cache_prefix(name)
+        for path in prefix.parent.glob(f'{prefix.name}-*'):
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            self._cache_total -= size
+
+    def _scan(self):
+        """Cached files as `(mtime, size, path)` tuples"""
+        files = []
+        for path in self.cache_dir.glob('*/*'):
+            if path.suffix == '.tmp':  # download in progress
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _evict(self):
+        """Remove least recently used files if the cache is too large.
+
+        The total size is tracked as files are downloaded, so the cache
+        directory is only scanned when the total grows past the cache size.
+        Other processes share the cache, so it is also scanned every
+        `scan_interval` seconds. Eviction stops at `low_water` of the cache
+        size, so the next downloads do not cause another scan right away.
+        """
+        now = time.monotonic()
+        stale = (
+            self._scanned is None or now - self._scanned > self.scan_interval
+        )
+        if self._cache_total <= self.cache_size and not stale:
+            return
+        self._scanned = now
+        files = self._scan()
+        total = sum(size for _, size, _ in files)
+        if total > self.cache_size:
+            for _, size, path in sorted(files):
+                if total <= self.cache_size * self.low_water:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self._cache_total = total
+
+    def _save(self, name, content):
+        self._forget(name)
+        return super()._save(name, content)
+
+    def delete(self, name):
+        self._forget(name)
+        return super().delete(name)
+
+
+class CachedMediaStorage(LocalCacheMixin, MediaStorage):
+    """Media storage with local disk cache, for workers that read the same
+    original files several times."""
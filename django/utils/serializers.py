@@ -1,9 +1,13 @@
 import json
 import re
 
+from django.conf import settings
+from django.db import models
 from rest_framework import exceptions, serializers
+from rest_framework.fields import SkipField
 
 from apps.photo.cropping.boundingbox import CropBox
+from apps.photo.thumbimage import prefetch_thumbnails
 
 
 def validate_phone_number(num):
@@ -48,6 +52,95 @@ class AbsoluteURLField(serializers.Field):
         return str(value)
 
 
+def thumbnail_lookups(serializer, instances):
+    """`(image, filenames)` pairs of thumbnails to look up before the
+    instances are serialized, from fields with a `thumbnail_lookup` method
+    in the serializer and its nested serializers."""
+    for field in serializer.fields.values():
+        lookup = getattr(field, 'thumbnail_lookup', None)
+        if lookup is None and not isinstance(field, serializers.Serializer):
+            continue
+        values = []
+        for instance in instances:
+            try:
+                values.append(field.get_attribute(instance))
+            except (AttributeError, KeyError, SkipField):
+                continue
+        if lookup is None:
+            yield from thumbnail_lookups(field, [v for v in values if v])
+            continue
+        for value in values:
+            found = lookup(value)
+            if found:
+                yield found
+
+
+class ThumbnailListSerializer(serializers.ListSerializer):
+    """Looks up the thumbnails of all items with a single key value store
+    request before they are serialized, instead of one request per item."""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        prefetch_thumbnails(thumbnail_lookups(self.child, items))
+        return super().to_representation(items)
+
+
+class ThumbnailURLField(AbsoluteURLField):
+    """Url of a named ImageFile thumbnail. Without `THUMBNAIL_FALLBACK_VIEW`
+    the thumbnail must be found in the key value store, see
+    `ThumbnailListSerializer`."""
+
+    def __init__(self, thumbnail, **kwargs):
+        self.thumbnail = thumbnail
+        kwargs = {'source': '*', **kwargs}
+        super().__init__(**kwargs)
+
+    def thumbnail_lookup(self, value):
+        if settings.THUMBNAIL_FALLBACK_VIEW or not (value and value.original):
+            return None
+        return value, [value.thumbnail_name(self.thumbnail)]
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return super().to_representation(value.thumbnail_url(self.thumbnail))
+
+
+class SrcsetField(AbsoluteURLField):
+    """Responsive ImageFile thumbnails as a list of `{type, srcset}` sources,
+    ready for `<picture>` and `<source>` elements. Thumbnails are cropped to
+    the size in the attribute `crop_size` of the instance, if given. Use with
+    `ThumbnailListSerializer`, since only existing thumbnails are included."""
+
+    def __init__(self, crop_size=None, **kwargs):
+        self.crop_size = crop_size
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        imagefile = super().get_attribute(instance)
+        if imagefile and self.crop_size:
+            return imagefile, getattr(instance, self.crop_size)
+        return imagefile, None
+
+    def thumbnail_lookup(self, value):
+        imagefile, crop_size = value
+        if not (imagefile and imagefile.original):
+            return None
+        return imagefile, imagefile.srcset_names(crop_size)
+
+    def to_representation(self, value):
+        imagefile, crop_size = value
+        if not imagefile:
+            return []
+        absolute_url = super().to_representation
+        return [{
+            'type': mimetype,
+            'srcset': ', '.join(
+                f'{absolute_url(url)} {width}w' for url, width in sources
+            ),
+        } for mimetype, sources in imagefile.srcset(crop_size)]
+
+
 class CropBoxField(serializers.Field):
     def to_representation(self, obj):
         return jsonDict(obj.serialize())
@@ -0,0 +1,133 @@
+import hashlib
+from io import BytesIO
+import os
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+import pytest
+
+from utils.aws_custom_storage import LocalCacheMixin
+
+
+class FakeObject:
+    """Stands in for a boto3 s3 Object"""
+
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+
+    @property
+    def e_tag(self):
+        return '"{}"'.format(
+            hashlib.md5(self.bucket.files[self.key]).hexdigest()
+        )
+
+    def download_fileobj(self, fp):
+        self.bucket.downloads.append(self.key)
+        data = self.bucket.files[self.key]
+        fp.write(data[:len(data) // 2])
+        if self.bucket.broken:
+            raise OSError('connection lost')
+        fp.write(data[len(data) // 2:])
+
+
+class FakeBucket:
+    def __init__(self):
+        self.files = {}
+        self.downloads = []
+        self.broken = False
+
+    def Object(self, key):
+        return FakeObject(self, key)
+
+
+class FakeRemoteStorage:
+    """Stands in for S3Boto3Storage"""
+
+    def __init__(self):
+        self.bucket = FakeBucket()
+
+    def _clean_name(self, name):
+        return name
+
+    _normalize_name = _encode_name = _clean_name
+
+    def _open(self, name, mode='rb'):
+        return File(BytesIO(self.bucket.files[name]), name)
+
+    def _save(self, name, content):
+        self.bucket.files[name] = content.read()
+        return name
+
+    def delete(self, name):
+        self.bucket.files.pop(name, None)
+
+
+class CachedFakeStorage(LocalCacheMixin, FakeRemoteStorage):
+    pass
+
+
+@pytest.fixture
+def storage(settings, tmp_path):
+    settings.MEDIA_CACHE_DIR = str(tmp_path)
+    settings.MEDIA_CACHE_SIZE = 1000
+    return CachedFakeStorage()
+
+
+def cached_files(storage, name=None):
+    if name is None:
+        return sorted(storage.cache_dir.glob('*/*'))
+    prefix = storage._cache_prefix(name)
+    return sorted(prefix.parent.glob(f'{prefix.name}-*'))
+
+
+def read(storage, name):
+    with storage._open(name) as fp:
+        return fp.read()
+
+
+def test_etag_revalidation(storage):
+    """Cached files are reused until the remote object changes"""
+    storage._save('a.jpg', ContentFile(b'one'))
+    assert read(storage, 'a.jpg') == b'one'
+    assert read(storage, 'a.jpg') == b'one'
+    assert storage.bucket.downloads == ['a.jpg']
+    storage.bucket.files['a.jpg'] = b'two'  # changed by another process
+    assert read(storage, 'a.jpg') == b'two'
+    assert storage.bucket.downloads == ['a.jpg', 'a.jpg']
+    assert len(cached_files(storage)) == 1  # the old version is removed
+    storage.delete('a.jpg')
+    assert cached_files(storage) == []
+
+
+def test_atomic_download(storage):
+    """A failed download leaves no partial file in the cache"""
+    storage._save('a.jpg', ContentFile(b'0123456789'))
+    storage.bucket.broken = True
+    assert read(storage, 'a.jpg') == b'0123456789'  # read from remote
+    assert cached_files(storage) == []
+    storage.bucket.broken = False
+    assert read(storage, 'a.jpg') == b'0123456789'
+    path, = cached_files(storage)
+    assert path.read_bytes() == b'0123456789'
+
+
+def test_size_capped_eviction(storage, monkeypatch):
+    """Least recently used files are evicted when the cache is too large,
+    and the cache directory is not scanned on every download"""
+    scans = []
+    scan = storage._scan
+    monkeypatch.setattr(storage, '_scan', lambda: scans.append(1) or scan())
+    for mtime, name in enumerate(['a.jpg', 'b.jpg', 'c.jpg']):
+        storage._save(name, ContentFile(bytes(300)))
+        read(storage, name)
+        path, = cached_files(storage, name)
+        os.utime(path, (mtime, mtime))
+    assert len(cached_files(storage)) == 3  # 900 bytes
+    assert len(scans) == 1  # first download only
+    storage._save('d.jpg', ContentFile(bytes(300)))
+    read(storage, 'd.jpg')  # 1200 bytes
+    assert len(scans) == 2
+    assert cached_files(storage, 'a.jpg') == []  # least recently used
+    assert len(cached_files(storage)) == 3
+    assert storage._cache_total == 900